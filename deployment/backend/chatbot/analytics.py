@@ -0,0 +1,341 @@
+# analytics.py
+# Incrementally maintained rollups for the admin dashboard.
+#
+# Every committed turn (including questions the widget answered from its FAQ
+# bundle, which /faq/lookup saves as turns) and every failed request is folded
+# into in-memory deltas, which are flushed every few seconds as counter
+# increments on small rollup documents. Dashboard reads then touch only the rollups for the
+# requested range, never chat_history.
+#
+# Layout (Firestore):
+#   analytics_hourly/{YYYYMMDDHH}                   counters for one UTC hour
+#   analytics_daily/{YYYYMMDD}                      counters for one UTC day
+#   analytics_daily/{YYYYMMDD}/questions/{hash}     per normalized question
+#   analytics_batches/{id}                          marker of an applied batch
+#
+# A flush is split into batches of at most 499 rollup writes, each committed
+# together with the create of its marker document. A batch whose marker
+# already exists was applied by an earlier attempt, so retrying a flush never
+# counts a batch twice. Markers carry `expire_at` for a Firestore TTL policy.
+#
+# Counters: queries, cache_hits, low_confidence, errors, busy, latency_ms_sum,
+# answer_chars_sum. Averages are derived on read. Question documents also keep
+# the latest confident answer, and separately the latest confident answer to
+# the question asked as the first turn of a session (`first_answer`, with a
+# `first_turns` count). faq_snapshot.py builds the FAQ bundle from the latter:
+# an answer to a follow-up depends on the earlier turns and cannot be served
+# on its own.
+
+import uuid
+import asyncio
+import hashlib
+import datetime
+from answer_cache import normalize_prompt
+
+HOURLY = "analytics_hourly"
+DAILY = "analytics_daily"
+QUESTIONS = "questions"
+BATCHES = "analytics_batches"
+MAX_BATCH_WRITES = 499  # plus the marker: Firestore allows 500 writes per commit
+MARKER_TTL = datetime.timedelta(days=7)
+COUNTERS = ("queries", "cache_hits", "low_confidence", "errors", "busy", "latency_ms_sum", "answer_chars_sum")
+MAX_QUESTION_CHARS = 200
+
+
+def hour_key(ts):
+    return ts.strftime("%Y%m%d%H")
+
+
+def day_key(ts):
+    return ts.strftime("%Y%m%d")
+
+
+def question_id(normalized):
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def with_averages(bucket):
+    """Adds avg_latency_ms and avg_answer_chars to a rollup dict."""
+    queries = bucket.get("queries", 0)
+    bucket["avg_latency_ms"] = round(bucket.get("latency_ms_sum", 0) / queries, 1) if queries else 0.0
+    bucket["avg_answer_chars"] = round(bucket.get("answer_chars_sum", 0) / queries, 1) if queries else 0.0
+    return bucket
+
+
+class RollupDelta:
+    """Counter increments not yet written, keyed by bucket."""
+
+    def __init__(self):
+        self.hours = {}      # hour_key -> {counter: n}
+        self.days = {}       # day_key -> {counter: n}
+        self.questions = {}  # (day_key, question_id) -> {"text", "count", "first_turns", "low_confidence",
+        #                                                  "last_seen", "answer"?, "first_answer"?}
+
+    def __len__(self):
+        return len(self.hours) + len(self.days) + len(self.questions)
+
+    def bump(self, ts, **counters):
+        for bucket in (self.hours.setdefault(hour_key(ts), {}), self.days.setdefault(day_key(ts), {})):
+            for name, amount in counters.items():
+                bucket[name] = bucket.get(name, 0) + amount
+
+    def add_turn(self, message, first_turn=False):
+        """Folds one persisted turn (a session page message) into the delta.
+
+        `first_turn` is True for the first turn of a session, the only one
+        whose answer does not depend on earlier turns.
+        """
+        ts = message["timestamp"]
+        low_confidence = 1 if message.get("low_confidence") else 0
+        self.bump(
+            ts, queries=1, low_confidence=low_confidence,
+            cache_hits=1 if message.get("outcome") in ("cache_hit", "faq") else 0,
+            latency_ms_sum=message.get("latency_ms", 0),
+            answer_chars_sum=len(message.get("bot_response", "")),
+        )
+        # A local FAQ answer is counted under the FAQ entry's question
+        question = message.get("faq_question") or message.get("user_prompt", "")
+        normalized = normalize_prompt(question)[:MAX_QUESTION_CHARS]
+        if normalized:
+            entry = self.questions.setdefault(
+                (day_key(ts), question_id(normalized)),
+                {"text": normalized, "count": 0, "first_turns": 0, "low_confidence": 0, "last_seen": ts},
+            )
+            entry["count"] += 1
+            entry["first_turns"] += 1 if first_turn else 0
+            entry["low_confidence"] += low_confidence
+            entry["last_seen"] = max(entry["last_seen"], ts)
+            if not low_confidence and message.get("outcome") in ("ok", "cache_hit", "faq") and message.get("bot_response"):
+                entry["answer"] = message["bot_response"]
+                if first_turn:
+                    entry["first_answer"] = message["bot_response"]
+
+    def split(self, max_writes=MAX_BATCH_WRITES):
+        """Splits the delta into deltas of at most `max_writes` buckets (one write each)."""
+        chunks, current = [], RollupDelta()
+        for table in ("hours", "days", "questions"):
+            for key, value in getattr(self, table).items():
+                if len(current) >= max_writes:
+                    chunks.append(current)
+                    current = RollupDelta()
+                getattr(current, table)[key] = value
+        if len(current):
+            chunks.append(current)
+        return chunks
+
+
+# --- Stores ---
+class FirestoreAnalyticsStore:
+    def __init__(self, db):
+        self.db = db
+
+    async def apply(self, delta, batch_id):
+        """Writes a delta (see RollupDelta.split) as Increment()s in one commit,
+        unless batch `batch_id` was already applied."""
+        from firebase_admin import firestore
+        from google.api_core.exceptions import AlreadyExists
+        writes = []
+        for key, counters in delta.hours.items():
+            ref = self.db.collection(HOURLY).document(key)
+            writes.append((ref, {"hour": key, **{n: firestore.Increment(v) for n, v in counters.items()}}))
+        for key, counters in delta.days.items():
+            ref = self.db.collection(DAILY).document(key)
+            writes.append((ref, {"day": key, **{n: firestore.Increment(v) for n, v in counters.items()}}))
+        for (day, qid), entry in delta.questions.items():
+            ref = self.db.collection(DAILY).document(day).collection(QUESTIONS).document(qid)
+            data = {
+                "text": entry["text"],
+                "count": firestore.Increment(entry["count"]),
+                "first_turns": firestore.Increment(entry["first_turns"]),
+                "low_confidence": firestore.Increment(entry["low_confidence"]),
+                "last_seen": entry["last_seen"],
+            }
+            for field in ("answer", "first_answer"):
+                if entry.get(field):
+                    data[field] = entry[field]
+            writes.append((ref, data))
+        if len(writes) > MAX_BATCH_WRITES:
+            raise ValueError(f"{len(writes)} writes in one analytics batch; split the delta first")
+        batch = self.db.batch()
+        for ref, data in writes:
+            batch.set(ref, data, merge=True)
+        now = datetime.datetime.utcnow()
+        batch.create(self.db.collection(BATCHES).document(batch_id), {"applied_at": now, "expire_at": now + MARKER_TTL})
+        try:
+            await batch.commit()
+        except AlreadyExists:
+            pass  # committed by an earlier attempt whose response was lost
+
+    async def _range(self, collection, field, start, end, limit, cursor=None):
+        query = self.db.collection(collection).where(field, ">=", start).where(field, "<", end)
+        if cursor:
+            query = query.where(field, ">", cursor)
+        return [doc.to_dict() async for doc in query.order_by(field).limit(limit).stream()]
+
+    async def hours(self, start, end, limit, cursor=None):
+        return await self._range(HOURLY, "hour", start, end, limit, cursor)
+
+    async def days(self, start, end, limit, cursor=None):
+        return await self._range(DAILY, "day", start, end, limit, cursor)
+
+    async def top_questions(self, day, order, limit, cursor=None):
+        from google.cloud.firestore_v1 import Query
+        questions = self.db.collection(DAILY).document(day).collection(QUESTIONS)
+        query = questions.order_by(order, direction=Query.DESCENDING)
+        if cursor:
+            # One extra read to resume after the last question of the previous page
+            last = await questions.document(cursor).get()
+            if last.exists:
+                query = query.start_after(last)
+        return [{"id": doc.id, **doc.to_dict()} async for doc in query.limit(limit).stream()]
+
+
+class InMemoryAnalyticsStore:
+    """Same interface as FirestoreAnalyticsStore, for offline runs."""
+
+    def __init__(self):
+        self.hourly = {}
+        self.daily = {}
+        self.questions = {}  # day -> {question_id: entry}
+        self.batches = set()
+
+    async def apply(self, delta, batch_id):
+        if batch_id in self.batches:
+            return
+        self.batches.add(batch_id)
+        for table, field, source in ((self.hourly, "hour", delta.hours), (self.daily, "day", delta.days)):
+            for key, counters in source.items():
+                bucket = table.setdefault(key, {field: key})
+                for name, amount in counters.items():
+                    bucket[name] = bucket.get(name, 0) + amount
+        for (day, qid), entry in delta.questions.items():
+            current = self.questions.setdefault(day, {}).setdefault(
+                qid, {"text": entry["text"], "count": 0, "first_turns": 0, "low_confidence": 0,
+                      "last_seen": entry["last_seen"]}
+            )
+            current["count"] += entry["count"]
+            current["first_turns"] += entry["first_turns"]
+            current["low_confidence"] += entry["low_confidence"]
+            current["last_seen"] = max(current["last_seen"], entry["last_seen"])
+            for field in ("answer", "first_answer"):
+                if entry.get(field):
+                    current[field] = entry[field]
+
+    @staticmethod
+    def _range(table, start, end, limit, cursor):
+        keys = sorted(k for k in table if start <= k < end and (cursor is None or k > cursor))
+        return [dict(table[k]) for k in keys[:limit]]
+
+    async def hours(self, start, end, limit, cursor=None):
+        return self._range(self.hourly, start, end, limit, cursor)
+
+    async def days(self, start, end, limit, cursor=None):
+        return self._range(self.daily, start, end, limit, cursor)
+
+    async def top_questions(self, day, order, limit, cursor=None):
+        entries = sorted(self.questions.get(day, {}).items(), key=lambda kv: (kv[1][order], kv[0]), reverse=True)
+        if cursor:
+            ids = [qid for qid, _ in entries]
+            entries = entries[ids.index(cursor) + 1:] if cursor in ids else []
+        return [{"id": qid, **entry} for qid, entry in entries[:limit]]
+
+
+# --- Rollup writer ---
+class AnalyticsRollup:
+    """Accumulates deltas and flushes them every `flush_interval` seconds."""
+
+    def __init__(self, store, flush_interval=10.0, max_pending_questions=20000):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_pending_questions = max_pending_questions
+        self._delta = RollupDelta()
+        self._unsent = []  # (batch id, delta) taken from _delta, not yet applied
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+        self.turns = 0
+        self.outcomes = 0
+        self.faq_hits = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped_questions = 0
+
+    def add_turns(self, turns):
+        """Called with each committed batch of persistence.PendingTurn."""
+        for turn in turns:
+            self._delta.add_turn(turn.message, first_turn=turn.turn_index == 0)
+            if turn.message.get("outcome") == "faq":
+                self.faq_hits += 1
+        self.turns += len(turns)
+        self._trim()
+        self._start()
+
+    def add_outcome(self, outcome, ts=None):
+        """Counts a request that produced no persisted turn ("error" or "busy")."""
+        self._delta.bump(ts or datetime.datetime.utcnow(), **{"errors" if outcome == "error" else "busy": 1})
+        self.outcomes += 1
+        self._start()
+
+    def _trim(self):
+        # While the database is unreachable, keep counters but cap per-question entries
+        while len(self._delta.questions) > self.max_pending_questions:
+            self._delta.questions.pop(next(iter(self._delta.questions)))
+            self.dropped_questions += 1
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                self.failures += 1
+                print(f"Analytics flush error: {e}")
+
+    async def flush(self):
+        """Applies pending increments batch by batch.
+
+        A batch keeps its id until it is applied, so a retry after an
+        ambiguous failure is deduplicated by the store. New increments wait in
+        `_delta` until every earlier batch is through. Flushes are serialized,
+        so the periodic task and stop() never apply the same batch twice.
+        """
+        async with self._flush_lock:
+            while True:
+                if not self._unsent:
+                    if not len(self._delta):
+                        return
+                    self._unsent = [(uuid.uuid4().hex, chunk) for chunk in self._delta.split()]
+                    self._delta = RollupDelta()
+                entry = self._unsent[0]
+                try:
+                    await self.store.apply(entry[1], entry[0])
+                except Exception as e:
+                    self.failures += 1
+                    print(f"Analytics flush failed, will retry: {e}")
+                    return
+                # Remove the batch that was applied, not whatever is first now
+                self._unsent = [u for u in self._unsent if u is not entry]
+                self.flushes += 1
+
+    async def stop(self):
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "turns": self.turns,
+            "outcomes": self.outcomes,
+            "faq_hits": self.faq_hits,
+            "pending_buckets": len(self._delta) + sum(len(chunk) for _, chunk in self._unsent),
+            "unsent_batches": len(self._unsent),
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "dropped_questions": self.dropped_questions,
+        }
@@ -0,0 +1,142 @@
+# answer_cache.py
+# Cache of generated answers for repeated questions (fee deadlines, scholarship
+# forms, timetable changes), checked before a Gemini generation.
+#
+# Layer 1: exact match on the normalized prompt.
+# Layer 2 (optional): near-duplicate match on character trigram overlap, which
+#          works the same for English, Hindi and other regional scripts.
+
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_prompt(text):
+    """Case-folds, NFKC-normalizes, drops punctuation and collapses whitespace.
+
+    Combining marks (matras, viramas) are kept, so Devanagari and other Indic
+    words stay intact; only Unicode punctuation is removed.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return " ".join(text.split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def iter_chunks(text, size=64):
+    """Splits a cached answer into stream chunks on whitespace boundaries."""
+    start = 0
+    while start < len(text):
+        end = start + size
+        if end < len(text):
+            space = text.rfind(" ", start, end)
+            if space > start:
+                end = space + 1
+        yield text[start:end]
+        start = end
+
+
+class AnswerCache:
+    """Size-bounded LRU + TTL cache of answers keyed by normalized prompt."""
+
+    def __init__(self, max_entries=2000, ttl_seconds=6 * 3600, near_duplicates=False,
+                 similarity_threshold=0.85):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.near_duplicates = near_duplicates
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # key -> [answer, expires_at, generation_seconds, grams]
+        self._gram_index = {}          # trigram -> set of keys (near-duplicate layer)
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.latency_saved_seconds = 0.0
+
+    def lookup(self, prompt):
+        """Returns the cached answer for `prompt`, or None."""
+        key = normalize_prompt(prompt)
+        entry = self._live_entry(key)
+        if entry is not None:
+            self.exact_hits += 1
+        elif self.near_duplicates:
+            key = self._nearest(key)
+            entry = self._live_entry(key) if key else None
+            if entry is not None:
+                self.near_hits += 1
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.latency_saved_seconds += entry[2]
+        return entry[0]
+
+    def store(self, prompt, answer, generation_seconds=0.0):
+        key = normalize_prompt(prompt)
+        if not key or not answer:
+            return
+        self._remove(key)
+        grams = trigrams(key) if self.near_duplicates else None
+        self._entries[key] = [answer, time.monotonic() + self.ttl_seconds, generation_seconds, grams]
+        if grams:
+            for gram in grams:
+                self._gram_index.setdefault(gram, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, prompt):
+        self._remove(normalize_prompt(prompt))
+
+    def invalidate_all(self):
+        """Hook for knowledge base changes: every cached answer may be stale."""
+        self._entries.clear()
+        self._gram_index.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        hits = self.exact_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "latency_saved_seconds": round(self.latency_saved_seconds, 3),
+        }
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] < time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def _nearest(self, key):
+        grams = trigrams(key)
+        overlap = {}
+        for gram in grams:
+            for candidate in self._gram_index.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+        best, best_score = None, 0.0
+        for candidate, shared in overlap.items():
+            union = len(grams) + len(self._entries[candidate][3]) - shared
+            score = shared / union
+            if score > best_score:
+                best, best_score = candidate, score
+        return best if best_score >= self.similarity_threshold else None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[3]:
+            for gram in entry[3]:
+                keys = self._gram_index.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._gram_index[gram]
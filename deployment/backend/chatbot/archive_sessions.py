@@ -0,0 +1,127 @@
+# archive_sessions.py
+# Moves sessions idle for longer than --older-than-days out of `chat_history`
+# into compressed columnar archive files (see session_archive.py), then
+# deletes them from Firestore or leaves a stub header (--stub).
+#
+# Usage (run daily from cron or any scheduler):
+#   python archive_sessions.py --out archive/ --older-than-days 90 --dry-run
+#   python archive_sessions.py --out archive/ --older-than-days 90
+#   python archive_sessions.py --out archive/ --older-than-days 30 --stub
+#
+# Legacy sessions (one `messages` array, no `updated_at`) are migrated to the
+# paged layout first, which dates them by their last message, so they are
+# archived in the same run when idle.
+#
+# Sessions are streamed oldest first, page by page, so only one row group per
+# open file and the ids of the sessions in the current file are in memory.
+# Sessions are removed from Firestore only after the file holding them is
+# fsynced and renamed into place. A session written to while it is being
+# archived stays in Firestore and is archived again on a later run, so the
+# same (session_id, turn_index) can appear in two archive files.
+
+import os
+import json
+import asyncio
+import argparse
+import datetime
+from session_archive import (
+    ArchiveWriter, SESSION_COLUMNS, TURN_COLUMNS, partition_dir, session_row, turn_row,
+)
+
+
+class PartitionFiles:
+    """Open sessions/turns files of one date partition and the sessions they hold."""
+
+    def __init__(self, root, day, name, row_group_rows):
+        self.day = day
+        folder = partition_dir(root, day)
+        self.path = os.path.join(folder, f"turns-{name}.ssa")
+        self.sessions = ArchiveWriter(os.path.join(folder, f"sessions-{name}.ssa"), SESSION_COLUMNS, row_group_rows)
+        self.turns = ArchiveWriter(self.path, TURN_COLUMNS, row_group_rows)
+        self.pending = []  # (session_id, slim header, version) to expire once the files are closed
+
+    def close(self, meta):
+        self.turns.close(meta)
+        self.sessions.close(meta)
+
+    def abort(self):
+        self.turns.abort()
+        self.sessions.abort()
+
+
+async def archive(store, root, before, stub=False, dry_run=False, limit=None,
+                  max_file_rows=200_000, row_group_rows=5000, run_id=None):
+    run_id = run_id or datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    result = {"sessions": 0, "turns": 0, "files": 0, "bytes": 0, "expired": 0, "kept": 0,
+              "legacy_migrated": 0, "dry_run": dry_run}
+    files = None
+    seq = 0
+
+    async for session_id, legacy in store.legacy_sessions():
+        if not dry_run:
+            await store.migrate(session_id, legacy)
+        result["legacy_migrated"] += 1
+
+    async def finish(files):
+        meta = {"run": run_id, "before": before.isoformat(), "stub": stub}
+        files.close(meta)
+        result["files"] += 2
+        result["bytes"] += os.path.getsize(files.path) + os.path.getsize(files.sessions.path)
+        kept = await store.expire(files.pending, stub=stub, note=os.path.relpath(files.path, root))
+        result["expired"] += len(files.pending) - len(kept)
+        result["kept"] += len(kept)
+
+    try:
+        async for session_id, header, version in store.idle_sessions(before):
+            day = header["updated_at"].date()
+            if not dry_run and (files is None or files.day != day or files.turns.rows >= max_file_rows):
+                if files is not None:
+                    await finish(files)
+                seq += 1
+                files = PartitionFiles(root, day, f"{run_id}-{seq:04d}", row_group_rows)
+
+            result["sessions"] += 1
+            if dry_run:
+                result["turns"] += header.get("turn_count", 0)
+            else:
+                async for turn_index, message in store.iter_turns(session_id, header):
+                    files.turns.write(turn_row(session_id, turn_index, message))
+                    result["turns"] += 1
+                files.sessions.write(session_row(session_id, header))
+                files.pending.append((session_id, {k: header.get(k) for k in ("turn_count", "page_size")}, version))
+            if limit and result["sessions"] >= limit:
+                break
+    except BaseException:
+        # Nothing in an unfinished file has been removed from Firestore yet
+        if files is not None:
+            files.abort()
+        raise
+    if files is not None:
+        await finish(files)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive idle chat sessions to columnar files.")
+    parser.add_argument("--out", required=True, help="Archive directory (partitioned by date)")
+    parser.add_argument("--older-than-days", type=float, default=float(os.getenv("ARCHIVE_AFTER_DAYS", "90")))
+    parser.add_argument("--stub", action="store_true", help="Keep a header stub instead of deleting the session")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after archiving this many sessions")
+    parser.add_argument("--max-file-rows", type=int, default=200_000, help="Turns per file before starting a new one")
+    parser.add_argument("--row-group-rows", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true", help="Count idle sessions without writing")
+    args = parser.parse_args()
+
+    from migrate_chat_history import init_db
+    from session_store import FirestoreSessionStore
+
+    before = datetime.datetime.utcnow() - datetime.timedelta(days=args.older_than_days)
+    result = asyncio.run(archive(
+        FirestoreSessionStore(init_db()), args.out, before, stub=args.stub, dry_run=args.dry_run,
+        limit=args.limit, max_file_rows=args.max_file_rows, row_group_rows=args.row_group_rows,
+    ))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
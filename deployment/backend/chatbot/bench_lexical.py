@@ -0,0 +1,97 @@
+# bench_lexical.py
+# BM25 query latency and index size of LexicalIndex against corpus size.
+#
+# Usage:
+#   python bench_lexical.py                        # 10k, 100k chunks
+#   python bench_lexical.py --sizes 10000,100000,500000 --batch 5000
+#
+# The synthetic corpus draws words from a Zipf distribution and sprinkles in
+# form numbers and dates, roughly like campus circulars.
+
+import time
+import argparse
+import tempfile
+import numpy as np
+from lexical_index import LexicalIndex
+
+
+def make_corpus(size, vocab_size=50000, doc_words=120, seed=0):
+    rng = np.random.default_rng(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    for start in range(0, size, 10000):
+        n = min(10000, size - start)
+        ranks = np.minimum(rng.zipf(1.2, size=(n, doc_words)), vocab_size) - 1
+        for i in range(n):
+            words = [vocab[r] for r in ranks[i]]
+            words.append(f"SF-{rng.integers(1, 500)}")
+            words.append(f"{rng.integers(1, 29)}/{rng.integers(1, 13)}/2025")
+            yield start + i, " ".join(words)
+
+
+def percentile_ms(samples, pct):
+    return round(float(np.percentile(samples, pct)) * 1000, 2)
+
+
+def bench(size, batch, queries, k):
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as path:
+        index = LexicalIndex(path)
+        started = time.perf_counter()
+        docs = []
+        for doc in make_corpus(size):
+            docs.append(doc)
+            if len(docs) >= batch:
+                index.add_batch(docs)
+                docs = []
+        index.add_batch(docs)
+        build_seconds = time.perf_counter() - started
+        segments_before = len(index.segments())
+        size_before = index.size_bytes()
+
+        query_texts = [
+            f"form SF-{rng.integers(1, 500)} w{rng.integers(0, 200)} w{rng.integers(0, 5000)}"
+            for _ in range(queries)
+        ]
+
+        def run():
+            samples = []
+            for q in query_texts:
+                t = time.perf_counter()
+                index.search(q, k)
+                samples.append(time.perf_counter() - t)
+            return samples
+
+        segmented = run()
+        started = time.perf_counter()
+        index.merge()
+        merge_seconds = time.perf_counter() - started
+        merged = run()
+
+        return {
+            "chunks": size,
+            "build_s": round(build_seconds, 2),
+            "segments": segments_before,
+            "index_mb": round(size_before / 2**20, 2),
+            "p50_ms": percentile_ms(segmented, 50),
+            "p95_ms": percentile_ms(segmented, 95),
+            "merge_s": round(merge_seconds, 2),
+            "merged_index_mb": round(index.size_bytes() / 2**20, 2),
+            "merged_p50_ms": percentile_ms(merged, 50),
+            "merged_p95_ms": percentile_ms(merged, 95),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LexicalIndex (BM25).")
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--batch", type=int, default=5000, help="Chunks per segment")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(bench(size, args.batch, args.queries, args.k), flush=True)
+
+
+if __name__ == "__main__":
+    main()
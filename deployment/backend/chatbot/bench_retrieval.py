@@ -0,0 +1,81 @@
+# bench_retrieval.py
+# Query latency of VectorIndex at increasing corpus sizes.
+#
+# Usage:
+#   python bench_retrieval.py                       # 10k, 100k, 1M chunks
+#   python bench_retrieval.py --sizes 10000,100000 --dim 384 --queries 50
+#
+# Random unit vectors stand in for real chunk embeddings; search cost depends
+# only on rows x dim, not on the text.
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from embeddings import normalize_rows
+from vector_index import VectorIndex
+
+
+def build_index(path, size, dim, batch=50000, seed=0):
+    rng = np.random.default_rng(seed)
+    index = VectorIndex(path, dim=dim)
+    for start in range(0, size, batch):
+        n = min(batch, size - start)
+        vectors = normalize_rows(rng.standard_normal((n, dim), dtype=np.float32))
+        records = [{"text": f"chunk {start + i}", "source": "bench"} for i in range(n)]
+        index.append(vectors, records)
+    return index
+
+
+def percentile_ms(samples, pct):
+    return round(float(np.percentile(samples, pct)) * 1000, 2)
+
+
+def bench(size, dim, queries, k, batch_size):
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as path:
+        started = time.perf_counter()
+        build_index(path, size, dim)
+        build_seconds = time.perf_counter() - started
+
+        index = VectorIndex(path)
+        index.search(normalize_rows(rng.standard_normal((1, dim), dtype=np.float32)), k)  # warm page cache
+
+        single = []
+        for _ in range(queries):
+            q = normalize_rows(rng.standard_normal((1, dim), dtype=np.float32))
+            started = time.perf_counter()
+            index.search(q, k)
+            single.append(time.perf_counter() - started)
+
+        batch = normalize_rows(rng.standard_normal((batch_size, dim), dtype=np.float32))
+        started = time.perf_counter()
+        index.search(batch, k)
+        batch_seconds = time.perf_counter() - started
+
+        return {
+            "chunks": size,
+            "index_mb": round(os.path.getsize(os.path.join(path, "embeddings.f32")) / 2**20, 1),
+            "build_s": round(build_seconds, 2),
+            "p50_ms": percentile_ms(single, 50),
+            "p95_ms": percentile_ms(single, 95),
+            f"batch{batch_size}_ms_per_query": round(batch_seconds * 1000 / batch_size, 2),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VectorIndex query latency.")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(bench(size, args.dim, args.queries, args.k, args.batch_size), flush=True)
+
+
+if __name__ == "__main__":
+    main()
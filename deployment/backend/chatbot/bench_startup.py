@@ -0,0 +1,130 @@
+# bench_startup.py
+# Cold-start benchmark: import time of main.py and time to first response.
+#
+# Each run uses a fresh interpreter, like a new serverless instance:
+#   import_ms        `import main` in a new process
+#   ready_ms         process spawn -> first 200 from GET /
+#   first_chat_*     first /chat on that process (builds the lazy clients)
+#   warm_chat_*      a second /chat on the same process
+#
+# Usage:
+#   python bench_startup.py                      # offline: memory store, fake Gemini
+#   python bench_startup.py --live               # use the real environment (.env)
+#   python bench_startup.py --save-baseline startup.json
+#   python bench_startup.py --baseline startup.json --max-regression 0.2
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import httpx
+from loadtest import compare, free_port
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COMPARED = ["import_ms", "ready_ms", "first_chat_ttfb_ms", "first_chat_total_ms"]
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import main; "
+    "print(round((time.perf_counter() - started) * 1000, 1))"
+)
+
+
+def bench_env(live):
+    env = dict(os.environ)
+    if not live:
+        env.setdefault("SESSION_STORE", "memory")
+        env.setdefault("GEMINI_FAKE", "1")
+        # Measure our own startup, not the fake model's simulated latency
+        env.setdefault("FAKE_GEMINI_LATENCY_MS", "0")
+        env.setdefault("FAKE_GEMINI_TOKENS_PER_S", "100000")
+    return env
+
+
+def measure_import(env):
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=HERE, env=env, capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def timed_chat(client, base_url, token=None):
+    """(ttfb ms, total ms, session token); without a token the server issues one."""
+    started = time.perf_counter()
+    ttfb = None
+    with client.stream("POST", f"{base_url}/chat", json={"session_token": token, "message": "What is the fee deadline?"}) as response:
+        for _ in response.iter_bytes():
+            if ttfb is None:
+                ttfb = time.perf_counter() - started
+        token = response.headers.get("X-Session-Token") or token
+    return round(ttfb * 1000, 1), round((time.perf_counter() - started) * 1000, 1), token
+
+
+def measure_server(env, timeout):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(timeout=timeout) as client:
+            while True:
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError("server did not start")
+                try:
+                    if client.get(f"{base_url}/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            ready_ms = round((time.perf_counter() - started) * 1000, 1)
+            first = timed_chat(client, base_url)
+            warm = timed_chat(client, base_url, first[2])
+    finally:
+        proc.terminate()
+        proc.wait()
+    return {
+        "ready_ms": ready_ms,
+        "first_chat_ttfb_ms": first[0], "first_chat_total_ms": first[1],
+        "warm_chat_ttfb_ms": warm[0], "warm_chat_total_ms": warm[1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold-start latency of the chat backend.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="Use the real Firestore/Gemini configuration")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--save-baseline", help="Write this run's report to a JSON file")
+    parser.add_argument("--baseline", help="Compare against a saved report")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    env = bench_env(args.live)
+    runs = []
+    for _ in range(args.runs):
+        run = {"import_ms": measure_import(env)}
+        run.update(measure_server(env, args.timeout))
+        runs.append(run)
+        print(run, flush=True)
+
+    report = {key: round(statistics.median(r[key] for r in runs), 1) for key in runs[0]}
+    report["runs"] = args.runs
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            rows, regressed = compare(report, json.load(f), args.max_regression, keys=COMPARED)
+        print("\n".join(rows))
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# context_builder.py
+# Builds the Gemini `contents` for one request: the last few turns verbatim
+# within a token budget, with older turns represented by a rolling summary.
+
+SUMMARY_PREFIX = "Summary of the earlier conversation with this student:\n"
+SUMMARY_ACK = "Understood. I will use this summary as context."
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a student and
+Shiksha Saathi, an academic assistant. Update the existing summary with the new
+turns below. Keep facts the student shared, questions asked and answers given
+(names, dates, courses, form numbers). Reply with the updated summary only, in
+at most {max_words} words.
+
+Existing summary:
+{summary}
+
+New turns:
+{turns}
+"""
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) that needs no API call."""
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+
+def entry_tokens(entry):
+    return sum(estimate_tokens(part) for part in entry.get("parts", []) if isinstance(part, str))
+
+
+class ContextWindow:
+    """Result of a build: the contents to send plus token accounting."""
+
+    __slots__ = ("contents", "tokens_full", "tokens_used", "recent_turns", "summarize_upto")
+
+    def __init__(self, contents, tokens_full, tokens_used, recent_turns, summarize_upto):
+        self.contents = contents
+        self.tokens_full = tokens_full
+        self.tokens_used = tokens_used
+        self.recent_turns = recent_turns
+        # Absolute turns [history.summary_turns, summarize_upto) are outside the window
+        # and should be folded into the summary after this request.
+        self.summarize_upto = summarize_upto
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.tokens_full - self.tokens_used)
+
+
+class ContextBuilder:
+    """Keeps at most `max_turns` recent turns within `token_budget` tokens.
+
+    The budget covers history, summary and the new message; the persona sent as
+    `system_instruction` is a fixed cost and is not counted here.
+    """
+
+    def __init__(self, max_turns=6, token_budget=3000, summary_batch_turns=4):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_batch_turns = summary_batch_turns
+
+    def build(self, history, message):
+        contents = history.contents
+        loaded_turns = len(contents) // 2
+        # Indices below are relative to the loaded tail (history.base_turn)
+        summarized = max(0, history.summary_turns - history.base_turn)
+        message_entry = {"role": "user", "parts": [message]}
+        message_tokens = entry_tokens(message_entry)
+        turn_tokens = [
+            entry_tokens(contents[2 * i]) + entry_tokens(contents[2 * i + 1])
+            for i in range(loaded_turns)
+        ]
+        tokens_full = sum(turn_tokens) + message_tokens
+
+        summary_entries = []
+        if history.summary:
+            summary_entries = [
+                {"role": "user", "parts": [SUMMARY_PREFIX + history.summary]},
+                {"role": "model", "parts": [SUMMARY_ACK]},
+            ]
+        used = message_tokens + sum(entry_tokens(e) for e in summary_entries)
+
+        # Walk back from the newest turn while it fits in both limits
+        start = loaded_turns
+        while start > 0 and loaded_turns - start < self.max_turns:
+            if used + turn_tokens[start - 1] > self.token_budget:
+                break
+            used += turn_tokens[start - 1]
+            start -= 1
+
+        # Turns already covered by the summary never need to be sent verbatim
+        if start < summarized:
+            used -= sum(turn_tokens[start:summarized])
+            start = summarized
+
+        window = summary_entries + contents[2 * start:] + [message_entry]
+
+        # Only summarize once a full batch has fallen out of the window, so the
+        # summary is extended incrementally rather than on every request.
+        summarize_upto = history.summary_turns
+        if start - summarized >= self.summary_batch_turns:
+            summarize_upto = history.base_turn + start
+
+        return ContextWindow(window, tokens_full, used, loaded_turns - start, summarize_upto)
+
+
+def format_turns(contents):
+    lines = []
+    for entry in contents:
+        speaker = "Student" if entry["role"] == "user" else "Assistant"
+        lines.append(f"{speaker}: {' '.join(p for p in entry['parts'] if isinstance(p, str))}")
+    return "\n".join(lines)
+
+
+async def summarize_turns(summary_model, previous_summary, contents, max_words=200):
+    """Folds `contents` (whole turns) into `previous_summary` with one LLM call."""
+    prompt = SUMMARY_PROMPT.format(
+        max_words=max_words,
+        summary=previous_summary or "(none yet)",
+        turns=format_turns(contents),
+    )
+    response = await summary_model.generate_content_async(prompt)
+    return response.text.strip()
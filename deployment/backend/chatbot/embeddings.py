@@ -0,0 +1,70 @@
+# embeddings.py
+# Pluggable text embedders for the retrieval step. Every embedder returns
+# L2-normalized float32 rows, so cosine similarity is a plain dot product.
+
+import zlib
+import numpy as np
+from answer_cache import normalize_prompt
+from lexical_index import STOPWORDS
+
+
+class Embedder:
+    """Interface: `name`, `dim` and `embed(texts) -> float32 array (n, dim)`."""
+
+    name = "base"
+    dim = 0
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class HashingEmbedder(Embedder):
+    """Offline default: signed feature hashing of words, word bigrams and
+    character trigrams. Needs no model download and is deterministic across
+    processes (crc32, not Python's salted hash).
+
+    Stopwords are left out, so questions do not match chunks on "what is the"
+    alone. (v2: v1 hashed stopwords too; its indexes need --rebuild.)
+    """
+
+    name = "hashing-v2"
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def features(self, text):
+        words = [w for w in normalize_prompt(text).split() if w not in STOPWORDS]
+        feats = list(words)
+        feats.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        for word in words:
+            padded = f"<{word}>"
+            feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return feats
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat in self.features(text):
+                h = zlib.crc32(feat.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        # Sublinear term frequency keeps repeated words from dominating
+        np.copysign(np.log1p(np.abs(matrix)), matrix, out=matrix)
+        return normalize_rows(matrix).astype(np.float32, copy=False)
+
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+}
+
+
+def get_embedder(name="hashing", dim=384):
+    try:
+        return EMBEDDERS[name](dim=dim)
+    except KeyError:
+        raise ValueError(f"Unknown embedder '{name}'. Available: {', '.join(EMBEDDERS)}")
@@ -0,0 +1,98 @@
+# fake_gemini.py
+# Offline stand-in for google.generativeai.GenerativeModel, used for load tests
+# and local runs (GEMINI_FAKE=1). Streams a canned answer with configurable
+# first-token latency, token rate, chunk size and error rate. With a prefill
+# cost set, input tokens (prompt prefix plus contents) add to the first-token
+# latency, except the ones covered by a cached prefix (see prompt_cache.py).
+
+import os
+import copy
+import random
+import asyncio
+
+LOREM = (
+    "The last date for fee payment is mentioned in the latest circular from the accounts "
+    "section. Students should submit the scholarship form along with the required documents "
+    "before the deadline and keep a copy of the acknowledgement receipt for future reference."
+).split()
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    """Async-iterable like AsyncGenerateContentResponse; `.text` when not streaming."""
+
+    def __init__(self, model, stream, prefill=0.0):
+        self.model = model
+        self.stream = stream
+        self.prefill = prefill
+        self.text = " ".join(model.words()) if not stream else ""
+
+    def __aiter__(self):
+        return self.model.chunks(self.prefill)
+
+
+class FakeGenerativeModel:
+    def __init__(self, first_token_latency=0.3, tokens_per_second=80.0, response_tokens=120,
+                 chunk_tokens=8, error_rate=0.0, seed=None, prefill_ms_per_1k=0.0, prefix_tokens=0):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.chunk_tokens = chunk_tokens
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.prefix_tokens = prefix_tokens  # system instruction + shared context
+        self.cached_tokens = 0
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls, prefix_tokens=0):
+        return cls(
+            prefix_tokens=prefix_tokens,
+            prefill_ms_per_1k=float(os.getenv("FAKE_GEMINI_PREFILL_MS_PER_1K", "0")),
+            first_token_latency=float(os.getenv("FAKE_GEMINI_LATENCY_MS", "300")) / 1000,
+            tokens_per_second=float(os.getenv("FAKE_GEMINI_TOKENS_PER_S", "80")),
+            response_tokens=int(os.getenv("FAKE_GEMINI_RESPONSE_TOKENS", "120")),
+            chunk_tokens=int(os.getenv("FAKE_GEMINI_CHUNK_TOKENS", "8")),
+            error_rate=float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0")),
+        )
+
+    def with_cached_tokens(self, tokens):
+        """Copy of this model whose first `tokens` prefix tokens are cached."""
+        model = copy.copy(self)
+        model.cached_tokens = tokens
+        return model
+
+    def prefill_seconds(self, contents):
+        """Simulated prefill for any `contents` shape the SDK accepts: a string,
+        a list of strings, or a list of {"role", "parts"} entries."""
+        if isinstance(contents, (str, dict)):
+            contents = [contents]
+        parts = [p for entry in contents for p in ([entry] if isinstance(entry, str) else entry.get("parts", []))]
+        text_tokens = sum(len(p) // 4 for p in parts if isinstance(p, str))
+        uncached = max(self.prefix_tokens - self.cached_tokens, 0) + text_tokens
+        return uncached * self.prefill_ms_per_1k / 1e6
+
+    def words(self):
+        return [LOREM[i % len(LOREM)] for i in range(self.response_tokens)]
+
+    async def chunks(self, prefill=0.0):
+        await asyncio.sleep(self.first_token_latency + prefill)
+        words = self.words()
+        for start in range(0, len(words), self.chunk_tokens):
+            piece = words[start:start + self.chunk_tokens]
+            yield FakeChunk(" ".join(piece) + " ")
+            await asyncio.sleep(len(piece) / self.tokens_per_second)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self.calls += 1
+        if self.random.random() < self.error_rate:
+            raise RuntimeError("429 Resource has been exhausted (fake quota error)")
+        prefill = self.prefill_seconds(contents)
+        if not stream:
+            await asyncio.sleep(self.first_token_latency + prefill + self.response_tokens / self.tokens_per_second)
+        return FakeResponse(self, stream, prefill)
@@ -0,0 +1,255 @@
+# faq_snapshot.py
+# Versioned bundle of the most asked questions and their answers, served at
+# /faq/snapshot so the widget can answer them without a /chat round trip
+# (and offline, from its stored copy).
+#
+# Built from the analytics question rollups (analytics.py): per-day counts
+# over the last --days are summed, questions that often got low-confidence
+# answers are dropped, and the top --top keep their latest confident answer
+# given when the question opened a session. Answers to follow-ups are never
+# used: they rely on context the widget does not have.
+# A curated file can pin, override or exclude entries:
+#   {"entries": [{"question": "...", "answer": "...", "aliases": ["..."]}],
+#    "exclude": ["question text", ...]}
+#
+# The version is a hash of the entries, so rebuilding with the same content
+# keeps the same ETag and clients revalidate with a 304.
+#
+# Usage:
+#   python faq_snapshot.py --days 30 --top 50 --curated data/faq_curated.json --out data/faq_snapshot.json
+
+import os
+import gzip
+import json
+import asyncio
+import hashlib
+import argparse
+import datetime
+from answer_cache import normalize_prompt, trigrams
+from analytics import day_key, question_id
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+FORMAT = 1
+
+
+def load_curated(path):
+    if not path or not os.path.exists(path):
+        return {"entries": [], "exclude": []}
+    with open(path, "r", encoding="utf-8") as f:
+        curated = json.load(f)
+    return {"entries": curated.get("entries", []), "exclude": curated.get("exclude", [])}
+
+
+async def collect_questions(store, days, per_day=200, now=None):
+    """Sums the per-day question rollups of the last `days` days, by question id."""
+    now = now or datetime.datetime.utcnow()
+    merged = {}
+    for n in range(days):
+        for row in await store.top_questions(day_key(now - datetime.timedelta(days=n)), "count", per_day):
+            entry = merged.setdefault(row["id"], {
+                "id": row["id"], "text": row["text"], "count": 0, "first_turns": 0, "low_confidence": 0,
+                "answer": None, "last_seen": None,
+            })
+            entry["count"] += row.get("count", 0)
+            entry["first_turns"] += row.get("first_turns", 0)
+            entry["low_confidence"] += row.get("low_confidence", 0)
+            # Days are visited newest first, so the first answer seen is the latest
+            if entry["answer"] is None and row.get("first_answer"):
+                entry["answer"] = row["first_answer"]
+                entry["last_seen"] = row.get("last_seen")
+    return list(merged.values())
+
+
+def select_entries(questions, curated, top=50, min_count=3, max_low_confidence=0.2):
+    """Curated entries first, then the most asked questions that have a good answer."""
+    excluded = {normalize_prompt(q) for q in curated["exclude"]}
+    entries, taken = [], set()
+    for item in curated["entries"]:
+        keys = [normalize_prompt(item["question"])] + [normalize_prompt(a) for a in item.get("aliases", [])]
+        keys = [k for k in dict.fromkeys(keys) if k]
+        if not keys or not item.get("answer"):
+            continue
+        entries.append({"id": question_id(keys[0]), "question": item["question"], "keys": keys,
+                        "answer": item["answer"], "count": 0, "curated": True})
+        taken.update(keys)
+
+    ranked = sorted(questions, key=lambda q: (-q["count"], q["id"]))
+    for q in ranked:
+        if len(entries) >= top:
+            break
+        if (q["text"] in taken or q["text"] in excluded or not q["answer"] or q["first_turns"] < min_count
+                or q["low_confidence"] > max_low_confidence * q["count"]):
+            continue
+        entries.append({"id": q["id"], "question": q["text"], "keys": [q["text"]],
+                        "answer": q["answer"], "count": q["count"], "curated": False})
+        taken.add(q["text"])
+    return entries
+
+
+def build_snapshot(entries, similarity_threshold=0.8):
+    content = {"format": FORMAT, "similarity_threshold": similarity_threshold, "entries": entries}
+    version = hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    return {"version": version, "built_at": datetime.datetime.utcnow().isoformat() + "Z", **content}
+
+
+def write_snapshot(path, snapshot):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+async def rebuild(store, path, curated_path=None, days=30, top=50, min_count=3, max_low_confidence=0.2,
+                  similarity_threshold=0.8):
+    questions = await collect_questions(store, days)
+    entries = select_entries(questions, load_curated(curated_path), top, min_count, max_low_confidence)
+    snapshot = build_snapshot(entries, similarity_threshold)
+    write_snapshot(path, snapshot)
+    return {"version": snapshot["version"], "entries": len(entries), "questions_seen": len(questions)}
+
+
+# --- Serving ---
+def accepted_encodings(accept_encoding):
+    """Codings the client accepts (q > 0), from an Accept-Encoding header."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "").rstrip("0").rstrip(".") == "q=0":
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def etag_matches(if_none_match, version):
+    for tag in (if_none_match or "").split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        tag = tag.removeprefix("W/").strip('"')
+        if tag.split("-")[0] == version:
+            return True
+    return False
+
+
+class FaqSnapshot:
+    """The snapshot file, with precompressed bodies and a lookup index.
+
+    Reloaded when the file changes, so a rebuild is picked up without a restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self.version = None
+        self.bodies = {}      # None | "gzip" | "br" -> bytes
+        self._by_key = {}     # normalized question -> entry
+        self._grams = {}      # trigram -> set of keys
+        self._key_grams = {}
+        self.threshold = 0.8
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+
+    def current(self):
+        """True if a snapshot is loaded (reloading it if the file changed)."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return self.version is not None
+        if mtime != self._mtime:
+            self._load()
+            self._mtime = mtime
+        return True
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        snapshot = json.loads(raw)
+        self.bodies = {None: raw, "gzip": gzip.compress(raw, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(raw, quality=11)
+        self.version = snapshot["version"]
+        self.threshold = snapshot.get("similarity_threshold", 0.8)
+        self._by_key, self._grams, self._key_grams = {}, {}, {}
+        for entry in snapshot["entries"]:
+            for key in entry["keys"]:
+                self._by_key[key] = entry
+                grams = trigrams(key)
+                self._key_grams[key] = grams
+                for gram in grams:
+                    self._grams.setdefault(gram, set()).add(key)
+        print(f"Loaded FAQ snapshot {self.version} ({len(snapshot['entries'])} entries).")
+
+    def body(self, accept_encoding):
+        """(bytes, content coding or None) for a client's Accept-Encoding."""
+        accepted = accepted_encodings(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in self.bodies and coding in accepted:
+                return self.bodies[coding], coding
+        return self.bodies[None], None
+
+    def etag(self, coding):
+        return f'"{self.version}-{coding}"' if coding else f'"{self.version}"'
+
+    def lookup(self, question):
+        """(entry, score) for an exact or near-exact match, else (None, best score)."""
+        self.lookups += 1
+        key = normalize_prompt(question)
+        if key in self._by_key:
+            self.exact_hits += 1
+            return self._by_key[key], 1.0
+        grams = trigrams(key)
+        overlap = {}
+        for gram in grams:
+            for candidate in self._grams.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+        best, best_score = None, 0.0
+        for candidate, shared in overlap.items():
+            score = shared / (len(grams) + len(self._key_grams[candidate]) - shared)
+            if score > best_score:
+                best, best_score = candidate, score
+        if best_score >= self.threshold:
+            self.near_hits += 1
+            return self._by_key[best], round(best_score, 3)
+        return None, round(best_score, 3)
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "entries": len({e["id"] for e in self._by_key.values()}),
+            "bytes": {coding or "identity": len(b) for coding, b in self.bodies.items()},
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the FAQ snapshot served at /faq/snapshot.")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "faq_snapshot.json"))
+    parser.add_argument("--curated", default=None, help="JSON file of curated/excluded questions")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--top", type=int, default=50)
+    parser.add_argument("--min-count", type=int, default=3, help="Min times asked as the first turn of a session")
+    parser.add_argument("--max-low-confidence", type=float, default=0.2, help="Max share of low-confidence answers")
+    parser.add_argument("--similarity", type=float, default=0.8, help="Trigram similarity for near-exact matches")
+    args = parser.parse_args()
+
+    from migrate_chat_history import init_db
+    from analytics import FirestoreAnalyticsStore
+
+    result = asyncio.run(rebuild(
+        FirestoreAnalyticsStore(init_db()), args.out, args.curated, args.days, args.top,
+        args.min_count, args.max_low_confidence, args.similarity,
+    ))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# history_cache.py
+# In-process cache of per-session Gemini `contents` (plus the rolling summary),
+# so follow-up turns in an active conversation skip the Firestore read and the
+# history rebuild.
+
+import time
+from collections import OrderedDict
+
+
+def estimate_size(contents):
+    """Rough byte size of a `contents` list (text parts only)."""
+    size = 0
+    for entry in contents:
+        for part in entry.get("parts", []):
+            if isinstance(part, str):
+                size += len(part.encode("utf-8"))
+    return size
+
+
+class SessionHistory:
+    """Built history for one session: Gemini contents plus the rolling summary.
+
+    A turn is one user/model pair in `contents`. Only the tail of a long
+    session is loaded, so `contents` starts at absolute turn `base_turn`;
+    `summary_turns` (absolute) is the number of leading turns already folded
+    into `summary`. `page_size` is the storage page size of the session.
+
+    `stored_turn_count` is the header's turn count. Loaded turns can fall
+    short of it (pages dropped by `archive_sessions.py --stub`), so new turns
+    are numbered from `next_turn`, the larger of the two.
+    """
+
+    __slots__ = ("contents", "summary", "summary_turns", "base_turn", "page_size", "stored_turn_count")
+
+    def __init__(self, contents=None, summary="", summary_turns=0, base_turn=0, page_size=None,
+                 stored_turn_count=0):
+        self.contents = contents if contents is not None else []
+        self.summary = summary
+        self.summary_turns = summary_turns
+        self.base_turn = base_turn
+        self.page_size = page_size
+        self.stored_turn_count = stored_turn_count
+
+    @property
+    def turn_count(self):
+        """Total turns in the session, including ones that were not loaded."""
+        return self.base_turn + len(self.contents) // 2
+
+    @property
+    def next_turn(self):
+        """Index for the session's next turn."""
+        return max(self.turn_count, self.stored_turn_count)
+
+    def turns(self, start, end):
+        """Contents for absolute turns [start, end); must be within the loaded range."""
+        return self.contents[2 * (start - self.base_turn):2 * (end - self.base_turn)]
+
+
+class SessionHistoryCache:
+    """LRU + TTL cache of chat history keyed by session_id.
+
+    Entries are bounded both by count and by an approximate total byte size.
+    The cache is per process: another worker writing the same session is not
+    seen until the entry expires, so keep the TTL short relative to a session.
+    """
+
+    def __init__(self, max_sessions=1000, max_bytes=64 * 1024 * 1024, ttl_seconds=1800):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # session_id -> [history, size, expires_at]
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id):
+        """Returns the cached SessionHistory, or None on a miss."""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[2] < time.monotonic():
+            self._remove(session_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, session_id, history):
+        """Stores a freshly loaded SessionHistory for a session."""
+        self._remove(session_id)
+        size = estimate_size(history.contents) + len(history.summary.encode("utf-8"))
+        self._entries[session_id] = [history, size, time.monotonic() + self.ttl_seconds]
+        self._total_bytes += size
+        self._evict()
+
+    def append_turn(self, session_id, user_prompt, bot_response, turn_index=None):
+        """Write-through update after a turn is saved; no-op if not cached.
+
+        With `turn_index`, an entry that does not end right before that turn
+        (another request of the session changed it meanwhile) is dropped
+        instead, so the next load rebuilds it.
+        """
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        if turn_index is not None and entry[0].next_turn != turn_index:
+            self._remove(session_id)
+            return
+        if turn_index is not None:
+            entry[0].stored_turn_count = turn_index + 1
+        new_entries = [
+            {"role": "user", "parts": [user_prompt]},
+            {"role": "model", "parts": [bot_response]},
+        ]
+        entry[0].contents.extend(new_entries)
+        added = estimate_size(new_entries)
+        entry[1] += added
+        entry[2] = time.monotonic() + self.ttl_seconds
+        self._total_bytes += added
+        self._entries.move_to_end(session_id)
+        self._evict()
+
+    def set_summary(self, session_id, summary, summary_turns):
+        """Write-through update after the rolling summary is saved."""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        history = entry[0]
+        delta = len(summary.encode("utf-8")) - len(history.summary.encode("utf-8"))
+        history.summary = summary
+        history.summary_turns = summary_turns
+        entry[1] += delta
+        self._total_bytes += delta
+        self._evict()
+
+    def invalidate(self, session_id):
+        self._remove(session_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _remove(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_sessions or self._total_bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry[1]
+            self.evictions += 1
+
+
+class TurnCounter:
+    """Hands out turn indexes per session, so overlapping requests of one
+    session (a double submit, two tabs) never write the same turn slot.
+
+    The index is claimed when a turn is saved: at least the session's
+    `next_turn` as the request loaded it, and past every index already claimed
+    in this process. Bounded LRU; a forgotten session falls back to its loaded
+    `next_turn`. Collisions across worker processes are not prevented: two
+    workers can claim the same index for one session (another worker's
+    queued turn is not in the header yet), and the later write wins.
+    """
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._next = OrderedDict()  # session_id -> next free turn index
+        self.claims = 0
+        self.contended = 0
+
+    def claim(self, session_id, loaded_turn_count):
+        index = max(loaded_turn_count, self._next.get(session_id, 0))
+        if index != loaded_turn_count:
+            self.contended += 1
+        self._next[session_id] = index + 1
+        self._next.move_to_end(session_id)
+        while len(self._next) > self.max_sessions:
+            self._next.popitem(last=False)
+        self.claims += 1
+        return index
+
+    def stats(self):
+        return {"sessions": len(self._next), "claims": self.claims, "contended": self.contended}
@@ -0,0 +1,379 @@
+# ingest.py
+# Document ingestion: PDF / HTML / plain text -> chunks -> vector index.
+#
+# Usage:
+#   python ingest.py docs/ circulars/fees_2025.pdf
+#   python ingest.py docs/ --workers 4 --batch-size 256 --rebuild
+#
+# - Text is extracted in a process pool, page by page, and chunked as a stream.
+#   Workers spool their chunks to a temporary file that the parent reads back
+#   line by line, and only a few files are in flight at once, so memory does
+#   not grow with the size of a document or of the corpus.
+# - Files whose sha256 is unchanged since the last run are skipped, and chunks
+#   whose normalized text is already indexed are not embedded again.
+# - Embeddings are computed in batches and appended to the existing index;
+#   each batch is also written as one BM25 segment (lexical_index.py).
+# Chunks of an edited document are appended next to the old ones; use
+# --rebuild to drop superseded chunks.
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+from itertools import islice
+from collections import deque
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor
+from answer_cache import normalize_prompt
+from embeddings import get_embedder
+from vector_index import VectorIndex
+from lexical_index import LEXICAL_DIR, LexicalIndex
+
+SUPPORTED_EXTENSIONS = {".pdf", ".html", ".htm", ".txt", ".md"}
+MANIFEST_FILE = "manifest.json"
+CHUNK_HASHES_FILE = "chunk_hashes.txt"
+
+
+# --- Extraction (runs in worker processes) ---
+class _TextExtractor(HTMLParser):
+    SKIP_TAGS = {"script", "style", "noscript"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+    def drain(self):
+        text, self.parts = " ".join(self.parts), []
+        return text
+
+
+def iter_pdf_pages(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise RuntimeError("PDF ingestion requires the 'pypdf' package")
+    reader = PdfReader(path)
+    for page_no, page in enumerate(reader.pages, 1):
+        yield page_no, page.extract_text() or ""
+
+
+def iter_html_blocks(path, block_size=64 * 1024):
+    parser = _TextExtractor()
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            parser.feed(block)
+            yield None, parser.drain()
+    parser.close()
+    yield None, parser.drain()
+
+
+def iter_text_blocks(path, block_lines=200):
+    lines = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            lines.append(line)
+            if len(lines) >= block_lines:
+                yield None, "".join(lines)
+                lines = []
+    if lines:
+        yield None, "".join(lines)
+
+
+def iter_pages(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        return iter_pdf_pages(path)
+    if ext in (".html", ".htm"):
+        return iter_html_blocks(path)
+    return iter_text_blocks(path)
+
+
+def chunk_pages(pages, chunk_words=200, overlap=40):
+    """Yields (page, text) chunks of `chunk_words` words from a page stream.
+
+    Consecutive chunks share `overlap` words (0 <= overlap < chunk_words);
+    `page` is where the chunk starts.
+    """
+    buffer = []  # (word, page)
+    fresh = 0
+    for page_no, text in pages:
+        for word in text.split():
+            buffer.append((word, page_no))
+            fresh += 1
+            if len(buffer) >= chunk_words:
+                yield buffer[0][1], " ".join(w for w, _ in buffer)
+                buffer = buffer[chunk_words - overlap:]
+                fresh = 0
+    if fresh:
+        yield buffer[0][1], " ".join(w for w, _ in buffer)
+
+
+def process_file(path, spool_dir, chunk_words=200, overlap=40):
+    """Worker entry point: extracts and chunks one file into a spool file.
+
+    The chunks are written as JSON lines to a temporary file in `spool_dir`,
+    read back by iter_spool().
+    """
+    pages = set()
+
+    def counted(stream):
+        for page_no, text in stream:
+            pages.add(page_no)
+            yield page_no, text
+
+    fd, spool = tempfile.mkstemp(suffix=".jsonl", dir=spool_dir)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for chunk in chunk_pages(counted(iter_pages(path)), chunk_words, overlap):
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+    except BaseException:
+        os.remove(spool)
+        raise
+    page_count = len(pages - {None}) or 1
+    return {"path": path, "pages": page_count, "spool": spool}
+
+
+def iter_spool(spool):
+    """Yields the (page, text) chunks of a spool file, then deletes it."""
+    try:
+        with open(spool, "r", encoding="utf-8") as f:
+            for line in f:
+                page_no, text = json.loads(line)
+                yield page_no, text
+    finally:
+        os.remove(spool)
+
+
+# --- Bookkeeping ---
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(text):
+    return hashlib.sha1(normalize_prompt(text).encode("utf-8")).hexdigest()
+
+
+def discover(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                        yield os.path.join(root, name)
+        elif os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS:
+            yield path
+
+
+def load_manifest(index_dir):
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}}
+
+
+def save_manifest(index_dir, manifest):
+    tmp = os.path.join(index_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(index_dir, MANIFEST_FILE))
+
+
+def load_chunk_hashes(index_dir):
+    try:
+        with open(os.path.join(index_dir, CHUNK_HASHES_FILE), "r", encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def peak_memory_mb():
+    """Peak RSS in MiB of this process and of the largest finished worker."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB on Linux
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(own / divisor, 1), round(children / divisor, 1)
+
+
+# --- Pipeline ---
+def ingest(paths, index_dir, embedder, workers=None, batch_size=256, chunk_words=200,
+           overlap=40, rebuild=False, merge=True, max_in_flight=None):
+    """Ingests files into the index at `index_dir` and returns a run report.
+
+    With merge=False, BM25 segments are left for the caller to merge later
+    (the upload endpoint does it in a background task). At most
+    `max_in_flight` files (default: twice the workers) are extracted ahead of
+    the embedder.
+    """
+    if not 0 <= overlap < chunk_words:
+        # A window that does not advance would never finish
+        raise ValueError(f"overlap must be at least 0 and less than chunk_words ({overlap=}, {chunk_words=})")
+    started = time.perf_counter()
+    if rebuild and os.path.isdir(index_dir):
+        shutil.rmtree(index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+
+    index = VectorIndex(index_dir, dim=embedder.dim, embedder_name=embedder.name)
+    if len(index) and index.meta().get("embedder") != embedder.name:
+        raise ValueError(
+            f"Index was built with '{index.meta().get('embedder')}', not '{embedder.name}'; use --rebuild"
+        )
+    lexical = LexicalIndex(os.path.join(index_dir, LEXICAL_DIR))
+    manifest = load_manifest(index_dir)
+    seen_chunks = load_chunk_hashes(index_dir)
+
+    todo, skipped_files = [], 0
+    for path in discover(paths):
+        key = os.path.abspath(path)
+        digest = file_sha256(path)
+        if manifest["files"].get(key, {}).get("sha256") == digest:
+            skipped_files += 1
+            continue
+        todo.append((key, digest))
+
+    report = {
+        "files": len(todo), "files_skipped": skipped_files, "pages": 0,
+        "chunks": 0, "chunks_added": 0, "chunks_skipped": 0, "errors": [],
+    }
+    pending_texts, pending_records = [], []
+    finished_files = {}  # files whose chunks are all queued, recorded once flushed
+    hash_log = open(os.path.join(index_dir, CHUNK_HASHES_FILE), "a", encoding="utf-8")
+    spool_dir = tempfile.mkdtemp(prefix="ingest-")
+
+    def flush():
+        """Embeds and appends the queued chunks, then records finished files."""
+        if pending_texts:
+            count = index.append(embedder.embed(pending_texts), pending_records)
+            first_row = count - len(pending_texts)
+            lexical.add_batch([(first_row + i, text) for i, text in enumerate(pending_texts)])
+            hash_log.write("".join(f"{r['chunk_hash']}\n" for r in pending_records))
+            hash_log.flush()
+            report["chunks_added"] += len(pending_texts)
+            pending_texts.clear()
+            pending_records.clear()
+        if finished_files:
+            manifest["files"].update(finished_files)
+            save_manifest(index_dir, manifest)
+            finished_files.clear()
+
+    def results():
+        if workers == 0:
+            for key, _ in todo:
+                yield _safe_process(key, spool_dir, chunk_words, overlap)
+            return
+        window = max_in_flight or 2 * (workers or os.cpu_count() or 1)
+        keys = iter([key for key, _ in todo])
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            submit = lambda key: pool.submit(_safe_process, key, spool_dir, chunk_words, overlap)
+            # A sliding window of futures, consumed in submission order
+            futures = deque(submit(key) for key in islice(keys, window))
+            while futures:
+                result = futures.popleft().result()
+                key = next(keys, None)
+                if key is not None:
+                    futures.append(submit(key))
+                yield result
+
+    digests = dict(todo)
+    try:
+        for result in results():
+            if "error" in result:
+                report["errors"].append({"path": result["path"], "error": result["error"]})
+                continue
+            report["pages"] += result["pages"]
+            source = os.path.basename(result["path"])
+            added = 0
+            for page_no, text in iter_spool(result["spool"]):
+                report["chunks"] += 1
+                h = chunk_hash(text)
+                if h in seen_chunks:
+                    report["chunks_skipped"] += 1
+                    continue
+                seen_chunks.add(h)
+                pending_texts.append(text)
+                pending_records.append({"text": text, "source": source, "page": page_no, "chunk_hash": h})
+                added += 1
+                # Batches span files, so many small circulars share one embedding call
+                if len(pending_texts) >= batch_size:
+                    flush()
+            finished_files[result["path"]] = {"sha256": digests[result["path"]], "chunks": added}
+        flush()
+    finally:
+        hash_log.close()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    if merge and lexical.needs_merge():
+        lexical.merge()
+
+    elapsed = time.perf_counter() - started
+    own_mb, worker_mb = peak_memory_mb()
+    report.update({
+        "index_rows": len(index),
+        "lexical_segments": len(lexical.segments()),
+        "seconds": round(elapsed, 3),
+        "pages_per_s": round(report["pages"] / elapsed, 1) if elapsed else 0.0,
+        "chunks_per_s": round(report["chunks"] / elapsed, 1) if elapsed else 0.0,
+        "peak_memory_mb": own_mb,
+        "peak_worker_memory_mb": worker_mb,
+    })
+    return report
+
+
+def _safe_process(path, spool_dir, chunk_words, overlap):
+    try:
+        return process_file(path, spool_dir, chunk_words, overlap)
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest documents into the RAG index.")
+    parser.add_argument("paths", nargs="+", help="Files or directories (pdf, html, txt, md)")
+    parser.add_argument("--index-dir", default=os.getenv(
+        "RAG_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "index")))
+    parser.add_argument("--embedder", default=os.getenv("RAG_EMBEDDER", "hashing"))
+    parser.add_argument("--dim", type=int, default=int(os.getenv("RAG_EMBEDDING_DIM", "384")))
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (0 = inline)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding call")
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--overlap", type=int, default=40)
+    parser.add_argument("--rebuild", action="store_true", help="Drop the index and ingest from scratch")
+    args = parser.parse_args()
+    if not 0 <= args.overlap < args.chunk_words:
+        parser.error("--overlap must be at least 0 and less than --chunk-words")
+
+    report = ingest(
+        args.paths, args.index_dir, get_embedder(args.embedder, dim=args.dim),
+        workers=args.workers, batch_size=args.batch_size, chunk_words=args.chunk_words,
+        overlap=args.overlap, rebuild=args.rebuild,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# lazy.py
+# Once-only, thread-safe initialization of heavy clients (Firebase, Gemini).
+#
+# On a serverless cold start nothing is built at import time; the first
+# request (or /warmup) builds the client. Slow module imports can be done on a
+# worker thread so the event loop keeps serving health checks meanwhile.
+
+import asyncio
+import importlib
+import threading
+import time
+
+
+class Lazy:
+    """Holds the result of `factory()`, built on first use.
+
+    `imports` lists modules the factory needs; aget() imports them off the
+    event loop before calling the factory on the loop thread (clients such as
+    the async Firestore one must be created where they are used).
+    """
+
+    def __init__(self, factory, imports=()):
+        self.factory = factory
+        self.imports = tuple(imports)
+        self.init_seconds = None
+        self._value = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def get(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                started = time.perf_counter()
+                self._value = self.factory()
+                self.init_seconds = time.perf_counter() - started
+                self._ready = True
+        return self._value
+
+    async def aget(self):
+        if self._ready:
+            return self._value
+        if self.imports:
+            await asyncio.to_thread(self.preload)
+        return self.get()
+
+    def preload(self):
+        for name in self.imports:
+            importlib.import_module(name)
+
+    def peek(self):
+        """The value if already built, else None; never triggers a build."""
+        return self._value if self._ready else None
@@ -0,0 +1,308 @@
+# lexical_index.py
+# BM25 inverted index for exact tokens that dense vectors handle poorly:
+# form numbers, course codes, dates, hostel names.
+#
+# Layout (one directory, single writer):
+#   segments.json           live segment names, replaced atomically
+#   seg_000001/meta.json    doc count, total length, array dtypes
+#   seg_000001/terms.json   term -> [offset, df] into the postings arrays
+#   seg_000001/doc_ids.u64  global doc id of each local doc (ascending)
+#   seg_000001/doclens.u32  token count of each local doc
+#   seg_000001/deltas.*     local doc ids per term, delta-encoded
+#   seg_000001/tfs.*        term frequency per posting
+#
+# Segments are immutable: each ingestion batch writes a new one and
+# merge() folds small segments together. Global doc ids are the row numbers
+# of the vector index, so results can be joined with chunk records.
+#
+# Queries ignore stopwords and terms whose idf is below `min_idf` (by default,
+# terms in about half of the chunks or more), so "What is the capital of France?" does not
+# match every chunk that says "what" or "the". Stopwords are still indexed.
+
+import os
+import json
+import shutil
+import unicodedata
+from collections import Counter
+import numpy as np
+
+LEXICAL_DIR = "lexical"  # subdirectory of the RAG index directory
+MANIFEST_FILE = "segments.json"
+JOINERS = set("-/._")
+STOPWORDS = frozenset("""
+a about after all also am an and any are as at be been before being but by can could did do does
+for from had has have how i if in into is it its me my no not of on or our should so than that the
+their them then there these they this to was we were what when where which who whom why will with
+would you your
+का की के को में से पर है हैं था थी थे और या भी तो ही एक यह वह ये वो क्या कैसे कब कहाँ कौन क्यों मैं
+मुझे मेरा हम आप कि जो ने लिए साथ बारे
+""".split())
+
+
+def tokenize(text):
+    """Unicode-aware tokenizer for English, Hindi and other Indic scripts.
+
+    Letters, digits and combining marks (matras, viramas, nuktas) form words,
+    so Devanagari words are not split at vowel signs. Zero-width joiners are
+    dropped. Compounds like "SF-12" or "B.Tech" yield their parts plus the
+    joined form ("sf", "12", "sf12").
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    tokens, parts, word = [], [], []
+
+    def end_word():
+        if word:
+            parts.append("".join(word))
+            word.clear()
+
+    def end_compound():
+        end_word()
+        tokens.extend(parts)
+        if len(parts) > 1:
+            tokens.append("".join(parts))
+        parts.clear()
+
+    for i, ch in enumerate(text):
+        category = unicodedata.category(ch)
+        if category[0] in "LMN":
+            word.append(ch)
+        elif category == "Cf":
+            continue
+        elif ch in JOINERS and word and i + 1 < len(text) and unicodedata.category(text[i + 1])[0] in "LN":
+            end_word()
+        else:
+            end_compound()
+    end_compound()
+    return tokens
+
+
+def smallest_uint(max_value):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+class Segment:
+    """Read-only view of one segment; arrays are memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as f:
+            self.terms = json.load(f)
+        self.doc_ids = self._load("doc_ids.u64", np.uint64)
+        self.doclens = self._load("doclens.u32", np.uint32)
+        self.deltas = self._load("deltas.bin", np.dtype(self.meta["delta_dtype"]))
+        self.tfs = self._load("tfs.bin", np.dtype(self.meta["tf_dtype"]))
+
+    def _load(self, name, dtype):
+        path = os.path.join(self.path, name)
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    @property
+    def num_docs(self):
+        return self.meta["num_docs"]
+
+    def postings(self, term):
+        """(local doc ids, term frequencies) for `term`, or None."""
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        offset, df = entry
+        local = np.cumsum(self.deltas[offset:offset + df], dtype=np.int64)
+        return local, self.tfs[offset:offset + df].astype(np.float32)
+
+
+def write_segment(path, doc_ids, doclens, postings):
+    """Writes a segment. `postings` maps term -> (ascending local ids, tfs)."""
+    os.makedirs(path)
+    terms, delta_parts, tf_parts = {}, [], []
+    offset = 0
+    for term in sorted(postings):
+        local, tfs = postings[term]
+        local = np.asarray(local, dtype=np.int64)
+        delta_parts.append(np.diff(local, prepend=0))
+        tf_parts.append(np.asarray(tfs, dtype=np.int64))
+        terms[term] = [offset, len(local)]
+        offset += len(local)
+
+    deltas = np.concatenate(delta_parts) if delta_parts else np.empty(0, dtype=np.int64)
+    tfs = np.concatenate(tf_parts) if tf_parts else np.empty(0, dtype=np.int64)
+    delta_dtype = smallest_uint(int(deltas.max()) if len(deltas) else 0)
+    tf_dtype = smallest_uint(int(tfs.max()) if len(tfs) else 0)
+
+    np.asarray(doc_ids, dtype=np.uint64).tofile(os.path.join(path, "doc_ids.u64"))
+    np.asarray(doclens, dtype=np.uint32).tofile(os.path.join(path, "doclens.u32"))
+    deltas.astype(delta_dtype).tofile(os.path.join(path, "deltas.bin"))
+    tfs.astype(tf_dtype).tofile(os.path.join(path, "tfs.bin"))
+    with open(os.path.join(path, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False, separators=(",", ":"))
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "num_docs": len(doc_ids),
+            "total_len": int(np.sum(doclens, dtype=np.int64)),
+            "delta_dtype": np.dtype(delta_dtype).name,
+            "tf_dtype": np.dtype(tf_dtype).name,
+        }, f)
+
+
+class LexicalIndex:
+    """Segmented BM25 index with a query API for /chat."""
+
+    def __init__(self, path, k1=1.2, b=0.75, merge_threshold=8, min_idf=0.7):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.min_idf = min_idf
+        self.merge_threshold = merge_threshold
+        self._manifest_mtime = None
+        self._segments = []
+
+    # --- Manifest ---
+    def _manifest(self):
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": [], "next_id": 1}
+
+    def _write_manifest(self, manifest):
+        tmp = os.path.join(self.path, MANIFEST_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.path, MANIFEST_FILE))
+
+    def segments(self):
+        """Live segments, reopened when the writer publishes a new manifest."""
+        try:
+            mtime = os.stat(os.path.join(self.path, MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if mtime != self._manifest_mtime:
+            names = self._manifest()["segments"]
+            self._segments = [Segment(os.path.join(self.path, name)) for name in names]
+            self._manifest_mtime = mtime
+        return self._segments
+
+    def __len__(self):
+        return sum(seg.num_docs for seg in self.segments())
+
+    def size_bytes(self):
+        total = 0
+        for root, _, names in os.walk(self.path):
+            total += sum(os.path.getsize(os.path.join(root, n)) for n in names)
+        return total
+
+    # --- Writing ---
+    def add_batch(self, docs):
+        """Writes one immutable segment for `docs`, a list of (doc_id, text)."""
+        if not docs:
+            return None
+        os.makedirs(self.path, exist_ok=True)
+        docs = sorted(docs)
+        postings = {}
+        doclens = np.empty(len(docs), dtype=np.uint32)
+        for local, (_, text) in enumerate(docs):
+            tokens = tokenize(text)
+            doclens[local] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                entry = postings.setdefault(term, ([], []))
+                entry[0].append(local)
+                entry[1].append(tf)
+
+        manifest = self._manifest()
+        name = f"seg_{manifest['next_id']:06d}"
+        write_segment(os.path.join(self.path, name), [d for d, _ in docs], doclens, postings)
+        manifest["segments"].append(name)
+        manifest["next_id"] += 1
+        self._write_manifest(manifest)
+        return name
+
+    def needs_merge(self):
+        return len(self._manifest()["segments"]) > self.merge_threshold
+
+    def merge(self):
+        """Merges all live segments into one; meant to run in the background.
+
+        Readers keep serving the old segments until the manifest is swapped.
+        """
+        manifest = self._manifest()
+        if len(manifest["segments"]) < 2:
+            return None
+        segments = [Segment(os.path.join(self.path, name)) for name in manifest["segments"]]
+        segments.sort(key=lambda seg: int(seg.doc_ids[0]) if seg.num_docs else 0)
+
+        bases, base = [], 0
+        for seg in segments:
+            bases.append(base)
+            base += seg.num_docs
+        doc_ids = np.concatenate([np.asarray(seg.doc_ids) for seg in segments])
+        doclens = np.concatenate([np.asarray(seg.doclens) for seg in segments])
+
+        postings = {}
+        for seg, seg_base in zip(segments, bases):
+            for term in seg.terms:
+                local, tfs = seg.postings(term)
+                entry = postings.setdefault(term, ([], []))
+                entry[0].append(local + seg_base)
+                entry[1].append(tfs)
+        postings = {t: (np.concatenate(l), np.concatenate(f)) for t, (l, f) in postings.items()}
+
+        name = f"seg_{manifest['next_id']:06d}"
+        write_segment(os.path.join(self.path, name), doc_ids, doclens, postings)
+        old = manifest["segments"]
+        self._write_manifest({"segments": [name], "next_id": manifest["next_id"] + 1})
+        for old_name in old:
+            shutil.rmtree(os.path.join(self.path, old_name), ignore_errors=True)
+        return name
+
+    # --- Querying ---
+    def search(self, query, k=10):
+        """Top-k (doc_id, score) pairs by BM25 for a free-text query.
+
+        Only terms that are not stopwords and have an idf of at least
+        `min_idf` are scored, so every hit shares a selective term.
+        """
+        segments = self.segments()
+        terms = [t for t in dict.fromkeys(tokenize(query)) if t not in STOPWORDS]
+        if not segments or not terms:
+            return []
+        num_docs = sum(seg.num_docs for seg in segments)
+        avgdl = sum(seg.meta["total_len"] for seg in segments) / max(num_docs, 1)
+
+        per_segment = [{t: seg.postings(t) for t in terms} for seg in segments]
+        df = {t: sum(len(p[t][0]) for p in per_segment if p[t] is not None) for t in terms}
+        idf = {t: np.log(1 + (num_docs - df[t] + 0.5) / (df[t] + 0.5)) for t in terms}
+        terms = [t for t in terms if df[t] and idf[t] >= self.min_idf]
+        if not terms:
+            return []
+
+        candidates_ids, candidates_scores = [], []
+        for seg, postings in zip(segments, per_segment):
+            scores = np.zeros(seg.num_docs, dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * np.asarray(seg.doclens, dtype=np.float32) / avgdl)
+            hit = False
+            for term in terms:
+                if postings[term] is None:
+                    continue
+                hit = True
+                local, tf = postings[term]
+                scores[local] += idf[term] * tf * (self.k1 + 1) / (tf + norm[local])
+            if not hit:
+                continue
+            kk = min(k, seg.num_docs)
+            top = np.argpartition(scores, seg.num_docs - kk)[-kk:]
+            top = top[scores[top] > 0]
+            candidates_ids.append(np.asarray(seg.doc_ids)[top])
+            candidates_scores.append(scores[top])
+
+        if not candidates_ids:
+            return []
+        ids = np.concatenate(candidates_ids)
+        scores = np.concatenate(candidates_scores)
+        order = np.argsort(-scores)[:k]
+        return [(int(ids[i]), float(scores[i])) for i in order]
@@ -0,0 +1,249 @@
+# llm_scheduler.py
+# Admission control between /chat and the Gemini client.
+#
+# - At most `max_concurrency` generations run at once.
+# - Requests-per-minute and tokens-per-minute token buckets keep us under the
+#   API quota instead of letting every request fail with 429 at peak.
+# - Excess requests wait in a priority queue (lower number first, FIFO within
+#   a priority), bounded both in length and in wait time.
+# - Transient upstream errors are retried with jittered exponential backoff,
+#   as long as nothing has been streamed to the student yet.
+
+import time
+import heapq
+import random
+import asyncio
+import functools
+import itertools
+from collections import deque
+
+TRANSIENT_MARKERS = ("429", "503", "resource has been exhausted", "unavailable", "deadline exceeded")
+
+# Priorities used by main.py
+PRIORITY_FOLLOW_UP = 0
+PRIORITY_NEW = 1
+PRIORITY_BACKGROUND = 2
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request is shed: the queue is full or the wait timed out."""
+
+
+@functools.cache
+def transient_errors():
+    """google.api_core exception types, imported on the first error (slow import)."""
+    try:
+        from google.api_core import exceptions as google_exceptions
+    except ImportError:
+        return ()
+    return (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError,
+    )
+
+
+def is_transient(error):
+    if transient_errors() and isinstance(error, transient_errors()):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in TRANSIENT_MARKERS)
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to `per_minute`; 0 = unlimited."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def has(self, amount):
+        return not self.capacity or self.level >= min(amount, self.capacity)
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def seconds_until(self, amount):
+        if self.has(amount):
+            return 0.0
+        return (min(amount, self.capacity) - self.level) / self.rate
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency=64, requests_per_minute=0, tokens_per_minute=0,
+                 max_queue=500, max_wait=20.0, max_retries=3, backoff_base=0.5, backoff_max=8.0):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._waiters = []  # heap of [priority, seq, cost, future, enqueued_at]
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._queued = 0  # live waiters; the heap may still hold abandoned ones
+        self._refill_timer = None
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.failures = 0
+        self._waits = deque(maxlen=1000)
+
+    # --- Admission ---
+    async def acquire(self, priority=PRIORITY_NEW, cost_tokens=0):
+        """Waits for a slot and quota; returns the seconds spent queued.
+
+        Raises SchedulerBusy if shed.
+        """
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerBusy("queue full")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), cost_tokens, future, time.monotonic()])
+        self._queued += 1
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._queued -= 1
+            self.timeouts += 1
+            raise SchedulerBusy(f"waited more than {self.max_wait}s")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Cancelled right after being admitted: hand the slot back
+                self.release()
+            else:
+                self._queued -= 1
+            raise
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def slot(self, priority=PRIORITY_NEW, cost_tokens=0):
+        return _Slot(self, priority, cost_tokens)
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        while self._waiters and self._in_flight < self.max_concurrency:
+            priority, _, cost, future, enqueued_at = self._waiters[0]
+            if future.done():  # timed out or cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            if not (self.requests.has(1) and self.tokens.has(cost)):
+                delay = max(self.requests.seconds_until(1), self.tokens.seconds_until(cost))
+                self._schedule_refill(delay)
+                break
+            heapq.heappop(self._waiters)
+            self._queued -= 1
+            self.requests.take(1)
+            self.tokens.take(cost)
+            self._in_flight += 1
+            self.admitted += 1
+            self._waits.append(now - enqueued_at)
+            future.set_result(now - enqueued_at)
+
+    def _schedule_refill(self, delay):
+        if self._refill_timer is None or self._refill_timer.cancelled():
+            def fire():
+                self._refill_timer = None
+                self._dispatch()
+            self._refill_timer = asyncio.get_running_loop().call_later(max(delay, 0.01), fire)
+
+    # --- Streaming with retries ---
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def stream(self, make_stream, priority=PRIORITY_NEW, cost_tokens=0, timings=None):
+        """Yields chunks from `await make_stream()` under admission control.
+
+        Transient errors are retried only before the first chunk; after that
+        a retry would repeat text the student has already seen. If given,
+        `timings` receives "queue_wait" and "retries".
+        """
+        async with self.slot(priority, cost_tokens) as waited:
+            if timings is not None:
+                timings["queue_wait"] = waited
+            attempt = 0
+            while True:
+                streamed = False
+                try:
+                    response = await make_stream()
+                    async for chunk in response:
+                        streamed = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    if streamed or attempt >= self.max_retries or not is_transient(e):
+                        self.failures += 1
+                        raise
+                    attempt += 1
+                    self.retries += 1
+                    if timings is not None:
+                        timings["retries"] = attempt
+                    await asyncio.sleep(self.backoff(attempt))
+
+    async def call(self, make_call, priority=PRIORITY_BACKGROUND, cost_tokens=0):
+        """Non-streaming call under admission control, with the same retries."""
+        async with self.slot(priority, cost_tokens):
+            attempt = 0
+            while True:
+                try:
+                    return await make_call()
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_transient(e):
+                        self.failures += 1
+                        raise
+                    attempt += 1
+                    self.retries += 1
+                    await asyncio.sleep(self.backoff(attempt))
+
+    # --- Metrics ---
+    def stats(self):
+        waits = sorted(self._waits)
+
+        def pct(p):
+            return round(waits[int((len(waits) - 1) * p)] * 1000, 1) if waits else 0.0
+
+        return {
+            "in_flight": self._in_flight,
+            "queue_depth": self._queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "failures": self.failures,
+            "wait_ms_p50": pct(0.5),
+            "wait_ms_p95": pct(0.95),
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+class _Slot:
+    def __init__(self, scheduler, priority, cost_tokens):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.cost_tokens = cost_tokens
+
+    async def __aenter__(self):
+        return await self.scheduler.acquire(self.priority, self.cost_tokens)
+
+    async def __aexit__(self, *exc):
+        self.scheduler.release()
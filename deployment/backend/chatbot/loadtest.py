@@ -0,0 +1,231 @@
+# loadtest.py
+# Concurrent load generator for /chat.
+#
+# Replays scripted multi-turn conversations with an open-loop (Poisson)
+# arrival rate and a cap on concurrent conversations. It measures time to
+# first byte, inter-chunk gaps, total stream time and error rate, and reports
+# p50/p95/p99.
+#
+# Usage:
+#   # Offline: spawn the app with in-memory sessions and a fake Gemini
+#   python loadtest.py --spawn --conversations 200 --concurrency 50 --rate 20
+#   # Against a running server
+#   python loadtest.py --url http://127.0.0.1:8000 --script conversations.json
+#   # Save a baseline, then compare a later run against it
+#   python loadtest.py --spawn --save-baseline baseline.json
+#   python loadtest.py --spawn --baseline baseline.json --max-regression 0.15
+#
+# A script file is a JSON list of conversations, each a list of messages.
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import httpx
+
+DEFAULT_SCRIPT = [
+    ["What is the last date for fee payment?", "Can I pay it in two installments?", "Is there a late fee?"],
+    ["How do I apply for the post-matric scholarship?", "Which documents are required?"],
+    ["When does the timetable for the mid-semester exams come out?"],
+    ["छात्रवृत्ति फॉर्म कब तक जमा करना है?", "क्या यह ऑनलाइन जमा हो सकता है?"],
+    ["What are the hostel gate timings?", "Who do I contact for a late entry pass?", "Thanks"],
+]
+
+# Metrics compared against a baseline; all are "lower is better"
+COMPARED = ["ttfb_p50", "ttfb_p95", "total_p50", "total_p95", "gap_p95", "error_rate"]
+
+# Bodies the backend streams instead of an answer (see main.py)
+ERROR_PREFIXES = ("An error occurred", "Shiksha Saathi is answering a lot of questions")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class Results:
+    def __init__(self):
+        self.ttfb = []
+        self.gaps = []
+        self.totals = []
+        self.turns = 0
+        self.errors = 0
+        self.error_samples = []
+
+    def error(self, message):
+        self.errors += 1
+        if len(self.error_samples) < 5:
+            self.error_samples.append(message)
+
+    def summary(self, elapsed):
+        def ms(values, pct):
+            value = percentile(values, pct)
+            return round(value * 1000, 1) if value is not None else None
+
+        report = {"turns": self.turns, "errors": self.errors, "elapsed_s": round(elapsed, 2)}
+        report["error_rate"] = round(self.errors / self.turns, 4) if self.turns else 0.0
+        report["turns_per_s"] = round(self.turns / elapsed, 2) if elapsed else 0.0
+        for name, values in (("ttfb", self.ttfb), ("gap", self.gaps), ("total", self.totals)):
+            for pct in (50, 95, 99):
+                report[f"{name}_p{pct}"] = ms(values, pct)
+        report["error_samples"] = self.error_samples
+        return report
+
+
+async def run_turn(client, base_url, token, message, results):
+    """Runs one turn; returns the session token to send with the next one."""
+    results.turns += 1
+    started = time.perf_counter()
+    first = last = None
+    body = []
+    try:
+        async with client.stream(
+            "POST", f"{base_url}/chat", json={"session_token": token, "message": message}
+        ) as response:
+            if response.status_code != 200:
+                results.error(f"HTTP {response.status_code}")
+                return token
+            token = response.headers.get("X-Session-Token", token)
+            async for chunk in response.aiter_text():
+                now = time.perf_counter()
+                if first is None:
+                    first = now
+                    results.ttfb.append(now - started)
+                else:
+                    results.gaps.append(now - last)
+                last = now
+                body.append(chunk)
+    except httpx.HTTPError as e:
+        results.error(f"{type(e).__name__}: {e}")
+        return token
+    text = "".join(body)
+    if first is None or text.startswith(ERROR_PREFIXES):
+        results.error(text[:120] or "empty response")
+        return token
+    results.totals.append(time.perf_counter() - started)
+    return token
+
+
+async def run_conversation(client, base_url, script, think_time, results):
+    # The first answer issues the session token, as in the widget
+    token = None
+    for message in script:
+        token = await run_turn(client, base_url, token, message, results)
+        if think_time:
+            await asyncio.sleep(random.expovariate(1 / think_time))
+
+
+async def run_load(base_url, scripts, conversations, concurrency, rate, think_time, timeout):
+    results = Results()
+    limiter = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def one(i):
+            async with limiter:
+                await run_conversation(client, base_url, scripts[i % len(scripts)], think_time, results)
+
+        started = time.perf_counter()
+        tasks = []
+        for i in range(conversations):
+            tasks.append(asyncio.create_task(one(i)))
+            if rate:
+                await asyncio.sleep(random.expovariate(rate))
+        await asyncio.gather(*tasks)
+        return results.summary(time.perf_counter() - started)
+
+
+def compare(report, baseline, max_regression, keys=COMPARED):
+    """Relative change of each compared metric; returns (rows, regressed)."""
+    rows, regressed = [], False
+    for key in keys:
+        old, new = baseline.get(key), report.get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+        flag = change > max_regression and new - old > (0.005 if key == "error_rate" else 1.0)
+        regressed = regressed or flag
+        rows.append(f"{key:12} {old:>10} -> {new:>10}  {change:+.1%}{'  REGRESSION' if flag else ''}")
+    return rows, regressed
+
+
+# --- Spawned offline server ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_server():
+    """Runs main:app in a background thread with in-memory sessions and a fake Gemini."""
+    os.environ.setdefault("SESSION_STORE", "memory")
+    os.environ.setdefault("GEMINI_FAKE", "1")
+    import uvicorn
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Shiksha Saathi chat backend.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="Start an offline server (fake Gemini, in-memory store)")
+    parser.add_argument("--script", help="JSON file: list of conversations, each a list of messages")
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="Max concurrent conversations")
+    parser.add_argument("--rate", type=float, default=10.0, help="Conversation arrivals per second (0 = all at once)")
+    parser.add_argument("--think", type=float, default=0.0, help="Mean think time between turns (s)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--save-baseline", help="Write this run's report to a JSON file")
+    parser.add_argument("--baseline", help="Compare against a saved report")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    scripts = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            scripts = json.load(f)
+
+    base_url, server = args.url, None
+    if args.spawn:
+        base_url, server = spawn_server()
+
+    report = asyncio.run(run_load(
+        base_url, scripts, args.conversations, args.concurrency, args.rate, args.think, args.timeout
+    ))
+    if server:
+        server.should_exit = True
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            rows, regressed = compare(report, json.load(f), args.max_regression)
+        print("\n".join(rows))
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,45 @@
 # test.py (Updated for Vercel Deployment)
 
 import os
+import time
+import asyncio
 import datetime
 import base64
 import json
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+import hmac
+import uuid
+import tempfile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, BackgroundTasks, Header, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import google.generativeai as genai
-import firebase_admin
-from firebase_admin import credentials, firestore
 from dotenv import load_dotenv
+from history_cache import SessionHistoryCache, TurnCounter
+from session_store import FirestoreSessionStore, InMemorySessionStore, build_chat_history
+from context_builder import ContextBuilder, estimate_tokens, summarize_turns
+from answer_cache import AnswerCache, iter_chunks
+from embeddings import get_embedder
+from vector_index import VectorIndex, Retriever, format_context
+from lexical_index import LEXICAL_DIR, LexicalIndex
+from ingest import SUPPORTED_EXTENSIONS, ingest
+from persistence import TurnWriter
+from analytics import (
+    AnalyticsRollup, FirestoreAnalyticsStore, InMemoryAnalyticsStore, with_averages, hour_key, day_key,
+)
+from lazy import Lazy
+from faq_snapshot import FaqSnapshot, etag_matches, rebuild as rebuild_faq_snapshot
+from session_tokens import SessionSigner
+from rate_limit import ClientRateLimiter, client_key
+from prompt_cache import (
+    PromptPrefix, PrefixCache, GeminiPrefixBackend, FakePrefixBackend, shared_context_contents,
+)
+from replay_buffer import MEDIA_TYPES, ReplayBuffer, stream_format, iter_frames
+from metrics import Registry, Trace, SamplingProfiler, log_event
+from llm_scheduler import (
+    LLMScheduler, SchedulerBusy, is_transient, PRIORITY_FOLLOW_UP, PRIORITY_NEW, PRIORITY_BACKGROUND,
+)
 
 # --- Load Environment Variables ---
 load_dotenv()
@@ -19,46 +47,288 @@ load_dotenv()
 # --- Pydantic Models ---
 class ChatRequest(BaseModel):
     message: str
-    session_id: str
+    session_token: str | None = None
+    session_id: str | None = None  # unsigned, from older widgets
 
 class SessionRequest(BaseModel):
-    session_id: str
+    session_id: str | None = None
+
+class AnalyticsPage(BaseModel):
+    items: list[dict]
+    next_cursor: str | None = None
+
+class ProfilingRequest(BaseModel):
+    sample_rate: float
 
 # --- App Initialization ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    if os.getenv("WARMUP_ON_START") == "1":
+        asyncio.get_running_loop().create_task(warm_up())
+    yield
+    # Let framed generations finish so their turns are saved
+    if generations:
+        await asyncio.wait(generations, timeout=float(os.getenv("SHUTDOWN_GRACE_SECONDS", "10")))
+    # Commit turns still queued by the write-behind writer before exiting
+    if turn_writer.peek():
+        await turn_writer.peek().stop()
+    if analytics.peek():
+        await analytics.peek().stop()
+    if prompt_cache.peek():
+        await prompt_cache.peek().close()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["X-Session-Id", "X-Session-Token", "X-Stream-Id", "X-Trace-Id", "ETag"],
 )
 
+# /admin/* and cache control need ADMIN_TOKEN, sent as "Authorization: Bearer
+# <token>" or X-Admin-Token. Without ADMIN_TOKEN set they are refused.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+async def require_admin(authorization: str | None = Header(None), x_admin_token: str | None = Header(None)):
+    token = x_admin_token or ""
+    if authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 # --- Firebase & Gemini Initialization (MODIFIED FOR VERCEL) ---
+# Nothing heavy happens at import time: the clients are built on first use
+# (or by /warmup), so a cold start can answer health checks immediately.
 
 # 1. Handle Firebase Credentials from Environment Variable
-try:
-    # Get the Base64 encoded credentials string from Vercel's environment variables
-    firebase_creds_base64 = os.getenv("FIREBASE_CREDS_BASE64")
-    
-    # Decode the Base64 string into a standard JSON string
-    firebase_creds_json_str = base64.b64decode(firebase_creds_base64).decode('utf-8')
-    
-    # Parse the JSON string into a Python dictionary
-    firebase_creds_dict = json.loads(firebase_creds_json_str)
-    
-    # Initialize the Firebase app with the dictionary credentials
-    cred = credentials.Certificate(firebase_creds_dict)
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    print("Firebase Firestore initialized successfully from environment variable.")
-
-except Exception as e:
-    print(f"FATAL: Could not initialize Firebase Admin SDK. Error: {e}")
-    # In a real app, you might want to handle this more gracefully
-    db = None
+def init_firestore():
+    try:
+        import firebase_admin
+        from firebase_admin import credentials, firestore_async
+
+        # Get the Base64 encoded credentials string from Vercel's environment variables
+        firebase_creds_base64 = os.getenv("FIREBASE_CREDS_BASE64")
+
+        # Decode the Base64 string into a standard JSON string
+        firebase_creds_json_str = base64.b64decode(firebase_creds_base64).decode('utf-8')
+
+        # Parse the JSON string into a Python dictionary
+        firebase_creds_dict = json.loads(firebase_creds_json_str)
+
+        # Initialize the Firebase app with the dictionary credentials
+        cred = credentials.Certificate(firebase_creds_dict)
+        firebase_admin.initialize_app(cred)
+        # Async client so Firestore round trips never block the event loop
+        db = firestore_async.client()
+        print("Firebase Firestore (async) initialized successfully from environment variable.")
+        return db
+
+    except Exception as e:
+        print(f"FATAL: Could not initialize Firebase Admin SDK. Error: {e}")
+        # In a real app, you might want to handle this more gracefully
+        return None
+
+firestore_db = Lazy(init_firestore, imports=("firebase_admin.firestore_async",))
+
+# --- Metrics ---
+# Per-stage latency of /chat and related counters, served on /metrics
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "chat_stage_seconds", "Time spent in each stage of /chat.", labels=("stage",)
+)
+CHAT_REQUESTS = metrics.counter("chat_requests_total", "Chat requests by outcome.", labels=("outcome",))
+CHAT_CHUNKS = metrics.histogram(
+    "chat_response_chunks", "Chunks streamed per answer.", buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
+CHAT_BYTES = metrics.histogram(
+    "chat_response_bytes", "Bytes streamed per answer.", buckets=(256, 1024, 4096, 16384, 65536)
+)
+PERSIST_COMMIT_SECONDS = metrics.histogram("persist_commit_seconds", "Latency of turn batch commits.")
+PERSIST_BATCH_TURNS = metrics.histogram(
+    "persist_batch_turns", "Turns per batch commit.", buckets=(1, 2, 5, 10, 25, 50, 100, 250)
+)
+
+def observe_commit(seconds, turns):
+    PERSIST_COMMIT_SECONDS.observe(seconds)
+    PERSIST_BATCH_TURNS.observe(len(turns))
+    # Dashboard rollups are updated from exactly the turns that were saved
+    if analytics.peek():
+        analytics.peek().add_turns(turns)
+
+# Opt-in stack sampling of a fraction of /chat requests; the rate can be
+# changed at runtime through /admin/profiling
+profiler = SamplingProfiler(
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+)
+
+# Sessions are stored as a header document plus fixed-size message pages.
+# SESSION_STORE=memory keeps them in process memory for offline runs.
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", "20"))
+SESSION_STORE = os.getenv("SESSION_STORE", "firestore")
+
+def create_session_store():
+    if SESSION_STORE == "memory":
+        return InMemorySessionStore(page_size=SESSION_PAGE_SIZE)
+    db = firestore_db.get()
+    return FirestoreSessionStore(db, page_size=SESSION_PAGE_SIZE) if db else None
+
+session_store = Lazy(create_session_store, imports=firestore_db.imports if SESSION_STORE != "memory" else ())
+
+# Sessions are named by signed tokens issued without a database round trip;
+# the session document is created with its first stored turn. Unsigned
+# session ids from older widgets are accepted only with ALLOW_UNSIGNED_SESSIONS=1.
+# Every instance must share SESSION_SECRET, so it is required unless the
+# sessions themselves are per-process (SESSION_STORE=memory).
+if not os.getenv("SESSION_SECRET") and SESSION_STORE != "memory":
+    raise RuntimeError("SESSION_SECRET must be set (comma-separated to rotate) when SESSION_STORE is not 'memory'")
+session_signer = SessionSigner(
+    os.getenv("SESSION_SECRET"),
+    ttl_seconds=float(os.getenv("SESSION_TOKEN_TTL_DAYS", "30")) * 86400,
+)
+ALLOW_UNSIGNED_SESSIONS = os.getenv("ALLOW_UNSIGNED_SESSIONS", "0") == "1"
+
+def resolve_session(request):
+    """(session_id, token) for a chat request; token is set if a new one was issued.
+
+    A missing, forged or expired token starts a new session.
+    """
+    if request.session_token:
+        session_id = session_signer.verify(request.session_token)
+        if session_id:
+            return session_id, None
+    elif request.session_id and ALLOW_UNSIGNED_SESSIONS:
+        return request.session_id, None
+    return session_signer.issue()
+
+# Dashboard analytics: hourly/daily rollups and per-question counts, updated
+# from committed turns and flushed every ANALYTICS_FLUSH_SECONDS.
+def create_analytics():
+    if os.getenv("ANALYTICS", "1") != "1":
+        return None
+    if SESSION_STORE == "memory":
+        store = InMemoryAnalyticsStore()
+    else:
+        db = firestore_db.get()
+        if not db:
+            return None
+        store = FirestoreAnalyticsStore(db)
+    return AnalyticsRollup(store, flush_interval=float(os.getenv("ANALYTICS_FLUSH_SECONDS", "10")))
+
+analytics = Lazy(create_analytics)
 
+# Completed turns are written behind the response: queued, then committed in
+# batches by size or time. Turns that cannot be committed after retries are
+# spilled to a local journal and replayed once the database is back. Each
+# worker process spills to its own file next to PERSIST_JOURNAL (see
+# persistence.py), so workers sharing the path do not lose each other's turns.
+def create_turn_writer():
+    store = session_store.get()
+    analytics.get()
+    return TurnWriter(
+        store,
+        max_batch=int(os.getenv("PERSIST_MAX_BATCH", "100")),
+        flush_interval=float(os.getenv("PERSIST_FLUSH_INTERVAL", "0.25")),
+        max_retries=int(os.getenv("PERSIST_MAX_RETRIES", "4")),
+        journal_path=os.getenv("PERSIST_JOURNAL", os.path.join(tempfile.gettempdir(), "shiksha_saathi_turns.journal")),
+        on_commit=observe_commit,
+        max_queued=int(os.getenv("PERSIST_MAX_QUEUED", "10000")),
+    ) if store else None
+
+turn_writer = Lazy(create_turn_writer)
 
 # 2. Handle Gemini API Key from Environment Variable
 gemini_api_key = os.getenv("GEMINI_API_KEY")
 
+# Admission control for Gemini calls: concurrency cap, RPM/TPM budgets (0 =
+# unlimited), a bounded priority queue and retries of transient errors.
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "64"))
+llm_scheduler = LLMScheduler(
+    max_concurrency=MAX_CONCURRENT_GENERATIONS,
+    requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+    tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", "500")),
+    max_wait=float(os.getenv("LLM_MAX_WAIT_SECONDS", "20")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+)
+# Expected answer length, charged against the tokens-per-minute budget
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "400"))
+FOLLOW_UP_MAX_CHARS = 280
+
+BUSY_MESSAGE = "Shiksha Saathi is answering a lot of questions right now. Please try again in a moment."
+ERROR_MESSAGE = "An error occurred while preparing the answer. Please try again."
+
+# Per-process cache of already-built chat history for active sessions
+history_cache = SessionHistoryCache(
+    max_sessions=int(os.getenv("HISTORY_CACHE_MAX_SESSIONS", "1000")),
+    max_bytes=int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl_seconds=int(os.getenv("HISTORY_CACHE_TTL_SECONDS", "1800")),
+)
+# Turn indexes claimed by this process, so concurrent requests of one session
+# get consecutive slots instead of both using the turn count they loaded
+turn_counter = TurnCounter(max_sessions=int(os.getenv("TURN_COUNTER_MAX_SESSIONS", "10000")))
+
+# Recent turns are sent verbatim within a token budget; older ones are folded
+# into a rolling summary stored on the session document.
+context_builder = ContextBuilder(
+    max_turns=int(os.getenv("CONTEXT_MAX_TURNS", "6")),
+    token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000")),
+    summary_batch_turns=int(os.getenv("SUMMARY_BATCH_TURNS", "4")),
+)
+context_stats = {"requests": 0, "tokens_full": 0, "tokens_used": 0, "tokens_saved": 0}
+summaries_in_progress = set()
+
+# Answers to first questions of a session (the repeated campus FAQs) are reused;
+# follow-ups depend on the conversation so they always go to the model.
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000")),
+    ttl_seconds=int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(6 * 3600))),
+    near_duplicates=os.getenv("ANSWER_CACHE_NEAR_DUPLICATES", "0") == "1",
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.85")),
+)
+
+# Top questions with their answers, built by faq_snapshot.py (or
+# /admin/faq/rebuild) and served to the widget, which answers matching first
+# questions from it without calling /chat.
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+faq_snapshot = FaqSnapshot(os.getenv("FAQ_SNAPSHOT_PATH", os.path.join(DATA_DIR, "faq_snapshot.json")))
+FAQ_CURATED_PATH = os.getenv("FAQ_CURATED_PATH", os.path.join(DATA_DIR, "faq_curated.json"))
+FAQ_MAX_AGE_SECONDS = int(os.getenv("FAQ_MAX_AGE_SECONDS", "300"))
+# Each FAQ report saves a turn and counts toward the rebuild, so reports are
+# limited per client address
+faq_report_limiter = ClientRateLimiter(int(os.getenv("FAQ_REPORTS_PER_HOUR", "30")))
+
+# Framed /chat streams (SSE/NDJSON) are generated into a replay buffer, so a
+# client that loses its connection can resume from its last byte offset.
+replay_buffer = ReplayBuffer(
+    max_streams=int(os.getenv("REPLAY_MAX_STREAMS", "1000")),
+    max_bytes=int(os.getenv("REPLAY_MAX_BYTES", str(16 * 1024 * 1024))),
+    ttl_seconds=int(os.getenv("REPLAY_TTL_SECONDS", "300")),
+)
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "10"))
+STREAM_COALESCE_SECONDS = float(os.getenv("STREAM_COALESCE_MS", "30")) / 1000
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "256"))
+generations = set()  # running framed generations
+
+# RAG: chunk embeddings live in a memory-mapped matrix shared by all workers.
+# Retrieval is skipped while the index is empty.
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join(os.path.dirname(__file__), "data", "index"))
+RAG_DIM = int(os.getenv("RAG_EMBEDDING_DIM", "384"))
+retriever = Retriever(
+    VectorIndex(RAG_INDEX_DIR, dim=RAG_DIM),
+    get_embedder(os.getenv("RAG_EMBEDDER", "hashing"), dim=RAG_DIM),
+    top_k=int(os.getenv("RAG_TOP_K", "4")),
+    min_score=float(os.getenv("RAG_MIN_SCORE", "0.2")),
+    dense_only_score=float(os.getenv("RAG_DENSE_ONLY_SCORE", "0.3")),
+    lexical=LexicalIndex(os.path.join(RAG_INDEX_DIR, LEXICAL_DIR), min_idf=float(os.getenv("RAG_MIN_IDF", "0.7"))),
+)
+
+# Uploaded documents are kept here and ingested into RAG_INDEX_DIR.
+# INGEST_WORKERS=0 extracts inline (for hosts without multiprocessing).
+DOCS_DIR = os.getenv("DOCS_DIR", os.path.join(os.path.dirname(__file__), "data", "documents"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS")) if os.getenv("INGEST_WORKERS") else None
+ingest_lock = asyncio.Lock()
+
 # 3. Define the AI's persona and instructions
 persona_instruction = """
 My Purpose and Vision
@@ -111,79 +381,644 @@ As a prototype, your capabilities are currently limited. It is crucial that you
         Instruction: If asked for current information (e.g., "What is the news today?"), you must state that you cannot access the live web and can only provide information from your existing knowledge base.
 """
 
-if not gemini_api_key:
-    print("FATAL: GEMINI_API_KEY environment variable not set.")
-    model = None
-else:
+CHAT_MODEL_NAME = "gemini-2.5-flash-lite"
+
+# Optional grounding text shared by every conversation (e.g. institution facts)
+SHARED_CONTEXT_PATH = os.getenv("SHARED_CONTEXT_PATH")
+SHARED_CONTENTS = []
+if SHARED_CONTEXT_PATH and os.path.exists(SHARED_CONTEXT_PATH):
+    with open(SHARED_CONTEXT_PATH, "r", encoding="utf-8") as f:
+        SHARED_CONTENTS = shared_context_contents(f.read())
+
+# Persona + shared context, registered once as a cached prompt prefix
+PROMPT_PREFIX = PromptPrefix(persona_instruction, SHARED_CONTENTS)
+
+def create_models():
+    """Returns (model, summary_model); both None if Gemini is not configured."""
+    if os.getenv("GEMINI_FAKE") == "1":
+        # Offline stand-in for load tests and local runs (see fake_gemini.py)
+        from fake_gemini import FakeGenerativeModel
+        model = FakeGenerativeModel.from_env(prefix_tokens=PROMPT_PREFIX.tokens)
+        print("Using fake Gemini model (GEMINI_FAKE=1).")
+        return model, FakeGenerativeModel.from_env()
+    if not gemini_api_key:
+        print("FATAL: GEMINI_API_KEY environment variable not set.")
+        return None, None
+
+    import google.generativeai as genai
     genai.configure(api_key=gemini_api_key)
     model = genai.GenerativeModel(
-        "gemini-2.5-flash-lite",
+        CHAT_MODEL_NAME,
         system_instruction=persona_instruction
     )
+    # Plain model (no persona) used to fold old turns into the session summary
+    summary_model = genai.GenerativeModel(os.getenv("SUMMARY_MODEL", "gemini-2.5-flash-lite"))
+    return model, summary_model
+
+gemini = Lazy(create_models, imports=("google.generativeai",) if gemini_api_key and os.getenv("GEMINI_FAKE") != "1" else ())
+
+# PROMPT_CACHE=0 sends the persona with every request instead
+def create_prompt_cache():
+    model = gemini.get()[0]
+    if os.getenv("PROMPT_CACHE", "1") != "1" or model is None:
+        return None
+    if os.getenv("GEMINI_FAKE") == "1":
+        backend = FakePrefixBackend(model, min_tokens=int(os.getenv("FAKE_PROMPT_CACHE_MIN_TOKENS", "0")))
+    else:
+        backend = GeminiPrefixBackend(f"models/{CHAT_MODEL_NAME}")
+    return PrefixCache(
+        backend, PROMPT_PREFIX,
+        ttl_seconds=int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600")),
+        refresh_margin=int(os.getenv("PROMPT_CACHE_REFRESH_MARGIN", "300")),
+        retry_seconds=int(os.getenv("PROMPT_CACHE_RETRY_SECONDS", "600")),
+    )
+
+prompt_cache = Lazy(create_prompt_cache)
+
+PERSONA_TOKENS = PROMPT_PREFIX.tokens
+
+PROMPT_CACHE_TOKENS = metrics.counter(
+    "prompt_cache_input_tokens_saved_total", "Prompt-prefix tokens served from the provider cache."
+)
+metrics.gauge("llm_in_flight", "Gemini generations running.", lambda: llm_scheduler.stats()["in_flight"])
+metrics.gauge("llm_queue_depth", "Requests waiting for a generation slot.", lambda: llm_scheduler.stats()["queue_depth"])
+metrics.gauge("persist_queued_turns", "Turns waiting to be committed.",
+              lambda: turn_writer.peek().stats()["queued"] if turn_writer.peek() else 0)
+metrics.gauge("history_cache_sessions", "Sessions in the history cache.", lambda: history_cache.stats()["sessions"])
+
+
+# --- Helpers ---
+async def load_history(session_id):
+    """Returns the session's SessionHistory, from the cache or the store."""
+    history = history_cache.get(session_id)
+    if history is None:
+        # Only the tail pages the context builder can use are read
+        history = await session_store.get().load(session_id, tail_turns=context_builder.max_turns)
+        # Turns still queued in the writer are not in the store yet
+        for turn in turn_writer.get().pending_for(session_id):
+            if turn.turn_index == history.next_turn:
+                history.contents.extend(build_chat_history([turn.message]))
+                history.stored_turn_count = turn.turn_index + 1
+        history_cache.put(session_id, history)
+    return history
+
+
+async def retrieve_context(message):
+    """Top knowledge-base chunks for the message (NumPy search runs off the loop)."""
+    if not len(retriever.index):
+        return []
+    try:
+        return await asyncio.to_thread(retriever.retrieve, message)
+    except Exception as e:
+        print(f"Error during retrieval: {e}")
+        return []
+
+
+def ground_contents(contents, chunks, message):
+    """Replaces the final user entry with the question plus retrieved excerpts."""
+    if chunks:
+        contents[-1] = {"role": "user", "parts": [f"{format_context(chunks)}\n\nQuestion: {message}"]}
+    return contents
+
+
+def request_priority(history, message):
+    """Short follow-ups in a running conversation go ahead of new sessions."""
+    if history.turn_count > 0 and len(message) <= FOLLOW_UP_MAX_CHARS:
+        return PRIORITY_FOLLOW_UP
+    return PRIORITY_NEW
+
+
+async def update_summary(session_id, history, summarize_upto):
+    """Folds the turns that left the context window into the rolling summary."""
+    if session_id in summaries_in_progress:
+        return
+    summaries_in_progress.add(session_id)
+    try:
+        turns = history.turns(history.summary_turns, summarize_upto)
+        cost = sum(estimate_tokens(p) for e in turns for p in e["parts"]) + estimate_tokens(history.summary)
+        summary = await llm_scheduler.call(
+            lambda: summarize_turns(gemini.get()[1], history.summary, turns),
+            priority=PRIORITY_BACKGROUND, cost_tokens=cost,
+        )
+        await session_store.get().save_summary(session_id, summary, summarize_upto)
+        history_cache.set_summary(session_id, summary, summarize_upto)
+    except Exception as e:
+        print(f"Error while updating summary for {session_id}: {e}")
+    finally:
+        summaries_in_progress.discard(session_id)
+
+
+async def generate_into(record, chunks, result, after=None):
+    """Runs a framed generation to completion, independent of any client."""
+    try:
+        async for text in chunks:
+            record.append(text)
+    finally:
+        record.finish(result.get("outcome", "error"))
+        replay_buffer.trim()
+    if after:
+        await after()
 
 
-# --- Endpoint to Create Session Document ---
+def framed_response(record, offset, fmt, headers=None):
+    frames = iter_frames(
+        record, offset, fmt, heartbeat_seconds=STREAM_HEARTBEAT_SECONDS,
+        coalesce_seconds=STREAM_COALESCE_SECONDS, coalesce_bytes=STREAM_COALESCE_BYTES,
+    )
+    headers = {**(headers or {}), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(frames, media_type=MEDIA_TYPES[fmt], headers=headers)
+
+
+# --- Endpoint to Start a Session ---
 @app.post("/session/start")
-async def start_session(request: SessionRequest):
-    """Creates a new, empty document when a session begins."""
-    if not db:
-        return {"status": "error", "message": "Database not initialized"}, 500
-        
-    session_ref = db.collection("chat_history").document(request.session_id)
-    # Check if the document already exists to avoid overwriting
-    if not session_ref.get().exists:
-        session_ref.set({
-            "created_at": datetime.datetime.utcnow(),
-            "session_id": request.session_id,
-            "messages": [] # Start with an empty messages array
-        })
-        return {"status": "session created"}
-    return {"status": "session already exists"}
+async def start_session(request: SessionRequest | None = None):
+    """Issues a signed session token; nothing is written until the first turn.
+
+    The widget no longer needs this (/chat issues a token when it gets none);
+    it is kept for older clients and integrations that want a token up front.
+    """
+    session_id, token = session_signer.issue()
+    return {"status": "session created", "session_id": session_id, "session_token": token}
 
 
 # --- Main Chat Endpoint ---
 @app.post("/chat")
-async def chat(request: ChatRequest):
-    if not db or not model:
+async def chat(request: ChatRequest, stream: str | None = None, accept: str | None = Header(None)):
+    """Streams the answer as plain text, or framed (?stream=sse|ndjson or Accept)."""
+    trace = Trace(STAGE_SECONDS)
+    if not (session_store.ready and gemini.ready):
+        # Cold start: the first request builds the clients
+        with trace.stage("client_init"):
+            await session_store.aget()
+            await gemini.aget()
+    store = session_store.get()
+    model = gemini.get()[0]
+    if not store or not model:
         return {"status": "error", "message": "Backend services not initialized"}, 500
 
-    def stream_and_save():
-        session_ref = db.collection("chat_history").document(request.session_id)
-        session_doc = session_ref.get()
-        chat_history = []
-        if session_doc.exists:
-            previous_messages = session_doc.to_dict().get("messages", [])
-            for msg in previous_messages:
-                # Ensure both keys exist before appending
-                if "user_prompt" in msg and "bot_response" in msg:
-                    chat_history.append({"role": "user", "parts": [msg.get("user_prompt")]})
-                    chat_history.append({"role": "model", "parts": [msg.get("bot_response")]})
-
-        chat_history.append({"role": "user", "parts": [request.message]})
-        
+    session_id, new_token = resolve_session(request)
+    with trace.stage("history_load"):
+        history = await load_history(session_id)
+    with trace.stage("prompt_assembly"):
+        window = context_builder.build(history, request.message)
+    context_stats["requests"] += 1
+    context_stats["tokens_full"] += window.tokens_full
+    context_stats["tokens_used"] += window.tokens_used
+    context_stats["tokens_saved"] += window.tokens_saved
+
+    cacheable = history.next_turn == 0
+    cached_answer = answer_cache.lookup(request.message) if cacheable else None
+    chunks = []
+    if cached_answer is None:
+        with trace.stage("retrieval"):
+            chunks = await retrieve_context(request.message)
+            ground_contents(window.contents, chunks, request.message)
+
+    # The persona and shared context come from the cached prompt prefix when
+    # it is available; otherwise they are sent with the request
+    cache = await prompt_cache.aget() if cached_answer is None else None
+    generation_model = cache.model() if cache else None
+    prefix_state = ("hit" if generation_model else "miss") if cache else "off"
+    contents = window.contents
+    if generation_model is None:
+        generation_model = model
+        contents = SHARED_CONTENTS + window.contents
+
+    result = {}
+
+    async def stream_and_save():
+        outcome = "ok"
+        chunk_count = 0
+        prefix_saved = (0, 0.0)
+        timings = {}
+        # Started here so the finally below always ends it; a response whose
+        # body never starts (setup failed, client gone) never samples
+        profile = profiler.maybe_start(trace.trace_id)
         try:
-            response_stream = model.generate_content(chat_history, stream=True)
             full_ai_reply = ""
-            for chunk in response_stream:
-                if chunk.text:
-                    full_ai_reply += chunk.text
-                    yield chunk.text
+            if cached_answer is not None:
+                outcome = "cache_hit"
+                for text in iter_chunks(cached_answer):
+                    full_ai_reply += text
+                    chunk_count += 1
+                    yield text
+            else:
+                started = time.monotonic()
+                first_chunk_at = None
+                response_stream = llm_scheduler.stream(
+                    lambda: generation_model.generate_content_async(contents, stream=True),
+                    priority=request_priority(history, request.message),
+                    cost_tokens=window.tokens_used + PERSONA_TOKENS + EXPECTED_OUTPUT_TOKENS,
+                    timings=timings,
+                )
+                async for chunk in response_stream:
+                    if first_chunk_at is None:
+                        first_chunk_at = time.monotonic()
+                        trace.record("queue_wait", timings.get("queue_wait", 0.0))
+                        trace.record("first_chunk", first_chunk_at - started - timings.get("queue_wait", 0.0))
+                        if cache:
+                            prefix_saved = cache.observe(prefix_state == "hit", trace.stages["first_chunk"] / 1000)
+                            PROMPT_CACHE_TOKENS.inc(prefix_saved[0])
+                    if chunk.text:
+                        full_ai_reply += chunk.text
+                        chunk_count += 1
+                        yield chunk.text
+                if first_chunk_at is not None:
+                    trace.record("stream", time.monotonic() - first_chunk_at)
+                if cacheable:
+                    answer_cache.store(request.message, full_ai_reply, time.monotonic() - started)
             
-            # Save the full conversation turn to Firestore
+            # Queue the turn for its message page; the reply closes without
+            # waiting for the write
             new_message = {
                 "timestamp": datetime.datetime.utcnow(),
                 "user_prompt": request.message,
-                "bot_response": full_ai_reply
+                "bot_response": full_ai_reply,
+                # Used by the analytics rollups
+                "outcome": outcome,
+                "latency_ms": round(trace.elapsed() * 1000),
+                "retrieved_chunks": len(chunks),
+                "low_confidence": cached_answer is None and not chunks and len(retriever.index) > 0,
             }
-            session_ref.update({"messages": firestore.ArrayUnion([new_message])})
+            with trace.stage("persistence"):
+                turn_index = turn_counter.claim(session_id, history.next_turn)
+                turn_writer.get().submit(session_id, turn_index, new_message, history.page_size)
+                history_cache.append_turn(session_id, request.message, full_ai_reply, turn_index)
+            CHAT_CHUNKS.observe(chunk_count)
+            CHAT_BYTES.observe(len(full_ai_reply.encode("utf-8")))
 
+        except SchedulerBusy as e:
+            outcome = "busy"
+            log_event("chat_shed", trace.trace_id, reason=str(e))
+            yield BUSY_MESSAGE
         except Exception as e:
-            print(f"Error during stream or DB operation: {e}")
-            yield f"An error occurred: {e}"
+            # The cached copy may no longer match Firestore; reload next turn
+            history_cache.invalidate(session_id)
+            outcome = "busy" if is_transient(e) else "error"
+            log_event("chat_error", trace.trace_id, error=f"{type(e).__name__}: {e}")
+            yield BUSY_MESSAGE if is_transient(e) else ERROR_MESSAGE
+        finally:
+            result["outcome"] = outcome
+            if outcome in ("busy", "error") and analytics.peek():
+                analytics.peek().add_outcome(outcome)
+            trace.record("total", trace.elapsed())
+            CHAT_REQUESTS.inc(outcome=outcome)
+            if profile:
+                profile.stop()
+            log_event(
+                "chat", trace.trace_id, session_id=session_id, outcome=outcome,
+                stages_ms=trace.stages, chunks=chunk_count, retries=timings.get("retries", 0),
+                context_tokens=window.tokens_used, retrieved=len(chunks), prompt_cache=prefix_state,
+                prompt_tokens_saved=prefix_saved[0], prompt_ms_saved_est=prefix_saved[1],
+            )
+
+    # Summarize after the response is sent so it never delays the answer
+    background = None
+    if window.summarize_upto > history.summary_turns:
+        background = BackgroundTask(
+            update_summary, session_id, history, window.summarize_upto
+        )
+
+    headers = {
+        "X-Context-Tokens": str(window.tokens_used),
+        "X-Context-Tokens-Saved": str(window.tokens_saved),
+        "X-Answer-Cache": "hit" if cached_answer is not None else "miss",
+        "X-Retrieved-Chunks": str(len(chunks)),
+        "X-Trace-Id": trace.trace_id,
+        "X-Prompt-Cache": prefix_state,
+        "X-Session-Id": session_id,
+    }
+    if new_token:
+        headers["X-Session-Token"] = new_token
+    fmt = stream_format(stream, accept)
+    if fmt is None:
+        return StreamingResponse(
+            stream_and_save(), media_type='text/plain', headers=headers, background=background
+        )
+
+    # Framed: generate in the background so a dropped client can resume
+    record = replay_buffer.create(uuid.uuid4().hex, session_id)
+    task = asyncio.create_task(generate_into(record, stream_and_save(), result, background))
+    generations.add(task)
+    task.add_done_callback(generations.discard)
+    return framed_response(record, 0, fmt, {**headers, "X-Stream-Id": record.stream_id})
+
+
+@app.get("/chat/stream/{stream_id}")
+async def resume_chat_stream(
+    stream_id: str, session_id: str, offset: int | None = None, stream: str | None = None,
+    accept: str | None = Header(None), last_event_id: str | None = Header(None),
+):
+    """Replays a framed answer from a byte offset (or Last-Event-ID) and follows it."""
+    record = replay_buffer.get(stream_id, session_id)
+    if record is None:
+        return JSONResponse({"status": "error", "message": "Stream expired; ask again"}, status_code=404)
+    if offset is None:
+        offset = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    if not record.valid_offset(offset):
+        return JSONResponse({"status": "error", "message": "Invalid offset"}, status_code=416)
+    return framed_response(record, offset, stream_format(stream, accept) or "ndjson")
+
+# --- FAQ Snapshot ---
+@app.get("/faq/snapshot")
+async def get_faq_snapshot(
+    accept_encoding: str | None = Header(None), if_none_match: str | None = Header(None),
+):
+    """The FAQ bundle; supports If-None-Match and gzip/br."""
+    if not faq_snapshot.current():
+        return JSONResponse({"status": "error", "message": "No FAQ snapshot"}, status_code=404)
+    body, coding = faq_snapshot.body(accept_encoding)
+    headers = {
+        "ETag": faq_snapshot.etag(coding),
+        "Cache-Control": f"public, max-age={FAQ_MAX_AGE_SECONDS}, stale-while-revalidate=86400",
+        "Vary": "Accept-Encoding",
+    }
+    if etag_matches(if_none_match, faq_snapshot.version):
+        return Response(status_code=304, headers=headers)
+    if coding:
+        headers["Content-Encoding"] = coding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.get("/faq/lookup")
+async def faq_lookup(q: str):
+    """Exact or near-exact match of a question against the FAQ bundle."""
+    if not faq_snapshot.current():
+        return {"match": False, "version": None}
+    entry, score = faq_snapshot.lookup(q)
+    if entry is None:
+        return {"match": False, "version": faq_snapshot.version, "score": score}
+    return {
+        "match": True, "version": faq_snapshot.version, "score": score,
+        "id": entry["id"], "question": entry["question"], "answer": entry["answer"],
+    }
+
+
+@app.post("/faq/lookup")
+async def faq_report(request: Request):
+    """Saves a question the widget answered from its FAQ bundle as the first
+    turn of a new session.
 
-    return StreamingResponse(stream_and_save(), media_type='text/plain')
+    Sent as a text/plain JSON body {"q": "..."} (no CORS preflight). The match
+    is checked against this instance's snapshot and the turn is queued like a
+    /chat turn (outcome "faq"), so it is counted under the entry's question and
+    a follow-up /chat with the returned session token has it as context.
+
+    Only a session's first question is answered locally, so a report that
+    carries a valid session token is refused, as are reports beyond
+    FAQ_REPORTS_PER_HOUR per client.
+    """
+    if not faq_report_limiter.allow(client_key(request)):
+        return JSONResponse({"match": False, "message": "Too many reports"}, status_code=429)
+    try:
+        data = json.loads(await request.body())
+        question = data["q"]
+    except (ValueError, KeyError, TypeError):
+        return JSONResponse({"match": False}, status_code=400)
+    if isinstance(data.get("session_token"), str) and session_signer.verify(data["session_token"]):
+        return JSONResponse({"match": False, "message": "Session already started"}, status_code=409)
+    if not isinstance(question, str) or not faq_snapshot.current():
+        return {"match": False}
+    entry, score = faq_snapshot.lookup(question)
+    if entry is None:
+        return {"match": False, "score": score}
+    writer = await turn_writer.aget()
+    if not writer:
+        return JSONResponse({"status": "error", "message": "Backend services not initialized"}, status_code=503)
+    session_id, token = session_signer.issue()
+    writer.submit(session_id, turn_counter.claim(session_id, 0), {
+        "timestamp": datetime.datetime.utcnow(),
+        "user_prompt": question,
+        "bot_response": entry["answer"],
+        "outcome": "faq",
+        # Counted under the entry, so answered FAQs keep their rank in the next rebuild
+        "faq_question": entry["keys"][0],
+        "latency_ms": 0,
+        "retrieved_chunks": 0,
+        "low_confidence": False,
+    })
+    return JSONResponse(
+        {"match": True, "id": entry["id"], "score": score, "session_id": session_id, "session_token": token},
+        headers={"X-Session-Id": session_id, "X-Session-Token": token},
+    )
+
+
+@app.post("/admin/faq/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_faq():
+    """Rebuilds the snapshot from this instance's analytics store."""
+    rollup = await analytics.aget()
+    if not rollup:
+        return {"status": "error", "message": "Analytics not available"}
+    # Rollups still pending in memory belong in the snapshot too
+    await rollup.flush()
+    return await rebuild_faq_snapshot(
+        rollup.store, faq_snapshot.path, FAQ_CURATED_PATH,
+        days=int(os.getenv("FAQ_DAYS", "30")), top=int(os.getenv("FAQ_TOP", "50")),
+        min_count=int(os.getenv("FAQ_MIN_COUNT", "3")),
+    )
 
 # --- Health Check Endpoint ---
 @app.get("/")
 async def health_check():
-    return {"message": "Shiksha Saathi test server is running!"}
\ No newline at end of file
+    return {"message": "Shiksha Saathi test server is running!"}
+
+
+async def warm_up():
+    """Builds the lazy clients and touches the retrieval index; returns ms per step."""
+    timings = {}
+    for name, lazy in (("session_store", session_store), ("gemini", gemini), ("turn_writer", turn_writer)):
+        started = time.perf_counter()
+        await lazy.aget()
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    started = time.perf_counter()
+    cache = await prompt_cache.aget()
+    if cache:
+        await cache.ensure()
+    timings["prompt_cache"] = round((time.perf_counter() - started) * 1000, 1)
+    started = time.perf_counter()
+    await retrieve_context("warm up")
+    timings["retrieval"] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+
+@app.get("/warmup")
+async def warmup():
+    """Initializes everything the first /chat would; point a cron or uptime ping here."""
+    cold = not (session_store.ready and gemini.ready)
+    timings = await warm_up()
+    return {
+        "status": "ready" if session_store.peek() and gemini.peek()[0] else "not configured",
+        "cold": cold,
+        "ms": timings,
+    }
+
+
+@app.get("/stats/faq")
+async def faq_stats():
+    faq_snapshot.current()
+    return {**faq_snapshot.stats(), "reports": faq_report_limiter.stats()}
+
+
+@app.get("/stats/sessions")
+async def session_token_stats():
+    return session_signer.stats()
+
+
+@app.get("/stats/history-cache")
+async def history_cache_stats():
+    return history_cache.stats()
+
+
+@app.get("/stats/context")
+async def context_window_stats():
+    return context_stats
+
+
+async def merge_lexical_segments():
+    """Background merge of BM25 segments written by recent uploads."""
+    async with ingest_lock:
+        if retriever.lexical.needs_merge():
+            await asyncio.to_thread(retriever.lexical.merge)
+
+
+@app.post("/admin/documents", dependencies=[Depends(require_admin)])
+async def upload_documents(background_tasks: BackgroundTasks, files: list[UploadFile] = File(...)):
+    """Saves uploaded documents and ingests them into the retrieval index."""
+    os.makedirs(DOCS_DIR, exist_ok=True)
+    saved, rejected = [], []
+    for upload in files:
+        name = os.path.basename(upload.filename or "")
+        if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+            rejected.append(name)
+            continue
+        dest = os.path.join(DOCS_DIR, name)
+        with open(dest, "wb") as f:
+            while block := await upload.read(1024 * 1024):
+                f.write(block)
+        saved.append(dest)
+
+    # One ingestion at a time: the index has a single writer
+    async with ingest_lock:
+        report = await asyncio.to_thread(
+            ingest, saved, RAG_INDEX_DIR, retriever.embedder, workers=INGEST_WORKERS, merge=False
+        )
+    if report["chunks_added"]:
+        answer_cache.invalidate_all()
+        background_tasks.add_task(merge_lexical_segments)
+    report["rejected"] = rejected
+    return report
+
+
+@app.get("/stats/answer-cache")
+async def answer_cache_stats():
+    return answer_cache.stats()
+
+
+@app.get("/stats/scheduler")
+async def scheduler_stats():
+    return llm_scheduler.stats()
+
+
+@app.get("/stats/persistence")
+async def persistence_stats():
+    stats = turn_writer.peek().stats() if turn_writer.peek() else {}
+    return {**stats, "turn_counter": turn_counter.stats()}
+
+
+# --- Admin Analytics ---
+def analytics_page(items, key, limit):
+    return {"items": items, "next_cursor": items[-1][key] if len(items) == limit else None}
+
+
+@app.get("/admin/analytics/summary", dependencies=[Depends(require_admin)])
+async def analytics_summary(days: int = 7):
+    """Totals and per-day series for the last `days` days (reads `days` rollups)."""
+    rollup = await analytics.aget()
+    if not rollup:
+        return {"status": "error", "message": "Analytics not available"}
+    days = min(max(days, 1), 366)
+    now = datetime.datetime.utcnow()
+    start = day_key(now - datetime.timedelta(days=days - 1))
+    series = [with_averages(d) for d in await rollup.store.days(start, day_key(now) + "~", days)]
+    totals = {name: sum(d.get(name, 0) for d in series) for name in
+              ("queries", "cache_hits", "low_confidence", "errors", "busy", "latency_ms_sum", "answer_chars_sum")}
+    return {"days": days, "totals": with_averages(totals), "series": series}
+
+
+@app.get("/admin/analytics/hourly", response_model=AnalyticsPage, dependencies=[Depends(require_admin)])
+async def analytics_hourly(start: str | None = None, end: str | None = None, limit: int = 48, cursor: str | None = None):
+    """Hourly buckets (keys YYYYMMDDHH, UTC) in [start, end); defaults to the last 24 hours."""
+    rollup = await analytics.aget()
+    if not rollup:
+        return {"items": []}
+    now = datetime.datetime.utcnow()
+    start = start or hour_key(now - datetime.timedelta(hours=23))
+    end = end or hour_key(now) + "~"
+    limit = min(max(limit, 1), 500)
+    items = [with_averages(h) for h in await rollup.store.hours(start, end, limit, cursor)]
+    return analytics_page(items, "hour", limit)
+
+
+@app.get("/admin/analytics/daily", response_model=AnalyticsPage, dependencies=[Depends(require_admin)])
+async def analytics_daily(start: str | None = None, end: str | None = None, limit: int = 31, cursor: str | None = None):
+    """Daily buckets (keys YYYYMMDD, UTC) in [start, end); defaults to the last 30 days."""
+    rollup = await analytics.aget()
+    if not rollup:
+        return {"items": []}
+    now = datetime.datetime.utcnow()
+    start = start or day_key(now - datetime.timedelta(days=29))
+    end = end or day_key(now) + "~"
+    limit = min(max(limit, 1), 500)
+    items = [with_averages(d) for d in await rollup.store.days(start, end, limit, cursor)]
+    return analytics_page(items, "day", limit)
+
+
+@app.get("/admin/analytics/questions", response_model=AnalyticsPage, dependencies=[Depends(require_admin)])
+async def analytics_questions(day: str | None = None, order: str = "count", limit: int = 20, cursor: str | None = None):
+    """Most asked normalized questions of a day; order=low_confidence for confusion hotspots."""
+    rollup = await analytics.aget()
+    if not rollup or order not in ("count", "low_confidence"):
+        return {"items": []}
+    limit = min(max(limit, 1), 200)
+    items = await rollup.store.top_questions(day or day_key(datetime.datetime.utcnow()), order, limit, cursor)
+    return analytics_page(items, "id", limit)
+
+
+@app.get("/stats/analytics")
+async def analytics_stats():
+    return analytics.peek().stats() if analytics.peek() else {}
+
+
+@app.get("/stats/replay-buffer")
+async def replay_buffer_stats():
+    return replay_buffer.stats()
+
+
+@app.get("/stats/prompt-cache")
+async def prompt_cache_stats():
+    cache = prompt_cache.peek()
+    return cache.stats() if cache else {"enabled": False}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/profiling", dependencies=[Depends(require_admin)])
+async def profiling_status():
+    return {"sample_rate": profiler.sample_rate, "profiles": list(profiler.profiles)}
+
+
+@app.post("/admin/profiling", dependencies=[Depends(require_admin)])
+async def set_profiling(request: ProfilingRequest):
+    """Changes the fraction of /chat requests that are profiled (0 disables)."""
+    profiler.sample_rate = min(max(request.sample_rate, 0.0), 1.0)
+    return {"sample_rate": profiler.sample_rate}
+
+
+@app.post("/cache/answers/invalidate", dependencies=[Depends(require_admin)])
+async def invalidate_answer_cache():
+    """Drops every cached answer; call after the knowledge base changes."""
+    answer_cache.invalidate_all()
+    return {"status": "answer cache cleared"}
\ No newline at end of file
@@ -0,0 +1,242 @@
+# metrics.py
+# Minimal in-process metrics rendered in the Prometheus text format, plus
+# per-request traces and an opt-in sampling profiler for /chat.
+#
+# Metrics are per process; scrape every worker (or instance) separately.
+
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from collections import Counter as StackCounter, deque
+
+# Latency buckets in seconds, from cache hits to long streamed answers
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{escape_label(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = format_labels(self.labels + ("le",), key + (repr(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read):
+        return self.register(Gauge(name, help, read))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# --- Traces ---
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def log_event(event, trace_id=None, **fields):
+    """One JSON line per event, so logs can be filtered by trace_id."""
+    record = {"ts": round(time.time(), 3), "event": event}
+    if trace_id:
+        record["trace_id"] = trace_id
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class Trace:
+    """Stage timings of one request; each stage is observed once finished."""
+
+    def __init__(self, histogram, trace_id=None):
+        self.histogram = histogram
+        self.trace_id = trace_id or new_trace_id()
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def record(self, stage, seconds):
+        self.stages[stage] = round(seconds * 1000, 2)
+        self.histogram.observe(seconds, stage=stage)
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class _Stage:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.record(self.name, time.perf_counter() - self.started)
+
+
+# --- Sampling profiler ---
+class SamplingProfiler:
+    """Samples the event-loop thread's stack for a fraction of requests.
+
+    While a sampled request runs, a helper thread records the loop thread's
+    stack every `interval` seconds as collapsed "a;b;c" strings (flame graph
+    input). The loop is shared, so concurrent requests appear in the same
+    samples; profiles show where the process spent time during the request.
+    `sample_rate` can be changed at runtime. A profile covers the streaming of
+    the answer and ends with it, or after `max_seconds` if the stream never
+    finishes.
+    """
+
+    def __init__(self, sample_rate=0.0, interval=0.005, max_profiles=20, max_active=2, max_seconds=120.0):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.max_active = max_active
+        self.profiles = deque(maxlen=max_profiles)
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def maybe_start(self, trace_id):
+        """Returns a running profile for this request, or None if not sampled."""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        with self._lock:
+            if self._active >= self.max_active:
+                return None
+            self._active += 1
+        return _Profile(self, trace_id, threading.get_ident())
+
+    def _finished(self, profile):
+        with self._lock:
+            self._active -= 1
+        self.profiles.append(profile.report())
+
+
+class _Profile:
+    def __init__(self, profiler, trace_id, thread_id):
+        self.profiler = profiler
+        self.trace_id = trace_id
+        self.thread_id = thread_id
+        self.stacks = StackCounter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.ended = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        deadline = self.started + self.profiler.max_seconds
+        while not self._stop.wait(self.profiler.interval) and time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+        self.profiler._finished(self)
+
+    def stop(self):
+        """Ends sampling without waiting: called on the event loop, so the
+        helper thread finishes (and reports) on its own."""
+        self.ended = time.perf_counter()
+        self._stop.set()
+
+    def report(self, top=25):
+        return {
+            "trace_id": self.trace_id,
+            "duration_ms": round(((self.ended or time.perf_counter()) - self.started) * 1000, 1),
+            "samples": self.samples,
+            "stacks": [{"stack": s, "samples": n} for s, n in self.stacks.most_common(top)],
+        }
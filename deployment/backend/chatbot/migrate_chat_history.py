@@ -0,0 +1,60 @@
+# migrate_chat_history.py
+# Backfills legacy `chat_history` documents (one `messages` array per session)
+# into the paged layout used by session_store.py.
+#
+# Usage:
+#   python migrate_chat_history.py --dry-run
+#   python migrate_chat_history.py --page-size 20 --limit 500
+#
+# Safe to re-run: documents that no longer have a `messages` field are skipped.
+# Sessions that are not backfilled are still migrated lazily on first load.
+
+import os
+import json
+import base64
+import asyncio
+import argparse
+import firebase_admin
+from firebase_admin import credentials, firestore_async
+from dotenv import load_dotenv
+from session_store import COLLECTION, DEFAULT_PAGE_SIZE, FirestoreSessionStore
+
+
+def init_db():
+    load_dotenv()
+    firebase_creds_json_str = base64.b64decode(os.getenv("FIREBASE_CREDS_BASE64")).decode('utf-8')
+    cred = credentials.Certificate(json.loads(firebase_creds_json_str))
+    firebase_admin.initialize_app(cred)
+    return firestore_async.client()
+
+
+async def migrate(db, page_size, limit=None, dry_run=False):
+    store = FirestoreSessionStore(db, page_size=page_size)
+    scanned = migrated = turns = 0
+    async for doc in db.collection(COLLECTION).stream():
+        scanned += 1
+        data = doc.to_dict()
+        if "messages" not in data:
+            continue
+        migrated += 1
+        turns += len(data["messages"])
+        if not dry_run:
+            await store.migrate(doc.id, data)
+        if limit and migrated >= limit:
+            break
+    return {"scanned": scanned, "migrated": migrated, "turns": turns, "dry_run": dry_run}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill chat_history into paged storage.")
+    parser.add_argument("--page-size", type=int, default=int(os.getenv("SESSION_PAGE_SIZE", DEFAULT_PAGE_SIZE)))
+    parser.add_argument("--limit", type=int, default=None, help="Stop after migrating this many sessions")
+    parser.add_argument("--dry-run", action="store_true", help="Count legacy sessions without writing")
+    args = parser.parse_args()
+
+    result = asyncio.run(migrate(init_db(), args.page_size, args.limit, args.dry_run))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
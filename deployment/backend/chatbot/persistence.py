@@ -0,0 +1,302 @@
+# persistence.py
+# Write-behind persistence of completed conversation turns.
+#
+# /chat hands each finished turn to TurnWriter.submit() and closes the reply
+# right away. A background task flushes queued turns to the session store in
+# batches (by size or every `flush_interval` seconds), retries failed commits
+# with backoff, and spills them to a local append-only journal if the
+# database stays down. The journal is replayed on start and after the next
+# successful flush. If the journal cannot be written either, the batch goes
+# back on the queue (at most `max_queued` turns are held; older ones beyond
+# that are dropped and counted). Journal lines that do not parse (a write cut
+# short by a crash) are moved to `<journal>.corrupt` instead of blocking the
+# replay.
+#
+# Several worker processes may share one journal path, so each process spills
+# to its own file, `<journal>.<pid>`. A replay first renames the files it will
+# read to `<journal>.<pid>.replay-<n>` (its own, and those of processes that
+# are no longer running), so no other process appends to or replays a file
+# while it is being committed.
+
+import os
+import json
+import time
+import random
+import asyncio
+import datetime
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+
+class PendingTurn:
+    __slots__ = ("session_id", "turn_index", "message", "page_size")
+
+    def __init__(self, session_id, turn_index, message, page_size):
+        self.session_id = session_id
+        self.turn_index = turn_index
+        self.message = message
+        self.page_size = page_size
+
+    def to_json(self):
+        message = dict(self.message)
+        message["timestamp"] = message["timestamp"].isoformat()
+        return json.dumps({
+            "session_id": self.session_id, "turn_index": self.turn_index,
+            "message": message, "page_size": self.page_size,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, line):
+        data = json.loads(line)
+        message = data["message"]
+        message["timestamp"] = datetime.datetime.fromisoformat(message["timestamp"])
+        return cls(data["session_id"], data["turn_index"], message, data["page_size"])
+
+
+class TurnWriter:
+    def __init__(self, store, max_batch=100, flush_interval=0.25, max_retries=4,
+                 backoff_base=0.2, backoff_max=5.0, journal_path=None, on_commit=None, max_queued=10000):
+        self.store = store
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.journal_path = journal_path
+        self.on_commit = on_commit  # called with (seconds, committed turns) per commit
+        self.max_queued = max_queued
+
+        self._pending = []
+        self._in_flight = []
+        self._wakeup = asyncio.Event()
+        self._replay_lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+
+        self.submitted = 0
+        self.flushed = 0
+        self.commits = 0
+        self.retries = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.requeued = 0
+        self.dropped = 0
+        self.corrupt = 0
+
+    # --- Producer side ---
+    def submit(self, session_id, turn_index, message, page_size=None):
+        """Queues a completed turn; never waits on the database."""
+        self._pending.append(PendingTurn(session_id, turn_index, message, page_size))
+        self.submitted += 1
+        self._bound_queue()
+        if self._task is None or self._task.done():
+            self.start()
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def pending_for(self, session_id):
+        """Turns of `session_id` not yet committed, in turn order."""
+        turns = [t for t in self._in_flight + self._pending if t.session_id == session_id]
+        return sorted(turns, key=lambda t: t.turn_index)
+
+    # --- Background task ---
+    def start(self):
+        """Starts the background task, or restarts it if it has ended."""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Flushes everything still queued; call on shutdown."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        while self._pending:
+            if not await self.flush():
+                print(f"Turn writer stopped with {len(self._pending)} turns unsaved")
+                break
+
+    async def _run(self):
+        try:
+            await self.replay_journal()
+        except Exception as e:
+            print(f"Journal replay error: {e}")
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while self._pending:
+                    if not await self.flush() or len(self._pending) < self.max_batch:
+                        break
+            except Exception as e:
+                print(f"Turn writer error: {e}")
+
+    async def flush(self):
+        """Commits up to `max_batch` queued turns; spills them if retries run out.
+
+        Returns False if the batch could be neither committed nor journaled,
+        in which case it is back at the head of the queue.
+        """
+        if not self._pending:
+            return True
+        batch = self._pending[:self.max_batch]
+        del self._pending[:self.max_batch]
+        self._in_flight = batch
+        try:
+            if await self._commit(batch):
+                await self.replay_journal()
+                return True
+            try:
+                self._spill(batch)
+                return True
+            except OSError as e:
+                print(f"Turn journal write failed: {e}")
+                self._requeue(batch)
+                return False
+        finally:
+            self._in_flight = []
+
+    async def _commit(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                started = time.perf_counter()
+                await self.store.append_turns(batch)
+                self.commits += 1
+                self.flushed += len(batch)
+                if self.on_commit:
+                    self.on_commit(time.perf_counter() - started, batch)
+                return True
+            except Exception as e:
+                print(f"Turn batch commit failed (attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+        return False
+
+    # --- Journal ---
+    def _requeue(self, batch):
+        self._pending[:0] = batch
+        self.requeued += len(batch)
+        self._bound_queue()
+
+    def _bound_queue(self):
+        overflow = len(self._pending) - self.max_queued
+        if overflow > 0:
+            # Keep the newest turns; the oldest have been waiting longest
+            del self._pending[:overflow]
+            self.dropped += overflow
+            print(f"Dropping {overflow} queued turns: more than max_queued={self.max_queued} unsaved")
+
+    def _spill(self, batch):
+        if not self.journal_path:
+            raise OSError("no journal configured")
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        with open(f"{self.journal_path}.{os.getpid()}", "a", encoding="utf-8") as f:
+            f.write("".join(turn.to_json() + "\n" for turn in batch))
+            f.flush()
+            os.fsync(f.fileno())
+        self.spilled += len(batch)
+
+    def _journal_files(self):
+        """(owner pid, path) of the journal files under `journal_path`."""
+        folder, name = os.path.split(os.path.abspath(self.journal_path))
+        if not os.path.isdir(folder):
+            return []
+        files = []
+        for entry in sorted(os.listdir(folder)):
+            if entry == name:
+                files.append((None, os.path.join(folder, entry)))  # written before per-process files
+            elif entry.startswith(name + ".") and entry[len(name) + 1:].split(".")[0].isdigit():
+                files.append((int(entry[len(name) + 1:].split(".")[0]), os.path.join(folder, entry)))
+        return files
+
+    def _claim_journals(self):
+        """Renames the files this process should replay to names it alone owns."""
+        pid = os.getpid()
+        claimed = []
+        for owner, path in self._journal_files():
+            if owner == pid and ".replay-" in os.path.basename(path):
+                claimed.append(path)  # left by an earlier replay of ours that failed
+                continue
+            if owner not in (pid, None) and process_alive(owner):
+                continue
+            target = f"{self.journal_path}.{pid}.replay-{time.time_ns()}"
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue  # claimed by another process first
+            claimed.append(target)
+        return claimed
+
+    async def replay_journal(self):
+        """Re-commits journaled turns; a journal file is removed only on success."""
+        if not self.journal_path:
+            return
+        async with self._replay_lock:
+            for path in self._claim_journals():
+                if not await self._replay_file(path):
+                    return
+
+    async def _replay_file(self, path):
+        turns, corrupt = [], []
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    turns.append(PendingTurn.from_json(line))
+                except (ValueError, KeyError, TypeError):
+                    corrupt.append(line if line.endswith("\n") else line + "\n")
+        if corrupt:
+            with open(self.journal_path + ".corrupt", "a", encoding="utf-8") as f:
+                f.write("".join(corrupt))
+            self.corrupt += len(corrupt)
+            print(f"Moved {len(corrupt)} unreadable journal lines to {self.journal_path}.corrupt")
+        for start in range(0, len(turns), self.max_batch):
+            batch = turns[start:start + self.max_batch]
+            try:
+                started = time.perf_counter()
+                await self.store.append_turns(batch)
+            except Exception as e:
+                print(f"Journal replay failed, will retry later: {e}")
+                # Keep only what is still uncommitted
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write("".join(t.to_json() + "\n" for t in turns[start:]))
+                return False
+            self.commits += 1
+            self.replayed += len(batch)
+            if self.on_commit:
+                self.on_commit(time.perf_counter() - started, batch)
+        os.remove(path)
+        return True
+
+    def stats(self):
+        return {
+            "queued": len(self._pending) + len(self._in_flight),
+            "submitted": self.submitted,
+            "flushed": self.flushed,
+            "commits": self.commits,
+            "turns_per_commit": round(self.flushed / self.commits, 2) if self.commits else 0.0,
+            "retries": self.retries,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "requeued": self.requeued,
+            "dropped": self.dropped,
+            "corrupt": self.corrupt,
+            "journal_bytes": sum(
+                os.path.getsize(path) for owner, path in self._journal_files() if owner == os.getpid()
+            ) if self.journal_path else 0,
+        }
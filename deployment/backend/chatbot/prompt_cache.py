@@ -0,0 +1,244 @@
+# prompt_cache.py
+# Prompt-prefix caching: the persona (system instruction) and any shared
+# grounding context are registered with the model provider once and reused by
+# every /chat request, instead of being sent and processed each time.
+#
+# PrefixCache owns one cached prefix: it creates it on first use, extends its
+# TTL before it expires, and falls back to the plain model (returns None)
+# while the provider refuses or fails, e.g. when the prefix is below the
+# provider's minimum cacheable size. Backends:
+#   GeminiPrefixBackend  google.generativeai.caching (CachedContent)
+#   FakePrefixBackend    offline; pairs with fake_gemini.FakeGenerativeModel
+
+import time
+import asyncio
+import hashlib
+import datetime
+from collections import deque
+from context_builder import estimate_tokens
+
+
+class PromptPrefix:
+    """System instruction plus shared contents that open every request."""
+
+    __slots__ = ("system_instruction", "contents", "tokens", "fingerprint")
+
+    def __init__(self, system_instruction, contents=None):
+        self.system_instruction = system_instruction
+        self.contents = contents or []
+        texts = [system_instruction] + [p for entry in self.contents for p in entry["parts"]]
+        self.tokens = sum(estimate_tokens(t) for t in texts)
+        self.fingerprint = hashlib.sha256("\x00".join(texts).encode("utf-8")).hexdigest()[:16]
+
+
+def shared_context_contents(text):
+    """Shared grounding text as a user/model pair placed before the conversation."""
+    if not text or not text.strip():
+        return []
+    return [
+        {"role": "user", "parts": [f"Reference information for all questions:\n{text.strip()}"]},
+        {"role": "model", "parts": ["Understood. I will use this reference information where relevant."]},
+    ]
+
+
+# --- Backends ---
+class PrefixHandle:
+    __slots__ = ("name", "expires_at", "tokens")
+
+    def __init__(self, name, expires_at, tokens):
+        self.name = name
+        self.expires_at = expires_at  # time.time() seconds
+        self.tokens = tokens
+
+
+class GeminiPrefixBackend:
+    """CachedContent on the Gemini API. The SDK calls block, so they run in threads."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    async def create(self, prefix, ttl_seconds):
+        from google.generativeai import caching
+
+        cache = await asyncio.to_thread(
+            caching.CachedContent.create,
+            model=self.model_name,
+            display_name=f"shiksha-saathi-{prefix.fingerprint}",
+            system_instruction=prefix.system_instruction,
+            contents=prefix.contents or None,
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+        tokens = getattr(getattr(cache, "usage_metadata", None), "total_token_count", None) or prefix.tokens
+        return PrefixHandle(cache.name, cache.expire_time.timestamp(), tokens), cache
+
+    async def refresh(self, handle, cache, ttl_seconds):
+        await asyncio.to_thread(cache.update, ttl=datetime.timedelta(seconds=ttl_seconds))
+        handle.expires_at = time.time() + ttl_seconds
+
+    async def delete(self, cache):
+        await asyncio.to_thread(cache.delete)
+
+    def model_for(self, cache):
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached_content=cache)
+
+
+class FakePrefixBackend:
+    """Offline backend: the returned model skips prefill for the cached tokens."""
+
+    def __init__(self, model, min_tokens=0, create_latency=0.05):
+        self.model = model
+        self.min_tokens = min_tokens
+        self.create_latency = create_latency
+        self.created = 0
+
+    async def create(self, prefix, ttl_seconds):
+        await asyncio.sleep(self.create_latency)
+        if prefix.tokens < self.min_tokens:
+            raise ValueError(f"400 cached content is too small ({prefix.tokens} < {self.min_tokens} tokens)")
+        self.created += 1
+        handle = PrefixHandle(f"cachedContents/fake-{prefix.fingerprint}", time.time() + ttl_seconds, prefix.tokens)
+        return handle, handle
+
+    async def refresh(self, handle, cache, ttl_seconds):
+        handle.expires_at = time.time() + ttl_seconds
+
+    async def delete(self, cache):
+        pass
+
+    def model_for(self, cache):
+        return self.model.with_cached_tokens(cache.tokens)
+
+
+# --- Cache ---
+class PrefixCache:
+    def __init__(self, backend, prefix, ttl_seconds=3600, refresh_margin=300, retry_seconds=600):
+        self.backend = backend
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.retry_seconds = retry_seconds
+
+        self._handle = None
+        self._cache = None
+        self._model = None
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._refresher = None
+        self._retry_at = 0.0
+        self.last_error = None
+
+        self.creates = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.hits = 0
+        self.bypassed = 0
+        self.tokens_saved = 0
+        self._first_chunk = {True: deque(maxlen=500), False: deque(maxlen=500)}
+
+    def model(self):
+        """Model bound to the cached prefix, or None to use the plain model.
+
+        Never waits: creation and refreshes run in the background, and the
+        current cache stays in use until it actually expires.
+        """
+        handle = self._handle
+        if handle is None or handle.expires_at - time.time() <= self.refresh_margin:
+            self._ensure_soon()
+        if handle is None or handle.expires_at <= time.time():
+            self.bypassed += 1
+            return None
+        self.hits += 1
+        return self._model
+
+    def _ensure_soon(self):
+        if self._task is None and time.monotonic() >= self._retry_at:
+            self._task = asyncio.get_running_loop().create_task(self.ensure())
+
+    async def ensure(self):
+        """Creates the cache, or extends it if it is close to expiry."""
+        try:
+            async with self._lock:
+                if self._handle is None:
+                    await self._create()
+                elif self._handle.expires_at - time.time() <= self.refresh_margin:
+                    await self._refresh()
+        except Exception as e:
+            self._failed(e)
+        finally:
+            self._task = None
+
+    async def _create(self):
+        self._handle, self._cache = await self.backend.create(self.prefix, self.ttl_seconds)
+        self._model = self.backend.model_for(self._cache)
+        self.creates += 1
+        self.last_error = None
+        print(f"Prompt prefix cached as {self._handle.name} ({self._handle.tokens} tokens).")
+        if self._refresher is None:
+            self._refresher = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def _refresh(self):
+        try:
+            await self.backend.refresh(self._handle, self._cache, self.ttl_seconds)
+            self.refreshes += 1
+        except Exception as e:
+            # The cache may have expired or been deleted; build a new one
+            print(f"Prompt prefix refresh failed, recreating: {e}")
+            self._handle = self._cache = self._model = None
+            await self._create()
+
+    def _failed(self, error):
+        self.failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        self._retry_at = time.monotonic() + self.retry_seconds
+        print(f"Prompt prefix caching unavailable, using the plain model: {error}")
+
+    async def _refresh_loop(self):
+        """Extends the TTL ahead of expiry, even when no request comes in."""
+        while True:
+            handle = self._handle
+            delay = handle.expires_at - time.time() - self.refresh_margin if handle else self.retry_seconds
+            await asyncio.sleep(max(delay, 1.0))
+            await self.ensure()
+
+    async def close(self):
+        if self._refresher:
+            self._refresher.cancel()
+        if self._cache is not None:
+            try:
+                await self.backend.delete(self._cache)
+            except Exception as e:
+                print(f"Could not delete cached prompt prefix: {e}")
+
+    # --- Accounting ---
+    def observe(self, cached, first_chunk_seconds, cached_tokens=None):
+        """Records one request; returns (tokens_saved, estimated_ms_saved)."""
+        self._first_chunk[cached].append(first_chunk_seconds)
+        if not cached:
+            return 0, 0.0
+        tokens = cached_tokens or (self._handle.tokens if self._handle else self.prefix.tokens)
+        self.tokens_saved += tokens
+        return tokens, self.latency_saved_ms()
+
+    def latency_saved_ms(self):
+        """Mean time to first chunk without the cache minus with it (needs both)."""
+        plain, cached = self._first_chunk[False], self._first_chunk[True]
+        if not plain or not cached:
+            return 0.0
+        return round((sum(plain) / len(plain) - sum(cached) / len(cached)) * 1000, 1)
+
+    def stats(self):
+        return {
+            "enabled": self._handle is not None,
+            "name": self._handle.name if self._handle else None,
+            "prefix_tokens": self._handle.tokens if self._handle else self.prefix.tokens,
+            "expires_in_s": round(self._handle.expires_at - time.time()) if self._handle else None,
+            "creates": self.creates,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "hits": self.hits,
+            "bypassed": self.bypassed,
+            "input_tokens_saved": self.tokens_saved,
+            "first_chunk_ms_saved_avg": self.latency_saved_ms(),
+        }
@@ -0,0 +1,51 @@
+# rate_limit.py
+# Per-client request limits for endpoints that need no session, such as the
+# FAQ report (POST /faq/lookup).
+
+import time
+from collections import OrderedDict
+
+
+def client_key(request):
+    """The client address: the first X-Forwarded-For hop (set by the Vercel
+    edge, which overwrites any value the client sent), else the peer address."""
+    forwarded = request.headers.get("x-forwarded-for", "")
+    if forwarded.split(",")[0].strip():
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class ClientRateLimiter:
+    """At most `limit` requests per client in any `window_seconds`.
+
+    Fixed windows per client, kept in a bounded LRU, so a flood of distinct
+    addresses costs memory only up to `max_clients`. Per process: with several
+    workers a client gets up to `limit` per worker.
+    """
+
+    def __init__(self, limit, window_seconds=3600, max_clients=10000):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.max_clients = max_clients
+        self._windows = OrderedDict()  # client -> [window start, requests]
+        self.allowed = 0
+        self.limited = 0
+
+    def allow(self, client):
+        now = time.monotonic()
+        window = self._windows.get(client)
+        if window is None or now - window[0] >= self.window_seconds:
+            window = [now, 0]
+            self._windows[client] = window
+        self._windows.move_to_end(client)
+        while len(self._windows) > self.max_clients:
+            self._windows.popitem(last=False)
+        if window[1] >= self.limit:
+            self.limited += 1
+            return False
+        window[1] += 1
+        self.allowed += 1
+        return True
+
+    def stats(self):
+        return {"clients": len(self._windows), "allowed": self.allowed, "limited": self.limited}
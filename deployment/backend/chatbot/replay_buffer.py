@@ -0,0 +1,183 @@
+# replay_buffer.py
+# Framed, resumable streaming for /chat.
+#
+# In framed mode (SSE or NDJSON) the answer is generated by a background task
+# into a StreamRecord, and each client connection only tails that record. A
+# client whose connection drops reconnects with its last byte offset and
+# gets the rest of the same answer, without a new generation. Records are
+# kept in a ReplayBuffer bounded by count, bytes and age.
+#
+# Frames (NDJSON shows the same fields as one JSON object per line):
+#   start      {"stream_id", "offset"}
+#   chunk      {"offset", "end", "text"}    offsets are UTF-8 byte offsets
+#   heartbeat  {"offset"}                   sent while nothing else is
+#   done       {"end", "status"}            status: ok | cache_hit | busy | error
+# SSE frames carry `id: <end>`, so Last-Event-ID is the resume offset.
+#
+# The buffer is per process: a reconnect that lands on another instance gets
+# a 404 and the client should ask again.
+
+import json
+import time
+import asyncio
+from collections import OrderedDict
+
+MEDIA_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+
+def stream_format(requested, accept):
+    """Framing for a request: "sse", "ndjson" or None (plain text)."""
+    if requested in MEDIA_TYPES:
+        return requested
+    accept = accept or ""
+    for fmt, media_type in MEDIA_TYPES.items():
+        if media_type in accept:
+            return fmt
+    return None
+
+
+def encode_frame(fmt, event, data, event_id=None):
+    payload = json.dumps(data, ensure_ascii=False)
+    if fmt == "sse":
+        head = f"id: {event_id}\n" if event_id is not None else ""
+        return f"{head}event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+
+class StreamRecord:
+    """Text of one answer as it is generated, readable by byte offset."""
+
+    def __init__(self, stream_id, session_id):
+        self.stream_id = stream_id
+        self.session_id = session_id
+        self.data = bytearray()
+        self.done = False
+        self.status = None
+        self.finished_at = None
+        self._changed = asyncio.Event()
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def append(self, text):
+        self.data += text.encode("utf-8")
+        self._notify()
+
+    def finish(self, status):
+        self.done = True
+        self.status = status
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        # Wake every waiting reader; later readers wait on a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, timeout):
+        """Waits for new text or the end; returns False on timeout."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), max(timeout, 0))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def valid_offset(self, offset):
+        """True if `offset` is within the text and on a character boundary."""
+        if not 0 <= offset <= self.size:
+            return False
+        return offset == self.size or (self.data[offset] & 0xC0) != 0x80
+
+    def read(self, start, end):
+        return self.data[start:end].decode("utf-8")
+
+
+class ReplayBuffer:
+    """Recent StreamRecords, bounded by count, total bytes and age after finishing."""
+
+    def __init__(self, max_streams=1000, max_bytes=16 * 1024 * 1024, ttl_seconds=300):
+        self.max_streams = max_streams
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._records = OrderedDict()  # stream_id -> StreamRecord
+        self.created = 0
+        self.resumes = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def create(self, stream_id, session_id):
+        self._expire()
+        record = StreamRecord(stream_id, session_id)
+        self._records[stream_id] = record
+        self.created += 1
+        self._evict()
+        return record
+
+    def get(self, stream_id, session_id):
+        """The record for a reconnect, or None if unknown, expired or not the session's."""
+        self._expire()
+        record = self._records.get(stream_id)
+        if record is None or record.session_id != session_id:
+            self.misses += 1
+            return None
+        self._records.move_to_end(stream_id)
+        self.resumes += 1
+        return record
+
+    def _expire(self):
+        now = time.monotonic()
+        for stream_id in [s for s, r in self._records.items()
+                          if r.done and now - r.finished_at > self.ttl_seconds]:
+            del self._records[stream_id]
+
+    def _evict(self):
+        # Records being read keep working; they just can no longer be resumed
+        total = sum(r.size for r in self._records.values())
+        while self._records and (len(self._records) > self.max_streams or total > self.max_bytes):
+            _, record = self._records.popitem(last=False)
+            total -= record.size
+            self.evictions += 1
+
+    def trim(self):
+        """Enforces the bounds; call after a record grows."""
+        self._evict()
+
+    def stats(self):
+        return {
+            "streams": len(self._records),
+            "active": sum(1 for r in self._records.values() if not r.done),
+            "bytes": sum(r.size for r in self._records.values()),
+            "created": self.created,
+            "resumes": self.resumes,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+async def iter_frames(record, offset, fmt, heartbeat_seconds=10.0, coalesce_seconds=0.03, coalesce_bytes=256):
+    """Frames for `record` from byte `offset` until the answer is complete.
+
+    Text that arrives in small pieces is held for up to `coalesce_seconds`
+    (or until `coalesce_bytes` are pending) and sent as one chunk frame.
+    """
+    yield encode_frame(fmt, "start", {"stream_id": record.stream_id, "offset": offset}, offset)
+    sent = offset
+    last_frame = time.monotonic()
+    while True:
+        if record.size > sent:
+            deadline = time.monotonic() + coalesce_seconds
+            while not record.done and record.size - sent < coalesce_bytes:
+                if not await record.wait(deadline - time.monotonic()):
+                    break
+            end = record.size
+            yield encode_frame(fmt, "chunk", {"offset": sent, "end": end, "text": record.read(sent, end)}, end)
+            sent = end
+            last_frame = time.monotonic()
+            continue
+        if record.done:
+            yield encode_frame(fmt, "done", {"end": sent, "status": record.status}, sent)
+            return
+        if not await record.wait(heartbeat_seconds - (time.monotonic() - last_frame)):
+            yield encode_frame(fmt, "heartbeat", {"offset": sent})
+            last_frame = time.monotonic()
@@ -0,0 +1,293 @@
+# session_archive.py
+# Compressed, column-oriented archive files for chat sessions moved out of
+# Firestore by archive_sessions.py, and a local reader for offline analysis.
+#
+# Layout of an archive directory (one partition per UTC day of last activity):
+#   date=2025-09-21/sessions-<run>.ssa   one row per session
+#   date=2025-09-21/turns-<run>.ssa      one row per turn
+#
+# An .ssa file is a sequence of row groups. Within a group each column is
+# stored on its own and zlib-compressed, so a reader that needs two columns
+# only reads and inflates those two:
+#   MAGIC | column blocks ... | footer JSON | footer length (u64) | MAGIC
+# The footer lists the schema and, per row group, the byte range of every
+# column block. Column kinds:
+#   int  little-endian int64, -1 when unknown
+#   str  uint32 byte lengths followed by the UTF-8 bytes
+#
+# Writers hold at most one row group in memory, and readers decode one row
+# group at a time, so memory does not depend on the size of the archive.
+#
+# Reader usage:
+#   python session_archive.py stats archive/
+#   python session_archive.py export archive/ --start 2025-09-01 --format jsonl > turns.jsonl
+#   python session_archive.py export archive/ --format script > conversations.json   # for loadtest.py
+
+import os
+import sys
+import json
+import zlib
+import struct
+import argparse
+import datetime
+import numpy as np
+
+MAGIC = b"SSARC1\n"
+SESSION_COLUMNS = {
+    "session_id": "str",
+    "created_at_us": "int",
+    "updated_at_us": "int",
+    "turn_count": "int",
+    "summary_turns": "int",
+    "summary": "str",
+}
+TURN_COLUMNS = {
+    "session_id": "str",
+    "turn_index": "int",
+    "timestamp_us": "int",
+    "user_prompt": "str",
+    "bot_response": "str",
+    "outcome": "str",
+    "latency_ms": "int",
+    "retrieved_chunks": "int",
+    "low_confidence": "int",
+}
+TABLES = {"sessions": SESSION_COLUMNS, "turns": TURN_COLUMNS}
+
+
+def to_micros(ts):
+    """Datetime (naive UTC or aware) to epoch microseconds; -1 if missing."""
+    if ts is None:
+        return -1
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return int(ts.timestamp() * 1_000_000)
+
+
+def from_micros(us):
+    if us < 0:
+        return None
+    return datetime.datetime.fromtimestamp(us / 1_000_000, datetime.timezone.utc)
+
+
+def session_row(session_id, header):
+    return {
+        "session_id": session_id,
+        "created_at_us": to_micros(header.get("created_at")),
+        "updated_at_us": to_micros(header.get("updated_at")),
+        "turn_count": header.get("turn_count", 0),
+        "summary_turns": header.get("summary_turns", 0),
+        "summary": header.get("summary", ""),
+    }
+
+
+def turn_row(session_id, turn_index, message):
+    low_confidence = message.get("low_confidence")
+    return {
+        "session_id": session_id,
+        "turn_index": turn_index,
+        "timestamp_us": to_micros(message.get("timestamp")),
+        "user_prompt": message.get("user_prompt", ""),
+        "bot_response": message.get("bot_response", ""),
+        "outcome": message.get("outcome", ""),
+        "latency_ms": message.get("latency_ms", -1),
+        "retrieved_chunks": message.get("retrieved_chunks", -1),
+        "low_confidence": -1 if low_confidence is None else int(low_confidence),
+    }
+
+
+# --- Encoding ---
+def encode_column(kind, values):
+    if kind == "int":
+        return np.asarray(values, dtype="<i8").tobytes()
+    encoded = [v.encode("utf-8") for v in values]
+    return np.fromiter((len(b) for b in encoded), dtype="<u4", count=len(encoded)).tobytes() + b"".join(encoded)
+
+
+def decode_column(kind, raw, rows):
+    if kind == "int":
+        return np.frombuffer(raw, dtype="<i8", count=rows)
+    lengths = np.frombuffer(raw, dtype="<u4", count=rows)
+    ends = np.cumsum(lengths, dtype=np.int64) + rows * 4
+    starts = ends - lengths
+    return [raw[a:b].decode("utf-8") for a, b in zip(starts.tolist(), ends.tolist())]
+
+
+class ArchiveWriter:
+    """Writes one .ssa file; rows are buffered `row_group_rows` at a time.
+
+    The file is written under a temporary name and renamed into place by
+    close(), after an fsync, so a file that exists is complete.
+    """
+
+    def __init__(self, path, columns, row_group_rows=5000, level=6):
+        self.path = path
+        self.columns = columns
+        self.row_group_rows = row_group_rows
+        self.level = level
+        self.rows = 0
+        self._groups = []
+        self._buffer = {name: [] for name in columns}
+        self._tmp = path + ".tmp"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(self._tmp, "wb")
+        self._file.write(MAGIC)
+
+    def write(self, row):
+        for name in self.columns:
+            self._buffer[name].append(row[name])
+        self.rows += 1
+        if len(self._buffer[next(iter(self.columns))]) >= self.row_group_rows:
+            self._flush_group()
+
+    def _flush_group(self):
+        count = len(self._buffer[next(iter(self.columns))])
+        if not count:
+            return
+        group = {"rows": count, "columns": {}}
+        for name, kind in self.columns.items():
+            block = zlib.compress(encode_column(kind, self._buffer[name]), self.level)
+            group["columns"][name] = [self._file.tell(), len(block)]
+            self._file.write(block)
+            self._buffer[name] = []
+        self._groups.append(group)
+
+    def close(self, meta=None):
+        self._flush_group()
+        footer = json.dumps({
+            "version": 1, "columns": self.columns, "rows": self.rows,
+            "row_groups": self._groups, "meta": meta or {},
+        }).encode("utf-8")
+        self._file.write(footer + struct.pack("<Q", len(footer)) + MAGIC)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp)
+
+
+class ArchiveReader:
+    """Reads an .ssa file one row group at a time, only the columns asked for."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            f.seek(-(8 + len(MAGIC)), os.SEEK_END)
+            tail = f.read()
+            if tail[8:] != MAGIC:
+                raise ValueError(f"{path} is not a complete session archive")
+            (length,) = struct.unpack("<Q", tail[:8])
+            f.seek(-(8 + len(MAGIC) + length), os.SEEK_END)
+            footer = json.loads(f.read(length))
+        self.columns = footer["columns"]
+        self.rows = footer["rows"]
+        self.row_groups = footer["row_groups"]
+        self.meta = footer["meta"]
+
+    def iter_batches(self, columns=None):
+        """Yields {column: values} per row group; ints as numpy arrays, strings as lists."""
+        names = list(columns or self.columns)
+        with open(self.path, "rb") as f:
+            for group in self.row_groups:
+                batch = {}
+                for name in names:
+                    offset, length = group["columns"][name]
+                    f.seek(offset)
+                    batch[name] = decode_column(self.columns[name], zlib.decompress(f.read(length)), group["rows"])
+                yield batch
+
+    def iter_rows(self, columns=None):
+        for batch in self.iter_batches(columns):
+            names = list(batch)
+            for values in zip(*(batch[n] for n in names)):
+                yield {n: (int(v) if isinstance(v, np.integer) else v) for n, v in zip(names, values)}
+
+
+# --- Dataset ---
+def partition_dir(root, day):
+    return os.path.join(root, f"date={day.isoformat()}")
+
+
+def archive_files(root, table="turns", start=None, end=None):
+    """Archive files of `table` for partitions in [start, end] (datetime.date), oldest first."""
+    if not os.path.isdir(root):
+        return []
+    files = []
+    for name in sorted(os.listdir(root)):
+        if not name.startswith("date="):
+            continue
+        day = datetime.date.fromisoformat(name[5:])
+        if (start and day < start) or (end and day > end):
+            continue
+        folder = os.path.join(root, name)
+        files.extend(
+            os.path.join(folder, f) for f in sorted(os.listdir(folder))
+            if f.startswith(table + "-") and f.endswith(".ssa")
+        )
+    return files
+
+
+def iter_table(root, table="turns", columns=None, start=None, end=None):
+    """Rows of a table across the whole archive (or a date range)."""
+    for path in archive_files(root, table, start, end):
+        yield from ArchiveReader(path).iter_rows(columns)
+
+
+def iter_conversations(root, start=None, end=None):
+    """User prompts grouped per session, in turn order, for evaluation replays.
+
+    Turns of a session are written contiguously, so only one conversation is
+    held at a time.
+    """
+    current, prompts = None, []
+    for row in iter_table(root, "turns", ["session_id", "turn_index", "user_prompt"], start, end):
+        if row["session_id"] != current and prompts:
+            yield current, prompts
+            prompts = []
+        current = row["session_id"]
+        prompts.append(row["user_prompt"])
+    if prompts:
+        yield current, prompts
+
+
+def archive_stats(root, start=None, end=None):
+    stats = {"files": 0, "bytes": 0, "sessions": 0, "turns": 0, "partitions": set()}
+    for table in TABLES:
+        for path in archive_files(root, table, start, end):
+            stats["files"] += 1
+            stats["bytes"] += os.path.getsize(path)
+            stats["partitions"].add(os.path.basename(os.path.dirname(path)))
+            stats[table] += ArchiveReader(path).rows
+    stats["partitions"] = len(stats["partitions"])
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read archived chat sessions.")
+    parser.add_argument("command", choices=["stats", "export"])
+    parser.add_argument("root", help="Archive directory written by archive_sessions.py")
+    parser.add_argument("--table", choices=list(TABLES), default="turns")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, help="First partition (YYYY-MM-DD)")
+    parser.add_argument("--end", type=datetime.date.fromisoformat, help="Last partition (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=["jsonl", "script"], default="jsonl",
+                        help="jsonl: one row per line; script: loadtest.py conversations")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(archive_stats(args.root, args.start, args.end)))
+    elif args.format == "script":
+        # Streamed as a JSON list, one conversation per line
+        sys.stdout.write("[")
+        for n, (_, prompts) in enumerate(iter_conversations(args.root, args.start, args.end)):
+            sys.stdout.write(("," if n else "") + "\n" + json.dumps(prompts, ensure_ascii=False))
+        sys.stdout.write("\n]\n")
+    else:
+        for row in iter_table(args.root, args.table, start=args.start, end=args.end):
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
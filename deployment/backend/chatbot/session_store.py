@@ -0,0 +1,432 @@
+# session_store.py
+# Paged storage for chat sessions.
+#
+# Layout (Firestore):
+#   chat_history/{session_id}                 header: counters + rolling summary
+#   chat_history/{session_id}/pages/{000000}  up to `page_size` turns each
+#
+# A page keeps its turns in a `turns` map keyed by the absolute turn index, so
+# a turn lands in its own slot whatever order writes arrive in (a journaled
+# turn replayed after later ones, a retried batch). Pages written before that
+# hold a positional `messages` array; readers accept both.
+#
+# The header keeps `turn_count`, `page_size`, `summary` and `summary_turns`, so
+# a read only fetches the header plus the tail pages the context builder needs,
+# and a write touches one small page instead of an ever-growing array.
+# Legacy documents (a single `messages` array) are migrated on first load, in
+# bulk with migrate_chat_history.py, or by archive_sessions.py before it looks
+# for idle sessions. Migration sets `updated_at` from the last message, so
+# legacy sessions age out like any other.
+#
+# Sessions idle for a long time are moved out by archive_sessions.py, which
+# deletes them or leaves a stub header (summary and counters, no pages and no
+# `updated_at`, so the stub is not picked up again until the session is used).
+#
+# Sessions are not created up front (see session_tokens.py): the header is
+# created with a create-if-absent write when the session's first turn is
+# stored, so visitors who never ask anything leave no document behind.
+#
+# firebase_admin is imported where it is used, so the in-memory store and the
+# app's cold start do not pay for it.
+
+import asyncio
+import datetime
+from history_cache import SessionHistory
+
+COLLECTION = "chat_history"
+PAGES = "pages"
+DEFAULT_PAGE_SIZE = 20
+MAX_BATCH_WRITES = 500  # Firestore limit per batch commit
+
+
+def build_chat_history(messages):
+    """Converts stored message dicts into Gemini `contents` entries."""
+    chat_history = []
+    for msg in messages:
+        # Ensure both keys exist before appending
+        if "user_prompt" in msg and "bot_response" in msg:
+            chat_history.append({"role": "user", "parts": [msg.get("user_prompt")]})
+            chat_history.append({"role": "model", "parts": [msg.get("bot_response")]})
+    return chat_history
+
+
+def page_id(page_no):
+    return f"{page_no:06d}"
+
+
+def load_range(turn_count, summary_turns, tail_turns):
+    """First turn to load: all unsummarized turns plus the last `tail_turns`."""
+    return max(0, min(summary_turns, turn_count - tail_turns))
+
+
+def paginate(messages, page_size, first_turn=0):
+    """Splits messages (starting at absolute turn `first_turn`) into
+    {page_no: {str(turn_index): message}} page `turns` maps."""
+    pages = {}
+    for offset, msg in enumerate(messages):
+        turn_index = first_turn + offset
+        pages.setdefault(turn_index // page_size, {})[str(turn_index)] = msg
+    return pages
+
+
+def page_turns(page_no, page_size, data):
+    """[(turn_index, message)] of a page doc, in turn order.
+
+    Reads the `turns` map and, for pages written before it, the positional
+    `messages` array.
+    """
+    turns = {page_no * page_size + offset: msg for offset, msg in enumerate(data.get("messages", []))}
+    turns.update((int(index), msg) for index, msg in data.get("turns", {}).items())
+    return sorted(turns.items())
+
+
+def history_from_pages(header, pages, first_turn, page_size):
+    """Builds a SessionHistory from header fields and (page_no, page doc) pairs (ordered)."""
+    messages = []
+    for page_no, data in pages:
+        messages.extend(msg for index, msg in page_turns(page_no, page_size, data) if index >= first_turn)
+    return SessionHistory(
+        build_chat_history(messages),
+        summary=header.get("summary", ""),
+        summary_turns=header.get("summary_turns", 0),
+        base_turn=first_turn,
+        page_size=page_size,
+        stored_turn_count=header.get("turn_count", 0),
+    )
+
+
+def group_turns(turns, default_page_size):
+    """Groups queued turns (see persistence.py) as
+    {session_id: {page_no: {str(turn_index): message}}}.
+
+    Also returns each session's page size, turn count (highest turn index + 1)
+    and last timestamp.
+    """
+    grouped, meta = {}, {}
+    for turn in sorted(turns, key=lambda t: (t.session_id, t.turn_index)):
+        page_size = turn.page_size or default_page_size
+        pages = grouped.setdefault(turn.session_id, {})
+        pages.setdefault(turn.turn_index // page_size, {})[str(turn.turn_index)] = turn.message
+        meta[turn.session_id] = (page_size, turn.turn_index + 1, turn.message["timestamp"])
+    return grouped, meta
+
+
+def new_header(session_id, page_size):
+    return {
+        "created_at": datetime.datetime.utcnow(),
+        "session_id": session_id,
+        "turn_count": 0,
+        "page_size": page_size,
+        "summary": "",
+        "summary_turns": 0,
+    }
+
+
+class FirestoreSessionStore:
+    """Paged session storage on the async Firestore client."""
+
+    def __init__(self, db, page_size=DEFAULT_PAGE_SIZE):
+        self.db = db
+        self.page_size = page_size
+
+    def _header_ref(self, session_id):
+        return self.db.collection(COLLECTION).document(session_id)
+
+    def _page_ref(self, session_id, page_no):
+        return self._header_ref(session_id).collection(PAGES).document(page_id(page_no))
+
+    async def create(self, session_id, page_size=None):
+        """Creates an empty header in one write; returns False if the session exists."""
+        from google.api_core.exceptions import AlreadyExists
+        try:
+            await self._header_ref(session_id).create(new_header(session_id, page_size or self.page_size))
+            return True
+        except AlreadyExists:
+            return False
+
+    async def load(self, session_id, tail_turns):
+        header_doc = await self._header_ref(session_id).get()
+        if not header_doc.exists:
+            return SessionHistory(page_size=self.page_size)
+        header = header_doc.to_dict()
+        if "messages" in header:
+            header = await self.migrate(session_id, header)
+
+        turn_count = header.get("turn_count", 0)
+        page_size = header.get("page_size", self.page_size)
+        first_turn = load_range(turn_count, header.get("summary_turns", 0), tail_turns)
+        if turn_count == 0:
+            return history_from_pages(header, [], first_turn, page_size)
+
+        page_nos = range(first_turn // page_size, (turn_count - 1) // page_size + 1)
+        refs = [self._page_ref(session_id, n) for n in page_nos]
+        pages = {}
+        async for page_doc in self.db.get_all(refs):
+            if page_doc.exists:
+                pages[int(page_doc.id)] = page_doc.to_dict()
+        ordered = [(n, pages.get(n, {})) for n in page_nos]
+        return history_from_pages(header, ordered, first_turn, page_size)
+
+    async def append_turn(self, session_id, turn_index, message, page_size=None):
+        """Writes turn number `turn_index` into its page slot and bumps the header.
+
+        `page_size` must be the one the session was loaded with (the header's).
+        `turn_count` only ever rises to `turn_index + 1`, so writing the same
+        turn twice (a retry after a commit that did land) is harmless.
+        """
+        from firebase_admin import firestore
+        page_size = page_size or self.page_size
+        if turn_index == 0:
+            await self.create(session_id, page_size)
+        batch = self.db.batch()
+        batch.set(
+            self._page_ref(session_id, turn_index // page_size),
+            {"turns": {str(turn_index): message}},
+            merge=True,
+        )
+        batch.set(
+            self._header_ref(session_id),
+            {
+                "session_id": session_id,
+                "page_size": page_size,
+                "turn_count": firestore.Maximum(turn_index + 1),
+                "updated_at": message["timestamp"],
+            },
+            merge=True,
+        )
+        await batch.commit()
+
+    async def append_turns(self, turns):
+        """Writes many queued turns: one page write per (session, page) and one
+        header update per session. A session's writes never span commits, and
+        every write is idempotent, so a retried batch cannot double count."""
+        from firebase_admin import firestore
+        grouped, meta = group_turns(turns, self.page_size)
+        # Headers of new sessions first, so they start from new_header()
+        await asyncio.gather(*(
+            self.create(t.session_id, t.page_size) for t in turns if t.turn_index == 0
+        ))
+        batch, writes = self.db.batch(), 0
+        for session_id, pages in grouped.items():
+            needed = len(pages) + 1
+            if writes and writes + needed > MAX_BATCH_WRITES:
+                await batch.commit()
+                batch, writes = self.db.batch(), 0
+            page_size, turn_count, updated_at = meta[session_id]
+            for page_no, slots in pages.items():
+                batch.set(self._page_ref(session_id, page_no), {"turns": slots}, merge=True)
+            batch.set(
+                self._header_ref(session_id),
+                {
+                    "session_id": session_id,
+                    "page_size": page_size,
+                    "turn_count": firestore.Maximum(turn_count),
+                    "updated_at": updated_at,
+                },
+                merge=True,
+            )
+            writes += needed
+        if writes:
+            await batch.commit()
+
+    async def save_summary(self, session_id, summary, summary_turns):
+        await self._header_ref(session_id).set(
+            {"summary": summary, "summary_turns": summary_turns}, merge=True
+        )
+
+    async def migrate(self, session_id, legacy):
+        """Rewrites a legacy `messages`-array document into header + pages."""
+        from firebase_admin import firestore
+        messages = legacy.get("messages", [])
+        header = {k: v for k, v in legacy.items() if k != "messages"}
+        header.update({
+            "session_id": session_id,
+            "turn_count": len(messages),
+            "page_size": self.page_size,
+            "summary": legacy.get("summary", ""),
+            "summary_turns": legacy.get("summary_turns", 0),
+        })
+        header.setdefault("created_at", datetime.datetime.utcnow())
+        if not header.get("updated_at"):
+            last = messages[-1].get("timestamp") if messages else None
+            header["updated_at"] = last or header["created_at"]
+
+        batch = self.db.batch()
+        for page_no, slots in paginate(messages, self.page_size).items():
+            batch.set(self._page_ref(session_id, page_no), {"turns": slots})
+        batch.set(self._header_ref(session_id), {**header, "messages": firestore.DELETE_FIELD}, merge=True)
+        await batch.commit()
+        return header
+
+
+    # --- Archival (see archive_sessions.py) ---
+    async def legacy_sessions(self, page=200):
+        """Yields (session_id, document) for documents still in the legacy
+        `messages`-array layout (which have no `updated_at`)."""
+        query = self.db.collection(COLLECTION).where("messages", "!=", None)
+        last = None
+        while True:
+            paged = query.start_after(last) if last is not None else query
+            docs = [doc async for doc in paged.limit(page).stream()]
+            for doc in docs:
+                yield doc.id, doc.to_dict()
+            if len(docs) < page:
+                return
+            last = docs[-1]
+
+    async def idle_sessions(self, before, page=200):
+        """Yields (session_id, header, version) for sessions last updated before
+        `before`, oldest first. `version` guards expire() against late writes."""
+        query = self.db.collection(COLLECTION).where("updated_at", "<", before).order_by("updated_at")
+        last = None
+        while True:
+            paged = query.start_after(last) if last is not None else query
+            docs = [doc async for doc in paged.limit(page).stream()]
+            for doc in docs:
+                yield doc.id, doc.to_dict(), doc.update_time
+            if len(docs) < page:
+                return
+            last = docs[-1]
+
+    async def iter_turns(self, session_id, header):
+        """Yields (turn_index, message) of a session, one page read at a time."""
+        page_size = header.get("page_size", self.page_size)
+        async for page_doc in self._header_ref(session_id).collection(PAGES).stream():
+            for turn_index, message in page_turns(int(page_doc.id), page_size, page_doc.to_dict()):
+                yield turn_index, message
+
+    async def expire(self, sessions, stub=False, note=None):
+        """Deletes (or stubs) archived sessions: [(session_id, header, version)].
+
+        A session whose header changed since it was read is kept and its id is
+        returned, so a turn written during archival is never lost.
+        """
+        from firebase_admin import firestore
+        from google.api_core.exceptions import FailedPrecondition
+
+        def page_count(header):
+            return max(header.get("turn_count", 0) - 1, 0) // header.get("page_size", self.page_size) + 1
+
+        def add(batch, session_id, header, version):
+            for page_no in range(page_count(header)):
+                batch.delete(self._page_ref(session_id, page_no))
+            option = self.db.write_option(last_update_time=version)
+            if stub:
+                batch.update(self._header_ref(session_id), {
+                    "archived_at": datetime.datetime.utcnow(),
+                    "archive": note,
+                    "updated_at": firestore.DELETE_FIELD,
+                }, option=option)
+            else:
+                batch.delete(self._header_ref(session_id), option=option)
+
+        kept = []
+        groups, group, writes = [], [], 0
+        for entry in sessions:
+            needed = page_count(entry[1]) + 1
+            if group and writes + needed > MAX_BATCH_WRITES:
+                groups.append(group)
+                group, writes = [], 0
+            group.append(entry)
+            writes += needed
+        if group:
+            groups.append(group)
+
+        for group in groups:
+            batch = self.db.batch()
+            for entry in group:
+                add(batch, *entry)
+            try:
+                await batch.commit()
+            except FailedPrecondition:
+                # Someone wrote to a session in this group; retry one by one
+                for entry in group:
+                    single = self.db.batch()
+                    add(single, *entry)
+                    try:
+                        await single.commit()
+                    except FailedPrecondition:
+                        kept.append(entry[0])
+        return kept
+
+
+class InMemorySessionStore:
+    """Same interface as FirestoreSessionStore, kept in process memory.
+
+    Used for offline runs (SESSION_STORE=memory) and local testing.
+    """
+
+    def __init__(self, page_size=DEFAULT_PAGE_SIZE):
+        self.page_size = page_size
+        self.headers = {}
+        self.pages = {}  # (session_id, page_no) -> {"turns": {str(turn_index): message}}
+
+    async def create(self, session_id):
+        if session_id in self.headers:
+            return False
+        self.headers[session_id] = new_header(session_id, self.page_size)
+        return True
+
+    async def load(self, session_id, tail_turns):
+        header = self.headers.get(session_id)
+        if header is None:
+            return SessionHistory(page_size=self.page_size)
+        turn_count = header["turn_count"]
+        page_size = header["page_size"]
+        first_turn = load_range(turn_count, header["summary_turns"], tail_turns)
+        page_nos = range(first_turn // page_size, (turn_count - 1) // page_size + 1) if turn_count else []
+        ordered = [(n, self.pages.get((session_id, n), {})) for n in page_nos]
+        return history_from_pages(header, ordered, first_turn, page_size)
+
+    async def append_turn(self, session_id, turn_index, message, page_size=None):
+        header = self.headers.setdefault(session_id, new_header(session_id, page_size or self.page_size))
+        page_size = header["page_size"]
+        page = self.pages.setdefault((session_id, turn_index // page_size), {"turns": {}})
+        page["turns"][str(turn_index)] = message
+        header["turn_count"] = max(header["turn_count"], turn_index + 1)
+        header["updated_at"] = message["timestamp"]
+
+    async def append_turns(self, turns):
+        for turn in sorted(turns, key=lambda t: (t.session_id, t.turn_index)):
+            await self.append_turn(turn.session_id, turn.turn_index, turn.message, turn.page_size)
+
+    async def save_summary(self, session_id, summary, summary_turns):
+        header = self.headers.setdefault(session_id, new_header(session_id, self.page_size))
+        header["summary"] = summary
+        header["summary_turns"] = summary_turns
+
+    async def legacy_sessions(self, page=200):
+        # Sessions in memory are always written in the paged layout
+        for session_id in ():
+            yield session_id, {}
+
+    async def idle_sessions(self, before, page=200):
+        idle = sorted(
+            (h["updated_at"], sid) for sid, h in self.headers.items()
+            if h.get("updated_at") is not None and h["updated_at"] < before
+        )
+        for _, session_id in idle:
+            header = self.headers[session_id]
+            yield session_id, dict(header), header["turn_count"]
+
+    async def iter_turns(self, session_id, header):
+        page_size = header["page_size"]
+        for page_no in range((header["turn_count"] - 1) // page_size + 1 if header["turn_count"] else 0):
+            for turn_index, message in page_turns(page_no, page_size, self.pages.get((session_id, page_no), {})):
+                yield turn_index, message
+
+    async def expire(self, sessions, stub=False, note=None):
+        kept = []
+        for session_id, header, version in sessions:
+            current = self.headers.get(session_id)
+            if current is None or current["turn_count"] != version:
+                kept.append(session_id)
+                continue
+            for page_no in range(current["turn_count"] // current["page_size"] + 1):
+                self.pages.pop((session_id, page_no), None)
+            if stub:
+                current.pop("updated_at", None)
+                current.update({"archived_at": datetime.datetime.utcnow(), "archive": note})
+            else:
+                del self.headers[session_id]
+        return kept
@@ -0,0 +1,71 @@
+# session_tokens.py
+# Stateless, HMAC-signed session tokens.
+#
+# A token names a server-generated session id and when it was issued:
+#   base64url(session_id "." issued_at) "." base64url(HMAC-SHA256)
+# Issuing and checking a token never touches the database; the session's
+# header document is only created when its first turn is stored.
+#
+# SESSION_SECRET may hold several comma-separated secrets: tokens are signed
+# with the first and accepted with any, so a secret can be rotated without
+# ending live sessions.
+
+import hmac
+import time
+import uuid
+import base64
+import hashlib
+import secrets
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class SessionSigner:
+    def __init__(self, secrets_csv=None, ttl_seconds=30 * 24 * 3600):
+        keys = [s.strip() for s in (secrets_csv or "").split(",") if s.strip()]
+        if not keys:
+            # Tokens then only work on this process: offline runs only (main.py
+            # refuses to start without SESSION_SECRET otherwise)
+            print("SESSION_SECRET is not set; using a random per-process secret.")
+            keys = [secrets.token_hex(32)]
+        self.keys = [k.encode("utf-8") for k in keys]
+        self.ttl_seconds = ttl_seconds
+        self.issued = 0
+        self.rejected = 0
+
+    def _sign(self, key, payload):
+        return hmac.new(key, payload, hashlib.sha256).digest()
+
+    def issue(self):
+        """Returns (session_id, token) for a new session."""
+        session_id = uuid.uuid4().hex
+        payload = f"{session_id}.{int(time.time())}".encode("ascii")
+        self.issued += 1
+        return session_id, f"{b64encode(payload)}.{b64encode(self._sign(self.keys[0], payload))}"
+
+    def verify(self, token):
+        """The token's session id, or None if it is malformed, forged or expired."""
+        try:
+            payload_b64, signature_b64 = token.split(".")
+            payload, signature = b64decode(payload_b64), b64decode(signature_b64)
+            session_id, issued_at = payload.decode("ascii").split(".")
+            issued_at = int(issued_at)
+        except (ValueError, UnicodeDecodeError):
+            self.rejected += 1
+            return None
+        if not any(hmac.compare_digest(self._sign(key, payload), signature) for key in self.keys):
+            self.rejected += 1
+            return None
+        if time.time() - issued_at > self.ttl_seconds:
+            self.rejected += 1
+            return None
+        return session_id
+
+    def stats(self):
+        return {"issued": self.issued, "rejected": self.rejected, "keys": len(self.keys)}
@@ -0,0 +1,248 @@
+# vector_index.py
+# On-disk vector index for the RAG step.
+#
+# Files in the index directory:
+#   embeddings.f32  contiguous float32 matrix (count x dim), memory-mapped so
+#                   every worker on the host shares one copy in the page cache
+#   chunks.jsonl    one JSON record per row (text, source, page, ...)
+#   offsets.u64     byte offset of each record in chunks.jsonl
+#   meta.json       dim, count, byte sizes and embedder name
+#
+# A single writer appends rows; readers only see rows up to meta.json's
+# `count`, which is replaced atomically after the data files are written.
+
+import os
+import json
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.f32"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "offsets.u64"
+META_FILE = "meta.json"
+
+
+class VectorIndex:
+    """Memory-mapped float32 matrix with batched top-k cosine search."""
+
+    def __init__(self, path, dim=384, embedder_name="hashing-v2", block_rows=65536):
+        self.path = path
+        self.dim = dim
+        self.embedder_name = embedder_name
+        self.block_rows = block_rows
+        self._meta = None
+        self._meta_mtime = None
+        self._mapped = None  # (meta, matrix, offsets) mapped for that meta
+
+    # --- Metadata ---
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def meta(self):
+        """Current meta.json, reloaded when the writer has published new rows."""
+        try:
+            mtime = os.stat(self._file(META_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return {"dim": self.dim, "count": 0, "chunks_bytes": 0, "embedder": self.embedder_name}
+        if mtime != self._meta_mtime:
+            with open(self._file(META_FILE), "r", encoding="utf-8") as f:
+                self._meta = json.load(f)
+            self._meta_mtime = mtime
+            self._mapped = None
+            self.dim = self._meta["dim"]
+        return self._meta
+
+    def __len__(self):
+        return self.meta()["count"]
+
+    def _write_meta(self, meta):
+        tmp = self._file(META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._file(META_FILE))
+
+    # --- Reading ---
+    def _view(self):
+        """(matrix, offsets) mapped for one meta.json, or (None, None) if empty.
+
+        Callers keep the pair locally: retrieval runs in threads, and another
+        thread may reload meta.json between two attribute reads.
+        """
+        meta = self.meta()
+        mapped = self._mapped
+        if mapped is None or mapped[0] is not meta:
+            if not meta["count"]:
+                return None, None
+            mapped = (
+                meta,
+                np.memmap(self._file(EMBEDDINGS_FILE), dtype=np.float32, mode="r",
+                          shape=(meta["count"], meta["dim"])),
+                np.memmap(self._file(OFFSETS_FILE), dtype=np.uint64, mode="r", shape=(meta["count"],)),
+            )
+            self._mapped = mapped
+        return mapped[1], mapped[2]
+
+    def matrix(self):
+        return self._view()[0]
+
+    def records(self, rows):
+        """Reads the chunk records for `rows` without loading the whole file."""
+        offsets = self._view()[1]
+        results = []
+        with open(self._file(CHUNKS_FILE), "rb") as f:
+            for row in rows:
+                f.seek(int(offsets[row]))
+                results.append(json.loads(f.readline()))
+        return results
+
+    def search(self, queries, k=4):
+        """Top-k rows by cosine similarity for each query row.
+
+        `queries` is (q, dim) or (dim,), already L2-normalized. The matrix is
+        scanned in blocks so memory stays bounded for millions of rows.
+        Returns (scores, rows), each (q, k') sorted best first.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        matrix = self.matrix()
+        if matrix is None:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+        k = min(k, matrix.shape[0])
+
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, matrix.shape[0], self.block_rows):
+            block = matrix[start:start + self.block_rows]
+            scores = queries @ block.T
+            kk = min(k, scores.shape[1])
+            top = np.argpartition(scores, scores.shape[1] - kk, axis=1)[:, -kk:]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, 1)], axis=1)
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(best_scores, best_scores.shape[1] - k, axis=1)[:, -k:]
+                best_scores = np.take_along_axis(best_scores, keep, 1)
+                best_rows = np.take_along_axis(best_rows, keep, 1)
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, 1), np.take_along_axis(best_rows, order, 1)
+
+    # --- Writing ---
+    def append(self, vectors, records):
+        """Appends rows and their records; returns the new row count.
+
+        Bytes past the published count (from an interrupted append) are
+        truncated first, so a crash never leaves misaligned files.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of shape (n, {self.dim}), got {vectors.shape}")
+        if len(vectors) != len(records):
+            raise ValueError("vectors and records must have the same length")
+        os.makedirs(self.path, exist_ok=True)
+        meta = dict(self.meta())
+        count = meta["count"]
+
+        for name, size in (
+            (EMBEDDINGS_FILE, count * self.dim * 4),
+            (OFFSETS_FILE, count * 8),
+            (CHUNKS_FILE, meta["chunks_bytes"]),
+        ):
+            with open(self._file(name), "ab") as f:
+                f.truncate(size)
+
+        offsets = np.empty(len(records), dtype=np.uint64)
+        with open(self._file(CHUNKS_FILE), "ab") as f:
+            for i, record in enumerate(records):
+                offsets[i] = f.tell()
+                f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            chunks_bytes = f.tell()
+        with open(self._file(EMBEDDINGS_FILE), "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self._file(OFFSETS_FILE), "ab") as f:
+            f.write(offsets.tobytes())
+
+        meta.update({
+            "dim": self.dim,
+            "count": count + len(vectors),
+            "chunks_bytes": chunks_bytes,
+            "embedder": meta.get("embedder", self.embedder_name),
+        })
+        self._write_meta(meta)
+        self._mapped = None
+        return meta["count"]
+
+
+class Retriever:
+    """Embeds queries and returns the best matching chunk records.
+
+    With a `lexical` (BM25) index over the same rows, dense and lexical hits
+    are combined by reciprocal rank fusion, so exact tokens such as form
+    numbers still surface when the embedding misses them. Dense hits need a
+    cosine of at least `min_score`, and `dense_only_score` when the lexical
+    index does not also find the chunk; lexical hits need a selective term
+    (see LexicalIndex.search). A question with neither gets no chunks.
+
+    Each record carries `score` (the cosine, None for a lexical-only hit) and,
+    with a lexical index, `rrf_score` (the fused rank score it was ordered by).
+    """
+
+    def __init__(self, index, embedder, top_k=4, min_score=0.2, lexical=None, rrf_k=60, dense_only_score=0.3):
+        self.index = index
+        self.embedder = embedder
+        self.top_k = top_k
+        self.min_score = min_score
+        self.dense_only_score = dense_only_score
+        self.lexical = lexical
+        self.rrf_k = rrf_k
+
+    def retrieve_many(self, queries, k=None):
+        k = k or self.top_k
+        fetch = k * 2 if self.lexical is not None else k
+        vectors = self.embedder.embed(queries)
+        scores, rows = self.index.search(vectors, fetch)
+        results = []
+        for query, q_scores, q_rows in zip(queries, scores, rows):
+            dense = [(int(r), float(s)) for s, r in zip(q_scores, q_rows) if s >= self.min_score]
+            cosine = dict(dense)
+            if self.lexical is not None:
+                lexical = self.lexical.search(query, fetch)
+                found = {r for r, _ in lexical}
+                dense = [(r, s) for r, s in dense if s >= self.dense_only_score or r in found]
+                hits = self._fuse(dense, lexical)[:k]
+                records = self.index.records([r for r, _ in hits])
+                results.append([
+                    {**rec, "score": round(cosine[r], 4) if r in cosine else None, "rrf_score": round(s, 4)}
+                    for (r, s), rec in zip(hits, records)
+                ])
+            else:
+                hits = dense[:k]
+                records = self.index.records([r for r, _ in hits])
+                results.append([{**rec, "score": round(s, 4)} for (_, s), rec in zip(hits, records)])
+        return results
+
+    def _fuse(self, dense, lexical):
+        fused = {}
+        for ranked in (dense, lexical):
+            for rank, (row, _) in enumerate(ranked):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        return sorted(fused.items(), key=lambda item: -item[1])
+
+    def retrieve(self, query, k=None):
+        return self.retrieve_many([query], k)[0]
+
+
+def format_context(chunks):
+    """Grounding block prepended to the student's question."""
+    if not chunks:
+        return ""
+    lines = ["Relevant excerpts from official institutional documents:"]
+    for i, chunk in enumerate(chunks, 1):
+        source = chunk.get("source", "unknown")
+        if chunk.get("page") is not None:
+            source = f"{source}, page {chunk['page']}"
+        lines.append(f"[{i}] ({source}) {chunk.get('text', '').strip()}")
+    lines.append(
+        "Answer using these excerpts where relevant and cite them as [n] with the source name."
+    )
+    return "\n".join(lines)
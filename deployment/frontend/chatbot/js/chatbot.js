@@ -7,7 +7,16 @@ class ShikshaSaathiChatbot {
         this.isWaitingForResponse = false;
         this.selectedLanguage = 'en';
         this.welcomeDismissed = false;
-        this.sessionId = ShikshaSaathiUtils.generateSessionId();
+        // The backend issues a signed session token with the first answer;
+        // no request is made on page load
+        this.sessionToken = ShikshaSaathiUtils.getSessionToken();
+        this.sessionId = null;
+        // Only the first question of a visit may be answered from the FAQ
+        // bundle; the session it starts arrives with the report, which the
+        // next /chat waits for
+        this.askedQuestion = this.sessionToken !== null;
+        this.faqSession = null;
+        this.faq = new ShikshaSaathiFaq(this.backendUrl);
 
         this.dom = this.initializeDOMElements();
         this.init();
@@ -36,31 +45,17 @@ class ShikshaSaathiChatbot {
         ShikshaSaathiUtils.setTheme(ShikshaSaathiUtils.getStoredTheme());
         this.updateUILanguage(this.selectedLanguage);
         this.handleSendButtonState();
-        this.startSession();
+        this.faq.load();
     }
 
     // Session Management
-    async startSession() {
-        try {
-            const response = await fetch(`${this.backendUrl}/session/start`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ session_id: this.sessionId })
-            });
-            
-            if (!response.ok) {
-                const errorText = await response.text();
-                console.error('Failed to start session:', errorText);
-                this.showNotification('Could not initialize a new chat session.', 'error');
-                return;
-            }
-            
-            const data = await response.json();
-            console.log('Session status:', data.status);
-        } catch (error) {
-            console.error('Error starting session:', error);
-            this.showNotification('Error connecting to the server.', 'error');
+    rememberSession(response) {
+        const token = response.headers.get('X-Session-Token');
+        if (token) {
+            this.sessionToken = token;
+            ShikshaSaathiUtils.storeSessionToken(token);
         }
+        this.sessionId = response.headers.get('X-Session-Id') || this.sessionId;
     }
 
     // Event Listeners Setup
@@ -209,42 +204,29 @@ class ShikshaSaathiChatbot {
                 }
             }, 8);
 
-            // Network fetch
-            const response = await fetch(`${this.backendUrl}/chat`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    message: userMessage,
-                    session_id: this.sessionId
-                })
-            });
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! Status: ${response.status}`);
+            // A first question that matches the FAQ bundle is answered locally
+            // and reported, which saves it as the session's first turn; follow-ups
+            // depend on the conversation and go to the backend
+            const faqAnswer = this.askedQuestion ? null : this.faq.lookup(userMessage);
+            this.askedQuestion = true;
+            if (faqAnswer) {
+                this.faqSession = this.faq.report(userMessage)
+                    .then(response => response && this.rememberSession(response));
+                await this.hideTypingIndicator();
+                charQueue.push(...faqAnswer.split(''));
+            } else {
+                await this.streamFromBackend(userMessage, text => charQueue.push(...text.split('')));
             }
-            
-            await this.hideTypingIndicator();
 
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) {
-                    const finalCheck = setInterval(() => {
-                        if (charQueue.length === 0) {
-                            clearInterval(rendererInterval);
-                            clearInterval(finalCheck);
-                            this.isWaitingForResponse = false;
-                            this.handleSendButtonState();
-                            ShikshaSaathiUtils.announceToScreenReader(fullReply);
-                        }
-                    }, 50);
-                    break;
+            const finalCheck = setInterval(() => {
+                if (charQueue.length === 0) {
+                    clearInterval(rendererInterval);
+                    clearInterval(finalCheck);
+                    this.isWaitingForResponse = false;
+                    this.handleSendButtonState();
+                    ShikshaSaathiUtils.announceToScreenReader(fullReply);
                 }
-                const chunk = decoder.decode(value, { stream: true });
-                charQueue.push(...chunk.split(''));
-            }
+            }, 50);
 
         } catch (error) {
             if (rendererInterval) clearInterval(rendererInterval);
@@ -258,6 +240,81 @@ class ShikshaSaathiChatbot {
         }
     }
 
+    // Network fetch: framed NDJSON, so a dropped connection can resume
+    // the same answer instead of generating it again
+    async streamFromBackend(userMessage, onText) {
+        // A follow-up to a local FAQ answer continues the session it started
+        if (this.faqSession) await this.faqSession;
+        const stream = { id: null, offset: 0, done: false };
+        let request = fetch(`${this.backendUrl}/chat?stream=ndjson`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                message: userMessage,
+                session_token: this.sessionToken
+            })
+        });
+        let resumeAttempts = 0;
+
+        while (true) {
+            try {
+                const response = await request;
+                if (!response.ok) {
+                    const httpError = new Error(`HTTP error! Status: ${response.status}`);
+                    httpError.fatal = true;
+                    throw httpError;
+                }
+                this.rememberSession(response);
+                await this.hideTypingIndicator();
+                await this.readFrames(response, stream, onText);
+            } catch (error) {
+                if (error.fatal || !stream.id) throw error;
+                console.warn('Stream interrupted, resuming:', error);
+            }
+            if (stream.done) break;
+            if (!stream.id || resumeAttempts >= 3) {
+                throw new Error('Stream ended before the answer was complete');
+            }
+
+            resumeAttempts++;
+            await new Promise(resolve => setTimeout(resolve, 500 * resumeAttempts));
+            const params = new URLSearchParams({
+                session_id: this.sessionId,
+                offset: stream.offset,
+                stream: 'ndjson'
+            });
+            request = fetch(`${this.backendUrl}/chat/stream/${stream.id}?${params}`);
+        }
+    }
+
+    // Reads NDJSON frames (start/chunk/heartbeat/done), tracking the byte
+    // offset reached so an interrupted stream can be resumed from it
+    async readFrames(response, stream, onText) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) return;
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const frame = JSON.parse(line);
+                if (frame.event === 'start') {
+                    stream.id = frame.stream_id;
+                } else if (frame.event === 'chunk' && frame.offset === stream.offset) {
+                    onText(frame.text);
+                    stream.offset = frame.end;
+                } else if (frame.event === 'done') {
+                    stream.done = true;
+                }
+            }
+        }
+    }
+
     // UI Methods
     addMessage(sender, text, options = {}) {
         const messageEl = document.createElement('div');
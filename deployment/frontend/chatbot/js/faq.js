@@ -0,0 +1,148 @@
+// Lowercase characters whose case folding differs from themselves (from
+// Python's unicodedata; characters NFKC replaces are left out)
+const CASE_FOLDS = {
+    '\u00df': '\u0073\u0073', '\u01f0': '\u006a\u030c', '\u0345': '\u03b9',
+    '\u0390': '\u03b9\u0308\u0301', '\u03b0': '\u03c5\u0308\u0301', '\u03c2': '\u03c3',
+    '\u1c80': '\u0432', '\u1c81': '\u0434', '\u1c82': '\u043e', '\u1c83': '\u0441',
+    '\u1c84': '\u0442', '\u1c85': '\u0442', '\u1c86': '\u044a', '\u1c87': '\u0463',
+    '\u1c88': '\ua64b', '\u1e96': '\u0068\u0331', '\u1e97': '\u0074\u0308',
+    '\u1e98': '\u0077\u030a', '\u1e99': '\u0079\u030a', '\u1f50': '\u03c5\u0313',
+    '\u1f52': '\u03c5\u0313\u0300', '\u1f54': '\u03c5\u0313\u0301', '\u1f56': '\u03c5\u0313\u0342',
+    '\u1f80': '\u1f00\u03b9', '\u1f81': '\u1f01\u03b9', '\u1f82': '\u1f02\u03b9',
+    '\u1f83': '\u1f03\u03b9', '\u1f84': '\u1f04\u03b9', '\u1f85': '\u1f05\u03b9',
+    '\u1f86': '\u1f06\u03b9', '\u1f87': '\u1f07\u03b9', '\u1f90': '\u1f20\u03b9',
+    '\u1f91': '\u1f21\u03b9', '\u1f92': '\u1f22\u03b9', '\u1f93': '\u1f23\u03b9',
+    '\u1f94': '\u1f24\u03b9', '\u1f95': '\u1f25\u03b9', '\u1f96': '\u1f26\u03b9',
+    '\u1f97': '\u1f27\u03b9', '\u1fa0': '\u1f60\u03b9', '\u1fa1': '\u1f61\u03b9',
+    '\u1fa2': '\u1f62\u03b9', '\u1fa3': '\u1f63\u03b9', '\u1fa4': '\u1f64\u03b9',
+    '\u1fa5': '\u1f65\u03b9', '\u1fa6': '\u1f66\u03b9', '\u1fa7': '\u1f67\u03b9',
+    '\u1fb2': '\u1f70\u03b9', '\u1fb3': '\u03b1\u03b9', '\u1fb4': '\u03ac\u03b9',
+    '\u1fb6': '\u03b1\u0342', '\u1fb7': '\u03b1\u0342\u03b9', '\u1fc2': '\u1f74\u03b9',
+    '\u1fc3': '\u03b7\u03b9', '\u1fc4': '\u03ae\u03b9', '\u1fc6': '\u03b7\u0342',
+    '\u1fc7': '\u03b7\u0342\u03b9', '\u1fd2': '\u03b9\u0308\u0300', '\u1fd6': '\u03b9\u0342',
+    '\u1fd7': '\u03b9\u0308\u0342', '\u1fe2': '\u03c5\u0308\u0300', '\u1fe4': '\u03c1\u0313',
+    '\u1fe6': '\u03c5\u0342', '\u1fe7': '\u03c5\u0308\u0342', '\u1ff2': '\u1f7c\u03b9',
+    '\u1ff3': '\u03c9\u03b9', '\u1ff4': '\u03ce\u03b9', '\u1ff6': '\u03c9\u0342',
+    '\u1ff7': '\u03c9\u0342\u03b9'
+};
+
+// What Python's str.split() splits on (unlike \s: U+001C-001F and U+0085,
+// but not U+FEFF)
+const PY_WHITESPACE = /[\t-\r\x1c-\x20\x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+/;
+
+/**
+ * FAQ bundle: the most asked questions with their answers, fetched from
+ * /faq/snapshot and kept in localStorage so matching questions are answered
+ * instantly, and still work offline.
+ */
+class ShikshaSaathiFaq {
+    constructor(backendUrl) {
+        this.url = `${backendUrl}/faq/snapshot`;
+        this.reportUrl = `${backendUrl}/faq/lookup`;
+        this.storageKey = 'shiksha_saathi_faq';
+        this.byKey = new Map();
+        this.keyGrams = new Map();
+        this.threshold = 0.8;
+        this.version = null;
+        this.use(this.readStored());
+    }
+
+    // Revalidates against the backend (a 304 when nothing changed)
+    async load() {
+        try {
+            const response = await fetch(this.url, { cache: 'no-cache' });
+            if (!response.ok) return;
+            const snapshot = await response.json();
+            if (snapshot.version !== this.version) {
+                this.use(snapshot);
+                localStorage.setItem(this.storageKey, JSON.stringify(snapshot));
+            }
+        } catch (error) {
+            console.warn('FAQ bundle unavailable, using the stored copy:', error);
+        }
+    }
+
+    readStored() {
+        try {
+            return JSON.parse(localStorage.getItem(this.storageKey));
+        } catch (error) {
+            return null;
+        }
+    }
+
+    use(snapshot) {
+        if (!snapshot || !Array.isArray(snapshot.entries)) return;
+        this.version = snapshot.version;
+        this.threshold = snapshot.similarity_threshold || 0.8;
+        this.byKey.clear();
+        this.keyGrams.clear();
+        for (const entry of snapshot.entries) {
+            for (const key of entry.keys) {
+                this.byKey.set(key, entry);
+                this.keyGrams.set(key, ShikshaSaathiFaq.trigrams(key));
+            }
+        }
+    }
+
+    // Same normalization as the backend (answer_cache.normalize_prompt):
+    // NFKC, case folding, punctuation to spaces, collapsed whitespace
+    static normalize(text) {
+        return ShikshaSaathiFaq.casefold(text.normalize('NFKC'))
+            .replace(/\p{P}/gu, ' ')
+            .split(PY_WHITESPACE).filter(Boolean).join(' ');
+    }
+
+    // Python's str.casefold(): toLowerCase() plus the full case foldings
+    // that differ from it (ß -> ss, final ς -> σ, ...). Cherokee small
+    // letters fold to the capitals.
+    static casefold(text) {
+        return Array.from(text.toLowerCase(), ch => {
+            if (ch in CASE_FOLDS) return CASE_FOLDS[ch];
+            const code = ch.codePointAt(0);
+            if (code >= 0xab70 && code <= 0xabbf) return String.fromCodePoint(code - 0xab70 + 0x13a0);
+            if (code >= 0x13f8 && code <= 0x13fd) return String.fromCodePoint(code - 8);
+            return ch;
+        }).join('');
+    }
+
+    static trigrams(text) {
+        const padded = `  ${text} `;
+        const grams = new Set();
+        for (let i = 0; i < padded.length - 2; i++) grams.add(padded.slice(i, i + 3));
+        return grams;
+    }
+
+    // Answer for an exact or near-exact match, or null
+    lookup(question) {
+        const key = ShikshaSaathiFaq.normalize(question);
+        if (!key || this.byKey.size === 0) return null;
+        if (this.byKey.has(key)) return this.byKey.get(key).answer;
+
+        const grams = ShikshaSaathiFaq.trigrams(key);
+        let best = null;
+        let bestScore = 0;
+        for (const [candidate, candidateGrams] of this.keyGrams) {
+            let shared = 0;
+            for (const gram of grams) if (candidateGrams.has(gram)) shared++;
+            const score = shared / (grams.size + candidateGrams.size - shared);
+            if (score > bestScore) {
+                best = candidate;
+                bestScore = score;
+            }
+        }
+        return bestScore >= this.threshold ? this.byKey.get(best).answer : null;
+    }
+
+    // Tells the backend a question was answered locally. It saves the
+    // exchange as the first turn of a new session and returns that session's
+    // token (resolves to null on failure). A text/plain body needs no CORS
+    // preflight; keepalive lets it finish if the page is closed.
+    report(question) {
+        const body = new Blob([JSON.stringify({ q: question })], { type: 'text/plain' });
+        return fetch(this.reportUrl, { method: 'POST', body, keepalive: true })
+            .then(response => (response.ok ? response : null))
+            .catch(() => null);
+    }
+}
+
+window.ShikshaSaathiFaq = ShikshaSaathiFaq;
@@ -136,14 +136,13 @@ function renderMarkdown(text) {
     return div.innerHTML;
 }
 
-// Generate session ID
-function generateSessionId() {
-    let sid = sessionStorage.getItem('shiksha_saathi_sid');
-    if (!sid) {
-        sid = 'session_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
-        sessionStorage.setItem('shiksha_saathi_sid', sid);
-    }
-    return sid;
+// Session token issued by the backend with the first answer; kept for the tab
+function getSessionToken() {
+    return sessionStorage.getItem('shiksha_saathi_token');
+}
+
+function storeSessionToken(token) {
+    sessionStorage.setItem('shiksha_saathi_token', token);
 }
 
 // Theme management
@@ -197,7 +196,8 @@ window.ShikshaSaathiUtils = {
     TRANSLATIONS,
     sanitizeHtml,
     renderMarkdown,
-    generateSessionId,
+    getSessionToken,
+    storeSessionToken,
     getStoredTheme,
     setTheme,
     toggleTheme,